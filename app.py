@@ -15,6 +15,19 @@ if str(src_path) not in sys.path:
     sys.path.insert(0, str(src_path))
 
 
+@st.cache_resource
+def upgrade_database(db_path):
+    """Bring a database created by an older version up to the current schema (once per process)"""
+    import sqlite3
+    from database.init_db import upgrade_schema
+
+    conn = sqlite3.connect(db_path)
+    try:
+        upgrade_schema(conn)
+    finally:
+        conn.close()
+
+
 def main():
     """Main application entry point"""
 
@@ -33,9 +46,12 @@ def main():
         st.info("Please ensure your SQLite database is located at: data/analytics.db")
         st.stop()
 
+    upgrade_database(str(db_path))
+
     # Import and render the modern segment builder
     try:
-        from components.modern_segment_builder import render_modern_segment_builder
+        from components.modern_segment_builder import render_modern_segment_builder, start_preview_warmup
+        start_preview_warmup()
         render_modern_segment_builder()
     except ImportError as e:
         st.error(f"❌ Import error: {e}")
@@ -7,6 +7,8 @@ import sqlite3
 import pandas as pd
 from pathlib import Path
 
+from src.database.result_cache import bump_ingest_watermark
+
 def check_database():
     """Check database contents and data formats"""
     db_path = Path("data/analytics.db")
@@ -127,6 +129,7 @@ def fix_data_issues():
         """)
         
         conn.commit()
+        bump_ingest_watermark(conn)
         
         # Verify the update
         new_mobile_count = conn.execute("SELECT COUNT(*) FROM hits WHERE device_type = 'Mobile'").fetchone()[0]
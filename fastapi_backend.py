@@ -4,18 +4,30 @@ Works with existing SQLite database (502K+ records)
 Provides REST API endpoints for the React frontend
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import sqlite3
+import hashlib
 import json
 import uuid
 from datetime import datetime
 from pathlib import Path
 import pandas as pd
 
+from src.database.sketches import estimate_segment_uniques, segment_hit_filter
+from src.database.partitions import apply_date_range, load_partition_catalog
+from src.database.overlap import MAX_OVERLAP_SEGMENTS, membership_sql, overlap_matrix
+from src.database.container_cache import load_members, segment_members
+from src.database.result_cache import cache_key, preview_cache
+from src.database.value_dictionary import lookup_values
+from src.database.stats_snapshot import get_stats_snapshot, load_stats_snapshot, refresh_stats_snapshot_async
+from src.database.init_db import upgrade_schema
+from src.database.warmup import start_warmup
+from src.database.sampling import sample_filter_sql, per_user_totals_sql, summarize_sample
+
 app = FastAPI(
     title="Adobe Analytics Segment Builder API",
     description="Modern API for building and managing segments with existing database",
@@ -31,6 +43,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Previews count matching hits up to this many, to keep big segments fast
+PREVIEW_COUNT_LIMIT = 10000
+
+# Hit columns shown in preview rows
+PREVIEW_HIT_COLUMNS = """h.hit_id, h.user_id, h.session_id, h.timestamp, h.page_url, 
+                   h.device_type, h.browser_name, h.country, h.revenue,
+                   h.products_viewed, h.cart_additions, h.time_on_page"""
+
 
 # Pydantic models
 class Condition(BaseModel):
@@ -83,6 +103,12 @@ class PreviewResponse(BaseModel):
     sample_data: List[Dict[str, Any]]
     sql_query: str
     statistics: Optional[Dict[str, Any]] = None
+    sampling: Optional[Dict[str, Any]] = None
+    estimated: bool = False
+
+
+class OverlapRequest(BaseModel):
+    segment_ids: List[str]
 
 
 # Database connection
@@ -94,6 +120,44 @@ def get_db_connection():
     return sqlite3.connect(str(db_path))
 
 
+# Startup handlers run in registration order: the schema is upgraded before
+# the stats refresh and the warm-up read from it
+@app.on_event("startup")
+async def upgrade_database_on_startup():
+    """Bring a database created by an older version up to the current schema"""
+    try:
+        initialize_segments_table()
+        conn = get_db_connection()
+        upgrade_schema(conn)
+        conn.close()
+        print("✅ Database initialized successfully")
+    except Exception as e:
+        print(f"❌ Database initialization failed: {e}")
+
+
+@app.on_event("startup")
+async def refresh_stats_on_startup():
+    """Bring the stats snapshot up to date without delaying startup"""
+    try:
+        conn = get_db_connection()
+        snapshot = load_stats_snapshot(conn)
+        conn.close()
+        if snapshot is None or snapshot["stale"]:
+            refresh_stats_snapshot_async()
+    except Exception as e:
+        print(f"Could not refresh stats snapshot: {e}")
+
+
+@app.on_event("startup")
+async def warm_saved_segments_on_startup():
+    """Precompute saved segment previews in the background (see src/database/warmup.py)"""
+    start_warmup(build_sql_from_segment, _warm_segment)
+
+
+def _warm_segment(segment: Dict[str, Any]):
+    _cached_preview(SegmentDefinition(**segment['definition']))
+
+
 def initialize_segments_table():
     """Initialize segments table if it doesn't exist"""
     conn = get_db_connection()
@@ -146,50 +210,109 @@ def initialize_segments_table():
     conn.close()
 
 
+# Real dimensions based on your actual database schema
+CONFIG_DIMENSIONS = [
+    {"name": "Page URL", "field": "page_url", "category": "Page", "type": "dimension", "dataType": "string"},
+    {"name": "Page Title", "field": "page_title", "category": "Page", "type": "dimension", "dataType": "string"},
+    {"name": "Page Type", "field": "page_type", "category": "Page", "type": "dimension", "dataType": "string"},
+    {"name": "Device Type", "field": "device_type", "category": "Technology", "type": "dimension",
+     "dataType": "string",
+     "values": ["Desktop", "Mobile", "Tablet"]},
+    {"name": "Browser Name", "field": "browser_name", "category": "Technology", "type": "dimension",
+     "dataType": "string",
+     "values": ["Chrome", "Firefox", "Safari", "Edge", "Other"]},
+    {"name": "Browser Version", "field": "browser_version", "category": "Technology", "type": "dimension",
+     "dataType": "string"},
+    {"name": "Country", "field": "country", "category": "Geography", "type": "dimension", "dataType": "string"},
+    {"name": "City", "field": "city", "category": "Geography", "type": "dimension", "dataType": "string"},
+    {"name": "Traffic Source", "field": "traffic_source", "category": "Marketing", "type": "dimension",
+     "dataType": "string"},
+    {"name": "Traffic Medium", "field": "traffic_medium", "category": "Marketing", "type": "dimension",
+     "dataType": "string"},
+    {"name": "Campaign", "field": "campaign", "category": "Marketing", "type": "dimension", "dataType": "string"},
+]
+
+# Real metrics based on your actual database schema
+CONFIG_METRICS = [
+    {"name": "Revenue", "field": "revenue", "category": "Commerce", "type": "metric", "dataType": "number"},
+    {"name": "Products Viewed", "field": "products_viewed", "category": "Commerce", "type": "metric",
+     "dataType": "number"},
+    {"name": "Cart Additions", "field": "cart_additions", "category": "Commerce", "type": "metric",
+     "dataType": "number"},
+    {"name": "Time on Page", "field": "time_on_page", "category": "Engagement", "type": "metric",
+     "dataType": "number"},
+    {"name": "Bounce", "field": "bounce", "category": "Engagement", "type": "metric", "dataType": "number"},
+    {"name": "Page Views", "field": "COUNT(*)", "category": "Traffic", "type": "metric", "dataType": "number"},
+    {"name": "Unique Visitors", "field": "COUNT(DISTINCT user_id)", "category": "Traffic", "type": "metric",
+     "dataType": "number"},
+    {"name": "Sessions", "field": "COUNT(DISTINCT session_id)", "category": "Traffic", "type": "metric",
+     "dataType": "number"},
+]
+
+
+# Changes whenever the catalog above does; part of the /api/config ETag
+CONFIG_VERSION = hashlib.sha256(
+    json.dumps([app.version, CONFIG_DIMENSIONS, CONFIG_METRICS], sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+# Bumped by writes through this API, so same-second updates still change the ETag
+_segments_generation = 0
+
+# endpoint -> (etag, serialized JSON body)
+_etag_bodies: Dict[str, tuple] = {}
+
+
+def bump_segments_generation():
+    global _segments_generation
+    _segments_generation += 1
+
+
+def segments_fingerprint(conn) -> str:
+    """Cheap summary of the segments table: row count, max rowid and max modified_date"""
+    try:
+        row = conn.execute("SELECT COUNT(*), MAX(rowid), MAX(modified_date) FROM segments").fetchone()
+    except sqlite3.OperationalError:
+        row = (0, None, None)
+    return f"{row[0]}:{row[1]}:{row[2]}:{_segments_generation}"
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def conditional_json(request: Request, name: str, version: str, build) -> Response:
+    """JSON response with an ETag; 304 if the client has it, else the cached or freshly built body"""
+    etag = '"' + hashlib.sha256(f"{name}:{version}".encode("utf-8")).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = _etag_bodies.get(name)
+    if cached is None or cached[0] != etag:
+        cached = (etag, json.dumps(build()))
+        _etag_bodies[name] = cached
+    return Response(content=cached[1], media_type="application/json", headers=headers)
+
+
 # Configuration data based on actual database schema
 @app.get("/api/config")
-async def get_config():
-    """Get dimensions, metrics, and segments configuration based on actual database schema"""
-
-    # Real dimensions based on your actual database schema
-    dimensions = [
-        {"name": "Page URL", "field": "page_url", "category": "Page", "type": "dimension", "dataType": "string"},
-        {"name": "Page Title", "field": "page_title", "category": "Page", "type": "dimension", "dataType": "string"},
-        {"name": "Page Type", "field": "page_type", "category": "Page", "type": "dimension", "dataType": "string"},
-        {"name": "Device Type", "field": "device_type", "category": "Technology", "type": "dimension",
-         "dataType": "string",
-         "values": ["Desktop", "Mobile", "Tablet"]},
-        {"name": "Browser Name", "field": "browser_name", "category": "Technology", "type": "dimension",
-         "dataType": "string",
-         "values": ["Chrome", "Firefox", "Safari", "Edge", "Other"]},
-        {"name": "Browser Version", "field": "browser_version", "category": "Technology", "type": "dimension",
-         "dataType": "string"},
-        {"name": "Country", "field": "country", "category": "Geography", "type": "dimension", "dataType": "string"},
-        {"name": "City", "field": "city", "category": "Geography", "type": "dimension", "dataType": "string"},
-        {"name": "Traffic Source", "field": "traffic_source", "category": "Marketing", "type": "dimension",
-         "dataType": "string"},
-        {"name": "Traffic Medium", "field": "traffic_medium", "category": "Marketing", "type": "dimension",
-         "dataType": "string"},
-        {"name": "Campaign", "field": "campaign", "category": "Marketing", "type": "dimension", "dataType": "string"},
-    ]
-
-    # Real metrics based on your actual database schema
-    metrics = [
-        {"name": "Revenue", "field": "revenue", "category": "Commerce", "type": "metric", "dataType": "number"},
-        {"name": "Products Viewed", "field": "products_viewed", "category": "Commerce", "type": "metric",
-         "dataType": "number"},
-        {"name": "Cart Additions", "field": "cart_additions", "category": "Commerce", "type": "metric",
-         "dataType": "number"},
-        {"name": "Time on Page", "field": "time_on_page", "category": "Engagement", "type": "metric",
-         "dataType": "number"},
-        {"name": "Bounce", "field": "bounce", "category": "Engagement", "type": "metric", "dataType": "number"},
-        {"name": "Page Views", "field": "COUNT(*)", "category": "Traffic", "type": "metric", "dataType": "number"},
-        {"name": "Unique Visitors", "field": "COUNT(DISTINCT user_id)", "category": "Traffic", "type": "metric",
-         "dataType": "number"},
-        {"name": "Sessions", "field": "COUNT(DISTINCT session_id)", "category": "Traffic", "type": "metric",
-         "dataType": "number"},
-    ]
+async def get_config(request: Request):
+    """Get dimensions, metrics, and segments configuration based on actual database schema
+
+    Served with an ETag over the config version and the segments table, so
+    polling clients get 304s until something changes.
+    """
+    conn = get_db_connection()
+    version = f"{CONFIG_VERSION}:{segments_fingerprint(conn)}"
+    conn.close()
+    return conditional_json(request, "config", version, _build_config)
 
+
+def _build_config() -> Dict[str, Any]:
     # Get saved segments from database
     saved_segments = []
     try:
@@ -220,15 +343,15 @@ async def get_config():
 
     return {
         "dimensions": [
-            {"category": "Page", "items": [d for d in dimensions if d["category"] == "Page"]},
-            {"category": "Technology", "items": [d for d in dimensions if d["category"] == "Technology"]},
-            {"category": "Geography", "items": [d for d in dimensions if d["category"] == "Geography"]},
-            {"category": "Marketing", "items": [d for d in dimensions if d["category"] == "Marketing"]}
+            {"category": "Page", "items": [d for d in CONFIG_DIMENSIONS if d["category"] == "Page"]},
+            {"category": "Technology", "items": [d for d in CONFIG_DIMENSIONS if d["category"] == "Technology"]},
+            {"category": "Geography", "items": [d for d in CONFIG_DIMENSIONS if d["category"] == "Geography"]},
+            {"category": "Marketing", "items": [d for d in CONFIG_DIMENSIONS if d["category"] == "Marketing"]}
         ],
         "metrics": [
-            {"category": "Commerce", "items": [m for m in metrics if m["category"] == "Commerce"]},
-            {"category": "Engagement", "items": [m for m in metrics if m["category"] == "Engagement"]},
-            {"category": "Traffic", "items": [m for m in metrics if m["category"] == "Traffic"]}
+            {"category": "Commerce", "items": [m for m in CONFIG_METRICS if m["category"] == "Commerce"]},
+            {"category": "Engagement", "items": [m for m in CONFIG_METRICS if m["category"] == "Engagement"]},
+            {"category": "Traffic", "items": [m for m in CONFIG_METRICS if m["category"] == "Traffic"]}
         ],
         "segments": saved_segments
     }
@@ -291,6 +414,7 @@ async def save_segment(request: SaveSegmentRequest) -> Dict[str, Any]:
 
         conn.commit()
         conn.close()
+        bump_segments_generation()
 
         return {"success": True, "segment_id": segment_id, "message": "Segment saved successfully"}
 
@@ -299,8 +423,15 @@ async def save_segment(request: SaveSegmentRequest) -> Dict[str, Any]:
 
 
 @app.get("/api/segments", response_model=List[SegmentResponse])
-async def get_segments():
-    """Get all saved segments"""
+async def get_segments(request: Request):
+    """Get all saved segments (ETag-validated, body cached until the segments table changes)"""
+    conn = get_db_connection()
+    version = segments_fingerprint(conn)
+    conn.close()
+    return conditional_json(request, "segments", version, _load_segments)
+
+
+def _load_segments() -> List[Dict[str, Any]]:
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -339,7 +470,7 @@ async def get_segments():
                 created_by=row[7] or "User",
                 usage_count=row[8] or 0,
                 tags=json.loads(row[9]) if row[9] else []
-            ))
+            ).dict())
 
         conn.close()
         return segments
@@ -409,6 +540,7 @@ async def delete_segment(segment_id: str):
 
         conn.commit()
         conn.close()
+        bump_segments_generation()
 
         return {"success": True, "message": "Segment deleted successfully"}
 
@@ -419,25 +551,126 @@ async def delete_segment(segment_id: str):
 
 
 @app.post("/api/segments/preview")
-async def preview_segment(request: SaveSegmentRequest) -> PreviewResponse:
-    """Preview a segment and get estimated results using actual database"""
+async def preview_segment(request: SaveSegmentRequest, estimate: bool = False,
+                          sample_rate: Optional[float] = None, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None) -> PreviewResponse:
+    """Preview a segment and get estimated results using actual database
+
+    With estimate=true, simple hit-level segments are answered from the
+    precomputed HyperLogLog sketches without evaluating the segment: unique
+    users of the whole segment are estimated (with error bounds), matching
+    hits are extrapolated from them and capped at 10000 like the exact
+    preview, and the sample rows are the newest hits matching the conditions.
+    Other segments are previewed exactly; estimated tells which happened.
+    With sample_rate (e.g. 0.01 or 0.1), the segment is evaluated over a
+    deterministic user sample and counts are scaled up with 95% intervals
+    (in sampling); estimated_count and total_hits stay capped at 10000.
+    start_date/end_date (YYYY-MM-DD, inclusive) restrict the preview to a
+    date range, reading only the monthly hit partitions that overlap it.
+    """
+    if sample_rate is not None and not 0 < sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be in (0, 1]")
+    if bool(start_date) != bool(end_date):
+        raise HTTPException(status_code=400, detail="start_date and end_date must be given together")
+
+    return PreviewResponse(**_cached_preview(request.segment, estimate, sample_rate, start_date, end_date))
+
+
+def _cached_preview(segment: SegmentDefinition, estimate: bool = False, sample_rate: Optional[float] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+    """Preview as a dict, served from the result cache until the database changes
+
+    See src/database/result_cache.py.
+    """
+    key = cache_key("api_preview", segment.dict(), estimate=estimate, sample_rate=sample_rate,
+                    start_date=start_date, end_date=end_date, limit=100)
+    return preview_cache.get_or_compute(
+        key, lambda: _compute_preview(segment, estimate, sample_rate, start_date, end_date).dict()
+    )
+
+
+def _population_totals(conn) -> tuple:
+    """(users, hits) in the database, from the stats snapshot when there is one"""
+    snapshot = load_stats_snapshot(conn)
+    if snapshot is not None:
+        return snapshot["total_users"], snapshot["total_hits"]
+    return (conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM hits").fetchone()[0])
+
+
+def _compute_preview(segment: SegmentDefinition, estimate: bool, sample_rate: Optional[float],
+                     start_date: Optional[str], end_date: Optional[str]) -> PreviewResponse:
+    """Run a segment preview against the database"""
     try:
-        segment = request.segment
-
         # Build SQL query
-        sql_query = build_sql_from_segment(segment.dict())
+        segment_definition = segment.dict()
+        sql_query = build_sql_from_segment(segment_definition, sample_rate=sample_rate)
 
         # Execute preview query with limit
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        # Get count estimate (limit to prevent long queries)
-        count_query = f"SELECT COUNT(*) FROM ({sql_query} LIMIT 10000) as segment_result"
-        cursor.execute(count_query)
-        estimated_count = cursor.fetchone()[0]
+        date_range, catalog = None, None
+        if start_date:
+            date_range = (start_date, end_date)
+            catalog = load_partition_catalog(conn, skip_empty_default=True)
+            sql_query = apply_date_range(sql_query, date_range, catalog)
+
+        # Sampled previews are estimates already
+        if estimate and not sample_rate:
+            total_users, total_hits = _population_totals(conn)
+            sketch_stats = estimate_segment_uniques(conn, segment_definition, start_date, end_date, total_users)
+            if sketch_stats is not None:
+                # Same unit as the exact path (matching hits, capped), from the
+                # users the segment selects times their average hit count
+                hits_per_user = total_hits / total_users if total_users else 0
+                hit_count = min(PREVIEW_COUNT_LIMIT, int(round(sketch_stats['unique_users'] * hits_per_user)))
+
+                where_sql, params = segment_hit_filter(segment_definition)
+                sample_query = f"SELECT {PREVIEW_HIT_COLUMNS} FROM hits h WHERE {where_sql} ORDER BY h.timestamp DESC LIMIT 100"
+                if date_range:
+                    sample_query = apply_date_range(sample_query, date_range, catalog)
+                cursor.execute(sample_query, params)
+                columns = [description[0] for description in cursor.description]
+                sample_data = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                conn.close()
+
+                return PreviewResponse(
+                    estimated_count=hit_count,
+                    sample_data=sample_data,
+                    sql_query=sql_query,
+                    statistics=dict(
+                        sketch_stats,
+                        total_hits=hit_count,
+                        total_hits_method='unique users x average hits per user',
+                        # unique_users covers the whole segment, not the capped hits
+                        population_wide=['unique_users']
+                    ),
+                    estimated=True
+                )
+
+        # Only containers changed since the last preview are re-queried; the
+        # cached member sets are combined and matched against hits directly
+        members = segment_members(conn, segment_definition, build_container_sql, sample_rate, date_range, catalog)
+        hits_sql = sql_query
+        if members is not None:
+            hits_sql = apply_date_range(segment_hits_sql(load_members(conn, members), sample_rate), date_range, catalog)
+
+        sampling = None
+        if sample_rate:
+            # The sample is small enough to aggregate completely, then scale up
+            cursor.execute(per_user_totals_sql(hits_sql))
+            sampling = summarize_sample(cursor.fetchone(), sample_rate, _population_totals(conn)[0])
+            # Same unit as the exact path: matching hits, capped
+            estimated_count = min(PREVIEW_COUNT_LIMIT, sampling["total_hits"]["estimate"])
+        else:
+            # Get count estimate (limit to prevent long queries)
+            count_query = f"SELECT COUNT(*) FROM ({hits_sql} LIMIT {PREVIEW_COUNT_LIMIT}) as segment_result"
+            cursor.execute(count_query)
+            estimated_count = cursor.fetchone()[0]
 
         # Get sample data with relevant fields from actual schema
-        sample_query = f"{sql_query} LIMIT 100"
+        sample_query = f"{hits_sql} LIMIT 100"
         cursor.execute(sample_query)
 
         columns = [description[0] for description in cursor.description]
@@ -445,31 +678,52 @@ async def preview_segment(request: SaveSegmentRequest) -> PreviewResponse:
         for row in cursor.fetchall():
             sample_data.append(dict(zip(columns, row)))
 
-        # Get some statistics about the segment
-        stats_query = f"""
-        SELECT 
-            COUNT(DISTINCT user_id) as unique_users,
-            COUNT(DISTINCT session_id) as unique_sessions,
-            COUNT(*) as total_hits,
-            SUM(revenue) as total_revenue,
-            AVG(revenue) as avg_revenue,
-            COUNT(DISTINCT device_type) as device_types,
-            COUNT(DISTINCT browser_name) as browsers
-        FROM ({sql_query} LIMIT 10000) as segment_result
-        """
-
-        cursor.execute(stats_query)
-        stats_row = cursor.fetchone()
-
-        statistics = {
-            "unique_users": stats_row[0] if stats_row[0] else 0,
-            "unique_sessions": stats_row[1] if stats_row[1] else 0,
-            "total_hits": stats_row[2] if stats_row[2] else 0,
-            "total_revenue": float(stats_row[3]) if stats_row[3] else 0.0,
-            "avg_revenue": float(stats_row[4]) if stats_row[4] else 0.0,
-            "device_types": stats_row[5] if stats_row[5] else 0,
-            "browsers": stats_row[6] if stats_row[6] else 0
-        }
+        if sampling:
+            # Over the whole sample, scaled like the sampling estimates (the
+            # uncapped hit total is in sampling); the distinct category counts
+            # are what the sample shows
+            cursor.execute(f"""
+            SELECT SUM(revenue), AVG(revenue), COUNT(DISTINCT device_type), COUNT(DISTINCT browser_name)
+            FROM ({hits_sql}) as segment_result
+            """)
+            stats_row = cursor.fetchone()
+            statistics = {
+                "unique_users": sampling["unique_users"]["estimate"],
+                "unique_sessions": sampling["unique_sessions"]["estimate"],
+                "total_hits": estimated_count,
+                "total_revenue": float(stats_row[0]) / sampling["rate"] if stats_row[0] else 0.0,
+                "avg_revenue": float(stats_row[1]) if stats_row[1] else 0.0,
+                "device_types": stats_row[2] if stats_row[2] else 0,
+                "browsers": stats_row[3] if stats_row[3] else 0,
+                "population_wide": ["unique_users", "unique_sessions", "total_revenue", "avg_revenue"],
+                "sample_only": ["device_types", "browsers"]
+            }
+        else:
+            # Get some statistics about the segment
+            stats_query = f"""
+            SELECT 
+                COUNT(DISTINCT user_id) as unique_users,
+                COUNT(DISTINCT session_id) as unique_sessions,
+                COUNT(*) as total_hits,
+                SUM(revenue) as total_revenue,
+                AVG(revenue) as avg_revenue,
+                COUNT(DISTINCT device_type) as device_types,
+                COUNT(DISTINCT browser_name) as browsers
+            FROM ({hits_sql} LIMIT {PREVIEW_COUNT_LIMIT}) as segment_result
+            """
+
+            cursor.execute(stats_query)
+            stats_row = cursor.fetchone()
+
+            statistics = {
+                "unique_users": stats_row[0] if stats_row[0] else 0,
+                "unique_sessions": stats_row[1] if stats_row[1] else 0,
+                "total_hits": stats_row[2] if stats_row[2] else 0,
+                "total_revenue": float(stats_row[3]) if stats_row[3] else 0.0,
+                "avg_revenue": float(stats_row[4]) if stats_row[4] else 0.0,
+                "device_types": stats_row[5] if stats_row[5] else 0,
+                "browsers": stats_row[6] if stats_row[6] else 0
+            }
 
         conn.close()
 
@@ -477,93 +731,88 @@ async def preview_segment(request: SaveSegmentRequest) -> PreviewResponse:
             estimated_count=estimated_count,
             sample_data=sample_data,
             sql_query=sql_query,
-            statistics=statistics
+            statistics=statistics,
+            sampling=sampling,
+            estimated=sampling is not None
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error previewing segment: {str(e)}")
 
 
-@app.get("/api/database/stats")
-async def get_database_stats():
-    """Get database statistics for the UI"""
+@app.post("/api/segments/overlap")
+async def segment_overlap(request: OverlapRequest, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None):
+    """Pairwise overlap (shared visitors, sessions, hits) of saved segments
+
+    Each segment is evaluated once into membership bitmaps and every pair is
+    intersected in memory (see src/database/overlap.py).
+    """
+    segment_ids = list(dict.fromkeys(request.segment_ids))
+    if not 2 <= len(segment_ids) <= MAX_OVERLAP_SEGMENTS:
+        raise HTTPException(status_code=400,
+                            detail=f"Select between 2 and {MAX_OVERLAP_SEGMENTS} segments to compare")
+    if bool(start_date) != bool(end_date):
+        raise HTTPException(status_code=400, detail="start_date and end_date must be given together")
+
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get total counts
-        cursor.execute("SELECT COUNT(*) FROM hits")
-        total_hits = cursor.fetchone()[0]
+        placeholders = ", ".join("?" for _ in segment_ids)
+        rows = conn.execute(
+            f"SELECT segment_id, name, definition FROM segments WHERE segment_id IN ({placeholders})",
+            segment_ids
+        ).fetchall()
+        found = {row[0]: row for row in rows}
+        missing = [segment_id for segment_id in segment_ids if segment_id not in found]
+        if missing:
+            conn.close()
+            raise HTTPException(status_code=404, detail=f"Segments not found: {', '.join(missing)}")
 
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM hits")
-        total_users = cursor.fetchone()[0]
+        catalog = load_partition_catalog(conn, skip_empty_default=True) if start_date else None
+        segments = []
+        for segment_id in segment_ids:
+            _, name, definition = found[segment_id]
+            sql_query = build_sql_from_segment(json.loads(definition) if definition else {})
+            if start_date:
+                sql_query = apply_date_range(sql_query, (start_date, end_date), catalog)
+            segments.append((name, membership_sql(sql_query)))
+
+        result = overlap_matrix(conn, segments)
+        conn.close()
 
-        cursor.execute("SELECT COUNT(DISTINCT session_id) FROM hits")
-        total_sessions = cursor.fetchone()[0]
+        result["segment_ids"] = segment_ids
+        return result
 
-        # Get device type breakdown
-        cursor.execute("""
-                       SELECT device_type, COUNT(*) as count
-                       FROM hits
-                       GROUP BY device_type
-                       ORDER BY count DESC
-                       """)
-        device_breakdown = [{"device_type": row[0], "count": row[1]} for row in cursor.fetchall()]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing segment overlap: {str(e)}")
 
-        # Get browser breakdown
-        cursor.execute("""
-                       SELECT browser_name, COUNT(*) as count
-                       FROM hits
-                       GROUP BY browser_name
-                       ORDER BY count DESC
-                           LIMIT 10
-                       """)
-        browser_breakdown = [{"browser_name": row[0], "count": row[1]} for row in cursor.fetchall()]
 
-        # Get top countries
-        cursor.execute("""
-                       SELECT country, COUNT(*) as count
-                       FROM hits
-                       WHERE country IS NOT NULL AND country != ''
-                       GROUP BY country
-                       ORDER BY count DESC
-                           LIMIT 10
-                       """)
-        country_breakdown = [{"country": row[0], "count": row[1]} for row in cursor.fetchall()]
-
-        # Get revenue statistics
-        cursor.execute("""
-                       SELECT SUM(revenue)                            as total_revenue,
-                              AVG(revenue)                            as avg_revenue,
-                              COUNT(CASE WHEN revenue > 0 THEN 1 END) as revenue_hits
-                       FROM hits
-                       """)
-        revenue_row = cursor.fetchone()
-        revenue_stats = {
-            "total_revenue": float(revenue_row[0]) if revenue_row[0] else 0.0,
-            "avg_revenue": float(revenue_row[1]) if revenue_row[1] else 0.0,
-            "revenue_hits": revenue_row[2] if revenue_row[2] else 0
-        }
+@app.get("/api/database/stats")
+async def get_database_stats():
+    """Get database statistics for the UI
 
+    Served from the precomputed stats snapshot; computed_at tells how fresh it
+    is and a stale snapshot is refreshed in the background.
+    """
+    try:
+        conn = get_db_connection()
+        snapshot = get_stats_snapshot(conn)
         conn.close()
-
-        return {
-            "total_hits": total_hits,
-            "total_users": total_users,
-            "total_sessions": total_sessions,
-            "device_breakdown": device_breakdown,
-            "browser_breakdown": browser_breakdown,
-            "country_breakdown": country_breakdown,
-            "revenue_stats": revenue_stats
-        }
+        return snapshot
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting database stats: {str(e)}")
 
 
 @app.get("/api/fields/{field_name}/values")
-async def get_field_values(field_name: str, limit: int = 50):
-    """Get unique values for a specific field"""
+async def get_field_values(field_name: str, limit: int = 50, prefix: Optional[str] = None):
+    """Get unique values for a specific field
+
+    Served from the precomputed value dictionary when it has been built;
+    prefix narrows the values for autocomplete (case-insensitive).
+    """
     try:
         # Validate field name to prevent SQL injection
         valid_fields = [
@@ -577,156 +826,188 @@ async def get_field_values(field_name: str, limit: int = 50):
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        query = f"""
-            SELECT {field_name}, COUNT(*) as count 
-            FROM hits 
-            WHERE {field_name} IS NOT NULL AND {field_name} != ''
-            GROUP BY {field_name} 
-            ORDER BY count DESC
-            LIMIT ?
-        """
-
-        cursor.execute(query, (limit,))
-        values = [{"value": row[0], "count": row[1]} for row in cursor.fetchall()]
+        rows = lookup_values(conn, field_name, prefix, limit)
+        if rows is None:
+            query = f"""
+                SELECT {field_name}, COUNT(*) as count 
+                FROM hits 
+                WHERE {field_name} IS NOT NULL AND {field_name} != ''
+                  AND (? IS NULL OR {field_name} LIKE ? || '%')
+                GROUP BY {field_name} 
+                ORDER BY count DESC
+                LIMIT ?
+            """
+            cursor.execute(query, (prefix, prefix, limit))
+            rows = cursor.fetchall()
+        values = [{"value": row[0], "count": row[1]} for row in rows]
 
         conn.close()
 
         return {"field": field_name, "values": values}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting field values: {str(e)}")
 
 
-def build_sql_from_segment(segment_definition: Dict[str, Any]) -> str:
-    """Build SQL query from segment definition using actual database schema"""
+def build_container_sql(container: Dict[str, Any], sample_rate: Optional[float] = None) -> Optional[str]:
+    """Query selecting the user_key of every user matched by one container
+
+    Returns None when the container has no usable conditions.
+    """
+    sample_sql = f"{sample_filter_sql(sample_rate)} AND " if sample_rate else ""
+    container_type = container.get('type', 'hit')
+    include = container.get('include', True)
+    conditions = container.get('conditions', [])
+    logic = container.get('logic', 'and').upper()
+
+    if not conditions:
+        return None
+
+    # Build conditions
+    condition_clauses = []
+    for condition in conditions:
+        field = condition.get('field', '')
+        operator = condition.get('operator', 'equals')
+        value = condition.get('value', '')
+        data_type = condition.get('dataType', 'string')
+
+        if not field or value == '':
+            continue
+
+        # Handle special metric fields (aggregations)
+        if field in ['COUNT(*)', 'COUNT(DISTINCT user_id)', 'COUNT(DISTINCT session_id)']:
+            # Skip aggregations in WHERE clause, handle separately
+            continue
+
+        # Build condition based on operator
+        if operator == 'equals':
+            if data_type == 'string':
+                clause = f"{field} = '{value}'"
+            else:
+                clause = f"{field} = {value}"
+        elif operator == 'does not equal':
+            if data_type == 'string':
+                clause = f"{field} != '{value}'"
+            else:
+                clause = f"{field} != {value}"
+        elif operator == 'contains':
+            clause = f"{field} LIKE '%{value}%'"
+        elif operator == 'does not contain':
+            clause = f"{field} NOT LIKE '%{value}%'"
+        elif operator == 'starts with':
+            clause = f"{field} LIKE '{value}%'"
+        elif operator == 'ends with':
+            clause = f"{field} LIKE '%{value}'"
+        elif operator == 'is greater than':
+            clause = f"{field} > {value}"
+        elif operator == 'is less than':
+            clause = f"{field} < {value}"
+        elif operator == 'is greater than or equal to':
+            clause = f"{field} >= {value}"
+        elif operator == 'is less than or equal to':
+            clause = f"{field} <= {value}"
+        elif operator == 'is between':
+            # For between, expect value as "min,max"
+            if ',' in str(value):
+                min_val, max_val = str(value).split(',', 1)
+                clause = f"{field} BETWEEN {min_val.strip()} AND {max_val.strip()}"
+            else:
+                clause = f"{field} = {value}"
+        elif operator == 'exists':
+            clause = f"{field} IS NOT NULL AND {field} != ''"
+        elif operator == 'does not exist':
+            clause = f"({field} IS NULL OR {field} = '')"
+        else:
+            # Default to equals
+            if data_type == 'string':
+                clause = f"{field} = '{value}'"
+            else:
+                clause = f"{field} = {value}"
+
+        condition_clauses.append(clause)
+
+    if condition_clauses:
+        conditions_sql = f" {logic} ".join(condition_clauses)
+
+        # Build container query based on type using actual database schema
+        if container_type == 'hit':
+            # Hit-level query using hits table
+            if include:
+                container_query = f"SELECT DISTINCT user_key FROM hits WHERE {sample_sql}({conditions_sql})"
+            else:
+                container_query = f"SELECT DISTINCT user_key FROM hits WHERE {sample_sql}NOT ({conditions_sql})"
+        elif container_type == 'visit':
+            # Visit-level query using sessions table joined with hits
+            if include:
+                container_query = f"""
+                SELECT DISTINCT h.user_key 
+                FROM hits h 
+                INNER JOIN sessions s ON h.session_key = s.session_key 
+                WHERE {sample_sql}({conditions_sql})
+                """
+            else:
+                container_query = f"""
+                SELECT DISTINCT h.user_key 
+                FROM hits h 
+                INNER JOIN sessions s ON h.session_key = s.session_key 
+                WHERE {sample_sql}NOT ({conditions_sql})
+                """
+        elif container_type == 'visitor':
+            # Visitor-level query using users table joined with hits
+            if include:
+                container_query = f"""
+                SELECT DISTINCT h.user_key 
+                FROM hits h 
+                INNER JOIN users u ON h.user_key = u.user_key 
+                WHERE {sample_sql}({conditions_sql})
+                """
+            else:
+                container_query = f"""
+                SELECT DISTINCT h.user_key 
+                FROM hits h 
+                INNER JOIN users u ON h.user_key = u.user_key 
+                WHERE {sample_sql}NOT ({conditions_sql})
+                """
+        else:
+            # Default to hit-level
+            if include:
+                container_query = f"SELECT DISTINCT user_key FROM hits WHERE {sample_sql}({conditions_sql})"
+            else:
+                container_query = f"SELECT DISTINCT user_key FROM hits WHERE {sample_sql}NOT ({conditions_sql})"
+
+        return container_query
+
+    return None
+
+
+def segment_hits_sql(members_sql: str, sample_rate: Optional[float] = None) -> str:
+    """Hits of the users selected by members_sql, newest first"""
+    outer_sample_sql = f" AND {sample_filter_sql(sample_rate, 'h')}" if sample_rate else ""
+    return f"""
+            SELECT {PREVIEW_HIT_COLUMNS}
+            FROM hits h 
+            WHERE h.user_key IN ({members_sql}){outer_sample_sql}
+            ORDER BY h.timestamp DESC
+            """
+
+
+def build_sql_from_segment(segment_definition: Dict[str, Any], sample_rate: Optional[float] = None) -> str:
+    """Build SQL query from segment definition using actual database schema
+
+    With sample_rate, every container and the final hit selection are
+    restricted to the deterministic user sample (see src/database/sampling.py).
+    """
     try:
         containers = segment_definition.get('containers', [])
         if not containers:
             return "SELECT * FROM hits LIMIT 0"
 
         container_queries = []
-
         for container in containers:
-            container_type = container.get('type', 'hit')
-            include = container.get('include', True)
-            conditions = container.get('conditions', [])
-            logic = container.get('logic', 'and').upper()
-
-            if not conditions:
-                continue
-
-            # Build conditions
-            condition_clauses = []
-            for condition in conditions:
-                field = condition.get('field', '')
-                operator = condition.get('operator', 'equals')
-                value = condition.get('value', '')
-                data_type = condition.get('dataType', 'string')
-
-                if not field or value == '':
-                    continue
-
-                # Handle special metric fields (aggregations)
-                if field in ['COUNT(*)', 'COUNT(DISTINCT user_id)', 'COUNT(DISTINCT session_id)']:
-                    # Skip aggregations in WHERE clause, handle separately
-                    continue
-
-                # Build condition based on operator
-                if operator == 'equals':
-                    if data_type == 'string':
-                        clause = f"{field} = '{value}'"
-                    else:
-                        clause = f"{field} = {value}"
-                elif operator == 'does not equal':
-                    if data_type == 'string':
-                        clause = f"{field} != '{value}'"
-                    else:
-                        clause = f"{field} != {value}"
-                elif operator == 'contains':
-                    clause = f"{field} LIKE '%{value}%'"
-                elif operator == 'does not contain':
-                    clause = f"{field} NOT LIKE '%{value}%'"
-                elif operator == 'starts with':
-                    clause = f"{field} LIKE '{value}%'"
-                elif operator == 'ends with':
-                    clause = f"{field} LIKE '%{value}'"
-                elif operator == 'is greater than':
-                    clause = f"{field} > {value}"
-                elif operator == 'is less than':
-                    clause = f"{field} < {value}"
-                elif operator == 'is greater than or equal to':
-                    clause = f"{field} >= {value}"
-                elif operator == 'is less than or equal to':
-                    clause = f"{field} <= {value}"
-                elif operator == 'is between':
-                    # For between, expect value as "min,max"
-                    if ',' in str(value):
-                        min_val, max_val = str(value).split(',', 1)
-                        clause = f"{field} BETWEEN {min_val.strip()} AND {max_val.strip()}"
-                    else:
-                        clause = f"{field} = {value}"
-                elif operator == 'exists':
-                    clause = f"{field} IS NOT NULL AND {field} != ''"
-                elif operator == 'does not exist':
-                    clause = f"({field} IS NULL OR {field} = '')"
-                else:
-                    # Default to equals
-                    if data_type == 'string':
-                        clause = f"{field} = '{value}'"
-                    else:
-                        clause = f"{field} = {value}"
-
-                condition_clauses.append(clause)
-
-            if condition_clauses:
-                conditions_sql = f" {logic} ".join(condition_clauses)
-
-                # Build container query based on type using actual database schema
-                if container_type == 'hit':
-                    # Hit-level query using hits table
-                    if include:
-                        container_query = f"SELECT DISTINCT user_id FROM hits WHERE {conditions_sql}"
-                    else:
-                        container_query = f"SELECT DISTINCT user_id FROM hits WHERE NOT ({conditions_sql})"
-                elif container_type == 'visit':
-                    # Visit-level query using sessions table joined with hits
-                    if include:
-                        container_query = f"""
-                        SELECT DISTINCT h.user_id 
-                        FROM hits h 
-                        INNER JOIN sessions s ON h.session_id = s.session_id 
-                        WHERE {conditions_sql}
-                        """
-                    else:
-                        container_query = f"""
-                        SELECT DISTINCT h.user_id 
-                        FROM hits h 
-                        INNER JOIN sessions s ON h.session_id = s.session_id 
-                        WHERE NOT ({conditions_sql})
-                        """
-                elif container_type == 'visitor':
-                    # Visitor-level query using users table joined with hits
-                    if include:
-                        container_query = f"""
-                        SELECT DISTINCT h.user_id 
-                        FROM hits h 
-                        INNER JOIN users u ON h.user_id = u.user_id 
-                        WHERE {conditions_sql}
-                        """
-                    else:
-                        container_query = f"""
-                        SELECT DISTINCT h.user_id 
-                        FROM hits h 
-                        INNER JOIN users u ON h.user_id = u.user_id 
-                        WHERE NOT ({conditions_sql})
-                        """
-                else:
-                    # Default to hit-level
-                    if include:
-                        container_query = f"SELECT DISTINCT user_id FROM hits WHERE {conditions_sql}"
-                    else:
-                        container_query = f"SELECT DISTINCT user_id FROM hits WHERE NOT ({conditions_sql})"
-
+            container_query = build_container_sql(container, sample_rate)
+            if container_query:
                 container_queries.append(container_query)
 
         if not container_queries:
@@ -736,39 +1017,12 @@ def build_sql_from_segment(segment_definition: Dict[str, Any]) -> str:
         segment_logic = segment_definition.get('logic', 'and').upper()
 
         if len(container_queries) == 1:
-            final_query = f"""
-            SELECT h.hit_id, h.user_id, h.session_id, h.timestamp, h.page_url, 
-                   h.device_type, h.browser_name, h.country, h.revenue,
-                   h.products_viewed, h.cart_additions, h.time_on_page
-            FROM hits h 
-            WHERE h.user_id IN ({container_queries[0]})
-            ORDER BY h.timestamp DESC
-            """
-        else:
-            if segment_logic == 'AND':
-                # Users must be in all containers
-                intersect_query = " INTERSECT ".join(container_queries)
-                final_query = f"""
-                SELECT h.hit_id, h.user_id, h.session_id, h.timestamp, h.page_url, 
-                       h.device_type, h.browser_name, h.country, h.revenue,
-                       h.products_viewed, h.cart_additions, h.time_on_page
-                FROM hits h 
-                WHERE h.user_id IN ({intersect_query})
-                ORDER BY h.timestamp DESC
-                """
-            else:  # OR
-                # Users can be in any container
-                union_query = " UNION ".join(container_queries)
-                final_query = f"""
-                SELECT h.hit_id, h.user_id, h.session_id, h.timestamp, h.page_url, 
-                       h.device_type, h.browser_name, h.country, h.revenue,
-                       h.products_viewed, h.cart_additions, h.time_on_page
-                FROM hits h 
-                WHERE h.user_id IN ({union_query})
-                ORDER BY h.timestamp DESC
-                """
-
-        return final_query
+            return segment_hits_sql(container_queries[0], sample_rate)
+        if segment_logic == 'AND':
+            # Users must be in all containers
+            return segment_hits_sql(" INTERSECT ".join(container_queries), sample_rate)
+        # OR: users can be in any container
+        return segment_hits_sql(" UNION ".join(container_queries), sample_rate)
 
     except Exception as e:
         print(f"Error building SQL: {e}")
@@ -800,13 +1054,7 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
 
-    # Initialize database on startup
-    try:
-        initialize_segments_table()
-        print("✅ Database initialized successfully")
-    except Exception as e:
-        print(f"❌ Database initialization failed: {e}")
-
+    # The database is upgraded by the startup handlers, also under other ASGI servers
     print("🚀 Starting Adobe Analytics Segment Builder API...")
     print("📊 Working with existing SQLite database at data/analytics.db")
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
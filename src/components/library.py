@@ -3,7 +3,12 @@ import json
 import os
 from datetime import datetime
 import pandas as pd
-from src.database.queries import load_saved_segments
+from src.database.queries import get_db_connection, load_saved_segments
+from src.database.canonical import segment_hash
+from src.database.overlap import MAX_OVERLAP_SEGMENTS, overlap_matrix
+from src.database.segment_sizes import load_segment_sizes, refresh_segment_sizes
+from src.utils.query_builder import build_membership_sql
+from src.utils.streamlit_cache import cached_query, clear_data_cache, database_version
 
 def render_library():
     """Render the segment library interface"""
@@ -288,12 +293,12 @@ def render_library():
     with col3:
         sort_by = st.selectbox(
             "Sort by",
-            options=["Name", "Created Date", "Modified Date", "Usage"],
+            options=["Name", "Created Date", "Modified Date", "Usage", "Size"],
             key="library_sort"
         )
     
     # Action buttons
-    col1, col2, col3 = st.columns([1, 1, 4])
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 3])
     
     with col1:
         if st.button("📥 Import Segment", key="import_segment_btn"):
@@ -303,14 +308,63 @@ def render_library():
         if st.button("🔄 Refresh", key="refresh_library_btn"):
             st.rerun()
     
+    with col3:
+        if st.button("🔢 Update Sizes", key="refresh_sizes_btn", help="Count visitors, sessions and hits of segments whose size is missing or out of date"):
+            update_segment_sizes()
+    
+    # Pairwise overlap of selected segments
+    render_overlap_comparison()
+    
     # Get and display segments
     render_segment_grid(search_term, filter_type, sort_by)
 
+def render_overlap_comparison():
+    """Compare saved segments with a pairwise overlap matrix"""
+    
+    with st.expander("🔀 Compare Segments", expanded=False):
+        segments_by_name = {}
+        for segment in get_saved_segments():
+            definition = segment.get('definition', segment)
+            if isinstance(definition, dict) and definition.get('containers'):
+                segments_by_name.setdefault(segment.get('name', 'Unnamed Segment'), definition)
+        
+        selected = st.multiselect(
+            "Segments to compare",
+            options=list(segments_by_name),
+            max_selections=MAX_OVERLAP_SEGMENTS,
+            key="library_overlap_segments"
+        )
+        level = st.radio(
+            "Overlap of",
+            options=["Visitors", "Sessions", "Hits"],
+            horizontal=True,
+            key="library_overlap_level"
+        )
+        
+        if st.button("Compute Overlap", key="library_overlap_btn", disabled=len(selected) < 2):
+            # Each segment is evaluated once; pairs are intersected in memory
+            conn = get_db_connection()
+            try:
+                st.session_state.library_overlap = overlap_matrix(
+                    conn, [(name, build_membership_sql(segments_by_name[name])) for name in selected]
+                )
+            except Exception as e:
+                st.error(f"Could not compute overlap: {str(e)}")
+            finally:
+                conn.close()
+        
+        result = st.session_state.get('library_overlap')
+        if result:
+            matrix = pd.DataFrame(result[level.lower()], index=result['segments'], columns=result['segments'])
+            st.dataframe(matrix, use_container_width=True)
+            st.caption(f"Diagonal: {level.lower()} in each segment. Other cells: {level.lower()} shared by the row and column segments.")
+
 def render_segment_grid(search_term, filter_type, sort_by):
     """Render the grid of saved segments"""
     
-    # Get saved segments
+    # Get saved segments and their materialized sizes (one query, cached per data version)
     saved_segments = get_saved_segments()
+    sizes = cached_query("segment_sizes", database_version(), load_segment_sizes)
     
     # Filter segments
     filtered_segments = []
@@ -342,6 +396,8 @@ def render_segment_grid(search_term, filter_type, sort_by):
         filtered_segments.sort(key=lambda x: x.get('modified_date', x.get('created_date', '')), reverse=True)
     elif sort_by == "Usage":
         filtered_segments.sort(key=lambda x: x.get('usage_count', 0), reverse=True)
+    elif sort_by == "Size":
+        filtered_segments.sort(key=lambda x: (get_segment_size(x, sizes) or {}).get('visitors', -1), reverse=True)
     
     # Display segments
     if filtered_segments:
@@ -349,11 +405,48 @@ def render_segment_grid(search_term, filter_type, sort_by):
         
         # Display as a list (more compact than grid)
         for idx, segment in enumerate(filtered_segments):
-            render_segment_card(segment, idx)
+            render_segment_card(segment, idx, get_segment_size(segment, sizes))
     else:
         st.info("No segments found. Create your first segment in the Segment Builder tab!")
 
-def render_segment_card(segment, idx):
+def get_segment_size(segment, sizes):
+    """Materialized size of a library segment, or None if not computed yet"""
+    definition = segment.get('definition', segment)
+    if not isinstance(definition, dict) or not definition.get('containers'):
+        return None
+    return sizes.get(segment_hash(definition))
+
+def format_segment_size(size):
+    """Size line for a segment card"""
+    if size is None:
+        return "<span>📏 Size not computed yet</span>"
+    stale = " (outdated)" if size['stale'] else ""
+    return (f"<span>👥 {size['visitors']:,} visitors</span>"
+            f"<span>🔁 {size['sessions']:,} sessions</span>"
+            f"<span>📄 {size['hits']:,} hits{stale}</span>")
+
+def update_segment_sizes():
+    """Materialize sizes of library segments that are missing or stale"""
+    definitions = []
+    for segment in get_saved_segments():
+        definition = segment.get('definition', segment)
+        if isinstance(definition, dict) and definition.get('containers'):
+            definitions.append(definition)
+    
+    conn = get_db_connection()
+    try:
+        with st.spinner("Counting segment sizes..."):
+            summary = refresh_segment_sizes(conn, definitions, build_membership_sql)
+        clear_data_cache()
+        st.success(f"Updated {summary['computed']} segment sizes ({summary['skipped']} already up to date)")
+        if summary['failed']:
+            st.warning(f"{summary['failed']} segments could not be sized")
+    except Exception as e:
+        st.error(f"Could not update segment sizes: {str(e)}")
+    finally:
+        conn.close()
+
+def render_segment_card(segment, idx, size=None):
     """Render a single segment card"""
     
     # Get segment type and definition
@@ -377,6 +470,7 @@ def render_segment_card(segment, idx):
                 {segment.get('description', 'No description available')}
             </div>
             <div class="segment-card-metrics">
+                {format_segment_size(size)}
                 <span>📊 {segment.get('usage_count', 0)} uses</span>
                 <span>📅 {segment.get('created_date', 'Unknown')}</span>
                 <span>👤 {segment.get('created_by', 'Unknown')}</span>
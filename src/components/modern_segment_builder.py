@@ -12,6 +12,7 @@ ENHANCEMENTS ADDED:
 
 import streamlit as st
 import streamlit.components.v1 as components
+import hashlib
 import json
 import uuid
 from typing import Dict, List, Any, Optional
@@ -20,6 +21,13 @@ import sqlite3
 from pathlib import Path
 import requests  # ADDED: For FastAPI integration
 
+from src.database.result_cache import cache_key, preview_cache
+from src.database.stats_snapshot import get_stats_snapshot
+from src.database.warmup import start_warmup
+from src.utils.streamlit_cache import (
+    cached_query, clear_data_cache, connection_lock, database_version, get_connection
+)
+
 
 def render_modern_segment_builder():
     """Adobe Analytics style segment builder with integrated home page and enhanced features"""
@@ -95,6 +103,9 @@ def _render_components_sidebar():
             st.metric("Unique Users", f"{(stats.get('unique_users', 0) / 1000):.1f}K")
             st.metric("Revenue", f"${(stats.get('total_revenue', 0) / 1000000):.1f}M")
 
+        if stats.get('computed_at'):
+            st.caption(f"Stats as of {stats['computed_at'].replace('T', ' ')}")
+
     # Search and tabs (unchanged)
     search_query = st.text_input("🔍 Search components...", key="component_search")
 
@@ -321,6 +332,9 @@ def _render_home_page_content():
     </div>
     """, unsafe_allow_html=True)
 
+    if stats.get('computed_at'):
+        st.caption(f"Database statistics as of {stats['computed_at'].replace('T', ' ')}")
+
     # ENHANCED: Create New Segment button with better styling
     st.markdown("<br>", unsafe_allow_html=True)
 
@@ -489,18 +503,16 @@ def _handle_preview_requests():
 def _get_database_config():
     """Get configuration from actual database"""
     try:
-        db_path = Path("data/analytics.db")
-        conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
+        # Cached per database version, so reruns skip the queries
+        version = database_version()
 
         # Get REAL database statistics from SQLite
-        stats = _get_database_stats(cursor)
+        stats = cached_query("database_stats", version, lambda conn: _get_database_stats(conn.cursor()))
         st.session_state.database_stats = stats
 
         # ENHANCED: Get saved segments and refresh the list
-        saved_segments = _get_saved_segments(cursor)
+        saved_segments = cached_query("saved_segments", version, lambda conn: _get_saved_segments(conn.cursor()))
         st.session_state.saved_segments = saved_segments
-        conn.close()
 
         return {
             'dimensions': [
@@ -560,28 +572,15 @@ def _get_database_config():
 
 
 def _get_database_stats(cursor):
-    """Get REAL database statistics from SQLite"""
+    """Get REAL database statistics from the precomputed stats snapshot"""
     stats = {}
     try:
-        # Total hits
-        cursor.execute("SELECT COUNT(*) FROM hits")
-        result = cursor.fetchone()
-        stats['total_hits'] = result[0] if result else 0
-
-        # Unique users
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM hits")
-        result = cursor.fetchone()
-        stats['unique_users'] = result[0] if result else 0
-
-        # Sessions
-        cursor.execute("SELECT COUNT(DISTINCT session_id) FROM hits")
-        result = cursor.fetchone()
-        stats['sessions'] = result[0] if result else 0
-
-        # Total revenue
-        cursor.execute("SELECT COALESCE(SUM(revenue), 0) FROM hits")
-        result = cursor.fetchone()
-        stats['total_revenue'] = result[0] if result else 0
+        snapshot = get_stats_snapshot(cursor.connection)
+        stats['total_hits'] = snapshot['total_hits']
+        stats['unique_users'] = snapshot['total_users']
+        stats['sessions'] = snapshot['total_sessions']
+        stats['total_revenue'] = snapshot['revenue_stats']['total_revenue']
+        stats['computed_at'] = snapshot['computed_at']
 
     except Exception as e:
         st.error(f"Error getting database stats: {e}")
@@ -660,51 +659,87 @@ def _get_saved_segments(cursor):
         return []
 
 
-def _execute_preview_query(sql_query):
-    """Execute SQL query and return REAL DATA results"""
-    try:
-        db_path = Path("data/analytics.db")
-        conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
+def _preview_cache_key(sql_query, segment_definition=None):
+    # The React and Python compilers emit different SQL (and columns) for the
+    # same definition, so the SQL is part of the key
+    sql_hash = hashlib.sha256(sql_query.encode('utf-8')).hexdigest()
+    return cache_key("builder_preview", segment_definition or {"sql": sql_query}, sql=sql_hash, limit=100)
+
+
+def _preview_result(cursor, sql_query):
+    """First 100 rows of a preview query, formatted for the builder"""
+    cursor.execute(sql_query)
+    columns = [description[0] for description in cursor.description]
+    rows = cursor.fetchmany(100)
+    cursor.close()
+
+    result_rows = []
+    for row in rows:
+        row_dict = {}
+        for i, col in enumerate(columns):
+            value = row[i]
+            if value is None:
+                value = ""
+            elif isinstance(value, (int, float)):
+                value = value
+            else:
+                value = str(value)
+            row_dict[col] = value
+        result_rows.append(row_dict)
+
+    return {
+        'sql_query': sql_query,
+        'rows': result_rows,
+        'columns': columns,
+        'total_count': len(result_rows),
+        'is_default': len(result_rows) == 0 or ('LIMIT 10' in sql_query and 'WHERE' not in sql_query),
+        'success': True
+    }
 
-        cursor.execute(sql_query)
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchmany(100)
-
-        result_rows = []
-        for row in rows:
-            row_dict = {}
-            for i, col in enumerate(columns):
-                value = row[i]
-                if value is None:
-                    value = ""
-                elif isinstance(value, (int, float)):
-                    value = value
-                else:
-                    value = str(value)
-                row_dict[col] = value
-            result_rows.append(row_dict)
 
+@st.cache_resource
+def start_preview_warmup():
+    """Precompute saved segment previews in the background, once per process"""
+    return start_warmup(_generate_sql_from_segment_with_nesting, _warm_segment_preview)
+
+
+def _warm_segment_preview(segment):
+    # Own connection, so warm-up never holds the shared one
+    key = _preview_cache_key(segment['sql'], segment['definition'])
+    token = preview_cache.token()
+    conn = sqlite3.connect("data/analytics.db")
+    try:
+        preview_cache.put(key, _preview_result(conn.cursor(), segment['sql']), token)
+    finally:
         conn.close()
 
-        return {
-            'sql_query': sql_query,
-            'rows': result_rows,
-            'columns': columns,
-            'total_count': len(result_rows),
-            'is_default': len(result_rows) == 0 or ('LIMIT 10' in sql_query and 'WHERE' not in sql_query),
-            'success': True
-        }
+
+def _execute_preview_query(sql_query, segment_definition=None):
+    """Execute SQL query and return REAL DATA results
+
+    Results are cached per canonical segment and SQL text until the
+    database changes.
+    """
+    key = _preview_cache_key(sql_query, segment_definition)
+    cached = preview_cache.get(key)
+    if cached is not None:
+        return cached
+    token = preview_cache.token()
+
+    try:
+        with connection_lock():
+            result = _preview_result(get_connection().cursor(), sql_query)
+        preview_cache.put(key, result, token)
+        return result
 
     except Exception as e:
         try:
-            db_path = Path("data/analytics.db")
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT * FROM hits LIMIT 10")
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
+            with connection_lock():
+                cursor = get_connection().cursor()
+                cursor.execute("SELECT * FROM hits LIMIT 10")
+                columns = [description[0] for description in cursor.description]
+                rows = cursor.fetchall()
+                cursor.close()
 
             result_rows = []
             for row in rows:
@@ -713,8 +748,6 @@ def _execute_preview_query(sql_query):
                     row_dict[col] = row[i] if row[i] is not None else ""
                 result_rows.append(row_dict)
 
-            conn.close()
-
             return {
                 'sql_query': f"-- Error in query: {str(e)}\nSELECT * FROM hits LIMIT 10",
                 'rows': result_rows,
@@ -2819,7 +2852,7 @@ def _render_adobe_segment_builder(config):
         if component_value.get('type') == 'segmentPreview' and component_value.get('executeNow'):
             sql_query = component_value.get('sql', '')
             if sql_query:
-                preview_result = _execute_preview_query(sql_query)
+                preview_result = _execute_preview_query(sql_query, component_value.get('segment'))
                 st.session_state.preview_data = preview_result
                 st.rerun()
 
@@ -3005,7 +3038,7 @@ def _preview_segment_action():
     """Preview segment results"""
     try:
         sql_query = _generate_sql_from_segment_with_nesting(st.session_state.segment_definition)
-        preview_result = _execute_preview_query(sql_query)
+        preview_result = _execute_preview_query(sql_query, st.session_state.segment_definition)
 
         st.info("🔍 Segment Preview")
 
@@ -3129,6 +3162,7 @@ def _save_segment_enhanced(segment):
 
         conn.commit()
         conn.close()
+        clear_data_cache()
 
         # Show success message
         st.success(f"✅ Segment '{segment.get('name')}' saved successfully!")
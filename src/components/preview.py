@@ -5,8 +5,16 @@ import plotly.graph_objects as go
 from datetime import datetime, timedelta
 from src.database.queries import execute_segment_query, get_db_connection
 from src.utils.query_builder import build_sql_from_segment
+from src.database.sampling import SAMPLE_RATES, grouped_totals_sql, summarize_sample
+from src.database.partitions import load_partition_catalog
+from src.database.result_cache import cache_key, preview_cache
+from src.database.value_dictionary import lookup_values, matching_hits, suggest_values
+from src.database.parquet_export import export_query, segment_members_sql
+from pathlib import Path
 import json
 
+EXPORT_DIR = Path("data/exports")
+
 def render_preview():
     """Render the preview panel with enhanced data handling"""
     
@@ -292,6 +300,15 @@ def render_preview():
             label_visibility="collapsed"
         )
         st.session_state.preview_limit = sample_size if sample_size != "All" else None
+        
+        # Hash-sampled evaluation for fast approximate counts
+        st.selectbox(
+            "Sampling",
+            options=list(SAMPLE_RATES.keys()),
+            index=0,
+            key="preview_sampling_mode",
+            help="Evaluate the segment over a fixed sample of users and scale counts up"
+        )
     
     with col3:
         # View mode
@@ -347,10 +364,14 @@ def render_preview():
             st.session_state.preview_segment = st.session_state.segment_definition
         
         # Generate or display preview
-        if st.session_state.preview_data is None or st.session_state.get('preview_segment') != st.session_state.get('last_preview_segment'):
+        sampling_mode = st.session_state.get('preview_sampling_mode', 'Exact')
+        if (st.session_state.preview_data is None
+                or st.session_state.get('preview_segment') != st.session_state.get('last_preview_segment')
+                or sampling_mode != st.session_state.get('last_preview_sampling_mode')):
             with st.spinner("Generating preview..."):
                 generate_preview()
                 st.session_state.last_preview_segment = st.session_state.get('preview_segment')
+                st.session_state.last_preview_sampling_mode = sampling_mode
         
         # Display results
         if st.session_state.preview_data is not None:
@@ -371,21 +392,28 @@ def generate_preview():
             st.session_state.preview_data = pd.DataFrame()
             return
         
-        # Build SQL query
-        sql_query = build_sql_from_segment(preview_segment)
-        
-        # Add date filter if enabled
+        # Date range is compiled into the query so only matching partitions are read
+        date_range = None
+        partition_catalog = None
         if st.session_state.get('use_date_filter') and st.session_state.get('preview_date_range'):
             date_range = st.session_state.preview_date_range
-            if len(date_range) == 2:
-                date_clause = f" AND h.timestamp BETWEEN '{date_range[0]}' AND '{date_range[1]}'"
-                if "ORDER BY" in sql_query:
-                    sql_query = sql_query.replace("ORDER BY", date_clause + " ORDER BY")
-                else:
-                    sql_query = sql_query + date_clause
+            conn = get_db_connection()
+            partition_catalog = load_partition_catalog(conn, skip_empty_default=True)
+            conn.close()
+        
+        # Build SQL query
+        sample_rate = SAMPLE_RATES.get(st.session_state.get('preview_sampling_mode', 'Exact'))
+        sql_query = build_sql_from_segment(
+            preview_segment,
+            sample_rate=sample_rate,
+            date_range=date_range,
+            partition_catalog=partition_catalog
+        )
         
-        # Add limit
         limit = st.session_state.get('preview_limit', 100)
+        totals_sql = grouped_totals_sql(sql_query) if sample_rate else None
+        
+        # Add limit
         if limit and "LIMIT" not in sql_query:
             sql_query = f"{sql_query} LIMIT {limit}"
         
@@ -393,12 +421,25 @@ def generate_preview():
         with st.expander("🔍 Generated SQL Query", expanded=False):
             st.code(sql_query, language='sql')
         
-        # Execute query
-        conn = get_db_connection()
-        df = pd.read_sql_query(sql_query, conn)
-        conn.close()
+        def run_preview():
+            conn = get_db_connection()
+            try:
+                # Scaled totals over the whole sample (before the display limit)
+                sampling = None
+                if totals_sql:
+                    users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+                    sampling = summarize_sample(conn.execute(totals_sql).fetchone(), sample_rate, users)
+                return pd.read_sql_query(sql_query, conn), sampling
+            finally:
+                conn.close()
+        
+        # Reruns and tab switches reuse the last result until the data changes
+        key = cache_key("streamlit_preview", preview_segment, sample_rate=sample_rate,
+                        date_range=date_range, limit=limit)
+        df, sampling = preview_cache.get_or_compute(key, run_preview)
         
         # Store in session state
+        st.session_state.preview_sampling = sampling
         st.session_state.preview_data = df
         
         if df.empty:
@@ -434,29 +475,30 @@ def show_debug_info():
     col1, col2 = st.columns(2)
     
     with col1:
-        # Check for specific values in segment
+        # Check each condition's value against the value dictionary (no hits scans)
         if st.session_state.segment_definition.get('containers'):
             for container in st.session_state.segment_definition['containers']:
                 for condition in container.get('conditions', []):
                     field = condition.get('field')
                     value = condition.get('value')
+                    operator = condition.get('operator', 'equals')
                     
                     if field and value:
-                        # Check if this value exists
-                        check_query = f"""
-                        SELECT COUNT(*) as count 
-                        FROM hits 
-                        WHERE {field} = '{value}'
-                        """
                         try:
-                            result = pd.read_sql_query(check_query, conn)
-                            count = result.iloc[0]['count']
-                            if count == 0:
-                                st.warning(f"❌ No records found with {field} = '{value}'")
-                            else:
-                                st.success(f"✅ Found {count} records with {field} = '{value}'")
-                        except:
+                            count = matching_hits(conn, field, operator, value)
+                        except Exception:
                             st.error(f"Could not check {field}")
+                            continue
+                        if count is None:
+                            st.info(f"ℹ️ Values of {field} can't be checked without a scan")
+                        elif count == 0:
+                            message = f"❌ No records where {field} {operator} '{value}'"
+                            suggestions = suggest_values(conn, field, value)
+                            if suggestions:
+                                message += "; did you mean " + " or ".join(f"'{s}'" for s in suggestions) + "?"
+                            st.warning(message)
+                        else:
+                            st.success(f"✅ Found {count:,} records where {field} {operator} '{value}'")
     
     with col2:
         # Show available values
@@ -465,8 +507,7 @@ def show_debug_info():
         # Get unique values for common fields
         for field in ['device_type', 'browser_name', 'page_type', 'traffic_source']:
             try:
-                query = f"SELECT DISTINCT {field}, COUNT(*) as count FROM hits GROUP BY {field} ORDER BY count DESC LIMIT 5"
-                df = pd.read_sql_query(query, conn)
+                df = _value_counts(conn, field, limit=5)
                 st.write(f"**{field}:**")
                 for _, row in df.iterrows():
                     st.write(f"- {row[field]}: {row['count']:,} records")
@@ -562,32 +603,38 @@ def show_available_values():
     
     with col1:
         # Device types
-        device_query = "SELECT DISTINCT device_type, COUNT(*) as count FROM hits GROUP BY device_type ORDER BY count DESC"
-        device_df = pd.read_sql_query(device_query, conn)
+        device_df = _value_counts(conn, 'device_type')
         st.markdown("**Device Types:**")
         st.dataframe(device_df, use_container_width=True, height=150)
     
     with col2:
         # Browsers
-        browser_query = "SELECT DISTINCT browser_name, COUNT(*) as count FROM hits GROUP BY browser_name ORDER BY count DESC LIMIT 10"
-        browser_df = pd.read_sql_query(browser_query, conn)
+        browser_df = _value_counts(conn, 'browser_name', limit=10)
         st.markdown("**Browser Names:**")
         st.dataframe(browser_df, use_container_width=True, height=150)
     
     # Page types
-    page_query = "SELECT DISTINCT page_type, COUNT(*) as count FROM hits GROUP BY page_type ORDER BY count DESC"
-    page_df = pd.read_sql_query(page_query, conn)
+    page_df = _value_counts(conn, 'page_type')
     st.markdown("**Page Types:**")
     st.dataframe(page_df, use_container_width=True, height=150)
     
     # Traffic sources
-    traffic_query = "SELECT DISTINCT traffic_source, COUNT(*) as count FROM hits GROUP BY traffic_source ORDER BY count DESC"
-    traffic_df = pd.read_sql_query(traffic_query, conn)
+    traffic_df = _value_counts(conn, 'traffic_source')
     st.markdown("**Traffic Sources:**")
     st.dataframe(traffic_df, use_container_width=True, height=150)
     
     conn.close()
 
+def _value_counts(conn, field, limit=None):
+    """Value counts of a hits field from the value dictionary, or a live GROUP BY"""
+    rows = lookup_values(conn, field, limit=limit or -1)
+    if rows is not None:
+        return pd.DataFrame(rows, columns=[field, 'count'])
+    query = f"SELECT DISTINCT {field}, COUNT(*) as count FROM hits GROUP BY {field} ORDER BY count DESC"
+    if limit:
+        query += f" LIMIT {limit}"
+    return pd.read_sql_query(query, conn)
+
 def render_preview_results(view_mode="Quick View"):
     """Render preview results with enhanced visualizations"""
     df = st.session_state.preview_data
@@ -627,37 +674,58 @@ def render_preview_results(view_mode="Quick View"):
         with tab5:
             render_export_options(df)
 
+def _sampled_metric_card(metric, label):
+    """Metric card showing a scaled estimate with its confidence interval"""
+    return f"""
+        <div class="metric-card">
+            <div class="metric-value">~{metric['estimate']:,}</div>
+            <div class="metric-label">{label}</div>
+            <div class="metric-label">95% CI {metric['lower']:,} – {metric['upper']:,}</div>
+        </div>
+        """
+
 def render_metrics_cards(df):
     """Render summary metrics in cards"""
+    sampling = st.session_state.get('preview_sampling')
+    
     st.markdown('<div class="metrics-container">', unsafe_allow_html=True)
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-value">{len(df):,}</div>
-            <div class="metric-label">Total Hits</div>
-        </div>
-        """, unsafe_allow_html=True)
+        if sampling:
+            st.markdown(_sampled_metric_card(sampling['total_hits'], "Total Hits"), unsafe_allow_html=True)
+        else:
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{len(df):,}</div>
+                <div class="metric-label">Total Hits</div>
+            </div>
+            """, unsafe_allow_html=True)
     
     with col2:
-        unique_sessions = df['session_id'].nunique() if 'session_id' in df.columns else 0
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-value">{unique_sessions:,}</div>
-            <div class="metric-label">Unique Sessions</div>
-        </div>
-        """, unsafe_allow_html=True)
+        if sampling:
+            st.markdown(_sampled_metric_card(sampling['unique_sessions'], "Unique Sessions"), unsafe_allow_html=True)
+        else:
+            unique_sessions = df['session_id'].nunique() if 'session_id' in df.columns else 0
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{unique_sessions:,}</div>
+                <div class="metric-label">Unique Sessions</div>
+            </div>
+            """, unsafe_allow_html=True)
     
     with col3:
-        unique_visitors = df['user_id'].nunique() if 'user_id' in df.columns else 0
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-value">{unique_visitors:,}</div>
-            <div class="metric-label">Unique Visitors</div>
-        </div>
-        """, unsafe_allow_html=True)
+        if sampling:
+            st.markdown(_sampled_metric_card(sampling['unique_users'], "Unique Visitors"), unsafe_allow_html=True)
+        else:
+            unique_visitors = df['user_id'].nunique() if 'user_id' in df.columns else 0
+            st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-value">{unique_visitors:,}</div>
+                <div class="metric-label">Unique Visitors</div>
+            </div>
+            """, unsafe_allow_html=True)
     
     with col4:
         total_revenue = df['revenue'].sum() if 'revenue' in df.columns else 0
@@ -668,6 +736,9 @@ def render_metrics_cards(df):
         </div>
         """, unsafe_allow_html=True)
     
+    if sampling:
+        st.caption(f"Estimated from a {sampling['rate']:.0%} user sample; rows below are sampled records only.")
+    
     st.markdown('</div>', unsafe_allow_html=True)
 
 def render_data_table(df):
@@ -815,6 +886,23 @@ def render_export_options(df):
             use_container_width=True
         )
     
+    # Full segment export, streamed from the database rather than the preview rows
+    st.markdown("#### Export Full Segment (Parquet)")
+    st.caption("Writes every matching row, not just the preview, in row groups straight from the database.")
+    if st.button("📦 Prepare Parquet Export", use_container_width=True):
+        export_full_segment_parquet()
+    
+    export_path = st.session_state.get('parquet_export_path')
+    if export_path and Path(export_path).exists():
+        with open(export_path, 'rb') as f:
+            st.download_button(
+                label=f"📥 Download {Path(export_path).name}",
+                data=f,
+                file_name=Path(export_path).name,
+                mime="application/vnd.apache.parquet",
+                use_container_width=True
+            )
+    
     # Segment definition export
     st.markdown("#### Export Segment Definition")
     segment_json = json.dumps(st.session_state.segment_definition, indent=2)
@@ -826,6 +914,36 @@ def render_export_options(df):
         use_container_width=True
     )
 
+def export_full_segment_parquet():
+    """Stream the whole preview segment (no display limit) into a Parquet file under EXPORT_DIR"""
+    segment = st.session_state.get('preview_segment', st.session_state.segment_definition)
+    date_range = None
+    if st.session_state.get('use_date_filter') and st.session_state.get('preview_date_range'):
+        date_range = st.session_state.preview_date_range
+    
+    conn = get_db_connection()
+    try:
+        sql_query = build_sql_from_segment(
+            segment,
+            date_range=date_range,
+            partition_catalog=load_partition_catalog(conn, skip_empty_default=True) if date_range else None
+        )
+        if sql_query.lstrip().startswith('--'):
+            st.warning("Add conditions to the segment before exporting")
+            return
+        
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        export_path = EXPORT_DIR / f"segment_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet"
+        with st.spinner("Exporting segment to Parquet..."):
+            rows = export_query(conn, segment_members_sql(sql_query), str(export_path))
+    except RuntimeError as e:
+        st.info(str(e))
+        return
+    finally:
+        conn.close()
+    st.session_state.parquet_export_path = str(export_path)
+    st.success(f"Exported {rows:,} rows to {export_path}")
+
 # Additional analysis functions for Full Analysis mode
 def render_trend_analysis(df):
     """Render trend analysis"""
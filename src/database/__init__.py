@@ -12,6 +12,7 @@ from .queries import (
     save_segment,
     load_saved_segments
 )
+from .sketches import build_hll_sketches, estimate_segment_uniques
 
 __all__ = [
     'initialize_database',
@@ -22,5 +23,7 @@ __all__ = [
     'validate_segment_sql',
     'get_segment_statistics',
     'save_segment',
-    'load_saved_segments'
+    'load_saved_segments',
+    'build_hll_sketches',
+    'estimate_segment_uniques'
 ]
\ No newline at end of file
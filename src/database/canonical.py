@@ -0,0 +1,63 @@
+"""
+Canonical form and hash of segment definitions
+
+Two definitions that select the same data hash identically: UI-only keys
+(ids, names, descriptions, tags, timestamps) are dropped, defaults are filled
+in, and conditions/containers are sorted since AND and OR are commutative.
+The hash is used as the key of result caches.
+"""
+
+import hashlib
+import json
+
+# Keys that affect the compiled SQL; everything else is presentation
+CONDITION_KEYS = ('field', 'operator', 'value', 'dataType', 'data_type')
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def canonical_condition(condition):
+    """Compiler-relevant part of a condition"""
+    canonical = {key: condition[key] for key in CONDITION_KEYS if key in condition}
+    canonical.setdefault('operator', 'equals')
+    return canonical
+
+
+def canonical_container(container):
+    """Canonical form of a container and its nested children"""
+    conditions = [canonical_condition(c) for c in container.get('conditions', []) or []]
+    children = [canonical_container(c) for c in container.get('children', []) or []]
+    return {
+        'type': container.get('type', 'hit'),
+        'include': bool(container.get('include', True)),
+        'logic': str(container.get('logic', 'and')).lower(),
+        'conditions': sorted(conditions, key=_dumps),
+        'children': sorted(children, key=_dumps)
+    }
+
+
+def canonical_segment(segment_definition):
+    """Canonical form of a whole segment definition"""
+    segment_definition = segment_definition or {}
+    containers = [canonical_container(c) for c in segment_definition.get('containers', []) or []]
+    return {
+        'container_type': segment_definition.get('container_type', 'hit'),
+        'logic': str(segment_definition.get('logic', 'and')).lower(),
+        'containers': sorted(containers, key=_dumps)
+    }
+
+
+def _digest(value):
+    return hashlib.sha256(_dumps(value).encode('utf-8')).hexdigest()
+
+
+def segment_hash(segment_definition):
+    """Stable hex digest of a segment's canonical form"""
+    return _digest(canonical_segment(segment_definition))
+
+
+def container_hash(container):
+    """Stable hex digest of a container subtree's canonical form"""
+    return _digest(canonical_container(container))
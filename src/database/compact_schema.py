@@ -0,0 +1,209 @@
+"""
+Compact storage layout for hits, sessions and users
+
+The original schema stores hits.timestamp as DATETIME text written by
+pandas (up to 26 bytes per row, compared as strings), and sessions/users
+are rowid tables with TEXT primary keys, so every id is stored twice (in
+the table and in its primary key index). The compact layout:
+
+- hits_data holds the hit rows with ts INTEGER (Unix seconds, UTC) in place
+  of timestamp; a hits view puts timestamp back as 'YYYY-MM-DD HH:MM:SS'
+  text (and exposes ts), with INSTEAD OF triggers for writes, so existing
+  SQL keeps working. Date ranges compile to ts predicates
+  (partitions.hits_source_sql).
+- sessions and users are WITHOUT ROWID tables clustered on session_key /
+  user_key, the columns segment SQL joins on; the text ids keep a unique
+  index.
+
+Timestamps lose their sub-second part. Partitioned databases cannot be
+converted.
+
+Usage (from the project root):
+    python src/database/compact_schema.py
+"""
+
+import re
+import sqlite3
+from pathlib import Path
+
+try:
+    from .partitions import COMPACT_TABLE, is_compact, is_partitioned
+    from .result_cache import bump_ingest_watermark
+except ImportError:
+    from partitions import COMPACT_TABLE, is_compact, is_partitioned
+    from result_cache import bump_ingest_watermark
+
+DB_PATH = Path("data/analytics.db")
+
+# Rollup table -> (clustering key, text id)
+ROLLUP_KEYS = {
+    'sessions': ('session_key', 'session_id'),
+    'users': ('user_key', 'user_id')
+}
+
+TIMESTAMP_SQL = "datetime(ts, 'unixepoch')"
+EPOCH_SQL = "CAST(strftime('%s', {}) AS INTEGER)"
+
+
+def _table_columns(conn, table):
+    """[(name, declared type, notnull, default)] in table order"""
+    return [(row[1], row[2], row[3], row[4]) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _column_ddl(name, declared_type, notnull, default):
+    ddl = f"{name} {declared_type}".rstrip()
+    if notnull:
+        ddl += " NOT NULL"
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    return ddl
+
+
+def _index_sqls(conn, table):
+    """[(name, CREATE INDEX statement)] of a table's explicit indexes"""
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+
+
+def database_bytes(conn):
+    """Size of the main database file in bytes"""
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def rebuild_compact_view(conn):
+    """(Re)create the hits view over hits_data and its write triggers"""
+    columns = [name for name, *_ in _table_columns(conn, COMPACT_TABLE)]
+    view_columns = [f"{TIMESTAMP_SQL} AS timestamp" if name == 'ts' else name for name in columns] + ['ts']
+
+    conn.execute("DROP VIEW IF EXISTS hits")
+    conn.execute(f"CREATE VIEW hits AS SELECT {', '.join(view_columns)} FROM {COMPACT_TABLE}")
+
+    # ts may be written directly or derived from timestamp text
+    new_ts = f"COALESCE(NEW.ts, {EPOCH_SQL.format('NEW.timestamp')})"
+    changed_ts = (f"CASE WHEN NEW.timestamp IS NOT OLD.timestamp "
+                  f"THEN {EPOCH_SQL.format('NEW.timestamp')} ELSE NEW.ts END")
+    values = ', '.join(new_ts if name == 'ts' else f"NEW.{name}" for name in columns)
+    assignments = ', '.join(
+        f"ts = {changed_ts}" if name == 'ts' else f"{name} = NEW.{name}"
+        for name in columns if name != 'hit_id'
+    )
+
+    for trigger, event, body in (
+        ('hits_insert', 'INSERT', f"INSERT INTO {COMPACT_TABLE} ({', '.join(columns)}) VALUES ({values});"),
+        ('hits_update', 'UPDATE', f"UPDATE {COMPACT_TABLE} SET {assignments} WHERE hit_id = OLD.hit_id;"),
+        ('hits_delete', 'DELETE', f"DELETE FROM {COMPACT_TABLE} WHERE hit_id = OLD.hit_id;")
+    ):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute(f"CREATE TRIGGER {trigger} INSTEAD OF {event} ON hits\nBEGIN\n    {body}\nEND")
+
+
+def _compact_hits(conn):
+    """Move hits into hits_data with epoch timestamps behind the hits view"""
+    columns = _table_columns(conn, 'hits')
+    definitions, targets, sources = [], [], []
+    for name, declared_type, notnull, default in columns:
+        if name == 'hit_id':
+            definitions.append("hit_id INTEGER PRIMARY KEY")
+            targets.append(name)
+            sources.append(name)
+        elif name == 'timestamp':
+            definitions.append("ts INTEGER NOT NULL")
+            targets.append('ts')
+            sources.append(EPOCH_SQL.format('timestamp'))
+        else:
+            definitions.append(_column_ddl(name, declared_type, notnull, default))
+            targets.append(name)
+            sources.append(name)
+    indexes = _index_sqls(conn, 'hits')
+
+    conn.execute(f"CREATE TABLE {COMPACT_TABLE} (\n    " + ',\n    '.join(definitions) + "\n)")
+    conn.execute(f"""
+        INSERT INTO {COMPACT_TABLE} ({', '.join(targets)})
+        SELECT {', '.join(sources)} FROM hits ORDER BY hit_id
+    """)
+    conn.execute("DROP TABLE hits")
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'hits'")
+
+    # Same indexes, named like a partition's (idx_hits_x_data) and on ts
+    suffix = COMPACT_TABLE[len('hits'):]
+    for name, sql in indexes:
+        sql = sql.replace(name, name + suffix, 1)
+        sql = re.sub(r'\bON\s+"?hits"?\s*\(', f'ON {COMPACT_TABLE}(', sql, count=1, flags=re.IGNORECASE)
+        conn.execute(re.sub(r'\btimestamp\b', 'ts', sql))
+
+    rebuild_compact_view(conn)
+
+
+def _compact_rollup(conn, table):
+    """Rebuild a rollup table WITHOUT ROWID, clustered on its integer key"""
+    key_column, id_column = ROLLUP_KEYS[table]
+    columns = _table_columns(conn, table)
+    definitions = [
+        _column_ddl(name, declared_type, notnull or name in (key_column, id_column), default)
+        for name, declared_type, notnull, default in columns
+    ]
+    # The key's own index is superseded by the clustering
+    indexes = [
+        (name, sql) for name, sql in _index_sqls(conn, table)
+        if not re.search(r'\(\s*%s\s*\)\s*$' % key_column, sql)
+    ]
+    names = ', '.join(name for name, *_ in columns)
+
+    conn.execute(
+        f"CREATE TABLE {table}_compact (\n    " + ',\n    '.join(definitions)
+        + f",\n    PRIMARY KEY ({key_column})\n) WITHOUT ROWID"
+    )
+    conn.execute(f"INSERT INTO {table}_compact ({names}) SELECT {names} FROM {table} ORDER BY {key_column}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_compact RENAME TO {table}")
+    conn.execute(f"CREATE UNIQUE INDEX idx_{table}_{id_column} ON {table}({id_column})")
+    for _, sql in indexes:
+        conn.execute(sql)
+
+
+def migrate_to_compact(conn):
+    """Convert hits, sessions and users to the compact layout in one transaction
+
+    Expects surrogate keys on every row (run init_db.upgrade_schema first).
+    Returns False if the database already is compact.
+    """
+    if is_compact(conn):
+        return False
+    if is_partitioned(conn):
+        raise ValueError("Partitioned databases cannot be converted to the compact layout")
+    for table, (key_column, _) in ROLLUP_KEYS.items():
+        if conn.execute(f"SELECT 1 FROM {table} WHERE {key_column} IS NULL LIMIT 1").fetchone():
+            raise ValueError(f"{table} has rows without {key_column}; run surrogate_keys.py first")
+    if conn.execute("SELECT 1 FROM hits WHERE strftime('%s', timestamp) IS NULL LIMIT 1").fetchone():
+        raise ValueError("hits has timestamps that are not valid dates")
+
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        _compact_hits(conn)
+        for table in ROLLUP_KEYS:
+            _compact_rollup(conn, table)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    bump_ingest_watermark(conn)
+    return True
+
+
+if __name__ == "__main__":
+    from init_db import upgrade_schema
+
+    conn = sqlite3.connect(str(DB_PATH))
+    before = database_bytes(conn)
+    upgrade_schema(conn)
+    print("Converting hits, sessions and users to the compact layout...")
+    if not migrate_to_compact(conn):
+        print(f"{DB_PATH} already uses the compact layout")
+    else:
+        conn.execute("VACUUM")
+        print(f"{DB_PATH}: {before / 1e6:,.1f} MB -> {database_bytes(conn) / 1e6:,.1f} MB")
+    conn.close()
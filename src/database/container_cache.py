@@ -0,0 +1,79 @@
+"""
+Memoized container member sets for interactive segment editing
+
+A segment's containers each select a set of users, which the segment logic
+then intersects (AND) or unions (OR). Each container's set is cached as a
+bitmap of user_key keyed by the container's canonical hash, so after editing
+one rule only that container is re-queried and the cached sets of the others
+are re-combined in memory. Entries are dropped when the database changes
+and persisted to the side cache database (see result_cache.ResultCache).
+"""
+
+try:
+    from .canonical import container_hash
+    from .overlap import bitmap_to_keys, keys_to_bitmap
+    from .partitions import apply_date_range
+    from .result_cache import ResultCache, disk_cache
+except ImportError:
+    from canonical import container_hash
+    from overlap import bitmap_to_keys, keys_to_bitmap
+    from partitions import apply_date_range
+    from result_cache import ResultCache, disk_cache
+
+MEMBERS_TABLE = 'temp.segment_members'
+
+# Bitmaps are small (one bit per user), so keep plenty of containers around
+member_cache = ResultCache(max_bytes=32 * 1024 * 1024, max_entries=2048, persistent=disk_cache)
+
+
+def container_members(conn, container, compile_container, sample_rate=None, date_range=None, catalog=None):
+    """user_key bitmap of one container, or None if it has no usable conditions
+
+    compile_container(container, sample_rate) returns a query selecting the
+    container's user_key values (or None).
+    """
+    key = f"container:{container_hash(container)}:{sample_rate}:{list(date_range or [])}"
+    missing = object()
+    cached = member_cache.get(key, missing)
+    if cached is not missing:
+        return cached
+
+    token = member_cache.token()
+    sql = compile_container(container, sample_rate)
+    if sql is None:
+        bitmap = None
+    else:
+        if date_range:
+            sql = apply_date_range(sql, date_range, catalog)
+        bitmap = keys_to_bitmap(row[0] for row in conn.execute(sql))
+    member_cache.put(key, bitmap, token)
+    return bitmap
+
+
+def segment_members(conn, segment_definition, compile_container, sample_rate=None, date_range=None, catalog=None):
+    """user_key bitmap of a whole segment, combining per-container sets with its logic
+
+    Returns None when no container has usable conditions.
+    """
+    bitmaps = [
+        container_members(conn, container, compile_container, sample_rate, date_range, catalog)
+        for container in segment_definition.get('containers', []) or []
+    ]
+    bitmaps = [bitmap for bitmap in bitmaps if bitmap is not None]
+    if not bitmaps:
+        return None
+
+    members = bitmaps[0]
+    use_and = str(segment_definition.get('logic', 'and')).lower() == 'and'
+    for bitmap in bitmaps[1:]:
+        members = members & bitmap if use_and else members | bitmap
+    return members
+
+
+def load_members(conn, members):
+    """Materialize a member bitmap into MEMBERS_TABLE for this connection"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS segment_members (user_key INTEGER PRIMARY KEY)")
+    conn.execute(f"DELETE FROM {MEMBERS_TABLE}")
+    conn.executemany(f"INSERT INTO {MEMBERS_TABLE} (user_key) VALUES (?)",
+                     ((key,) for key in bitmap_to_keys(members)))
+    return f"SELECT user_key FROM {MEMBERS_TABLE}"
@@ -0,0 +1,205 @@
+"""
+Persistent result cache in a side SQLite database
+
+Cached previews, container member sets and other small results are
+written through to data/cache.db so they survive API redeploys and
+Streamlit worker restarts. Every entry is tagged with the data version it
+was computed from (database id + hits ingest watermark, see
+result_cache.persistent_version); an entry read under another version is a
+miss and is deleted. The file is kept under max_bytes by evicting the least
+recently used entries.
+
+Usage (from the project root):
+    python src/database/disk_cache.py stats
+    python src/database/disk_cache.py list [--namespace api_preview]
+    python src/database/disk_cache.py purge [--namespace api_preview] [--stale]
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_PATH = Path("data/cache.db")
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Only small results are worth a disk round trip
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+
+def create_cache_table(cursor):
+    """Create the cache_entries table and its LRU index"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        namespace TEXT NOT NULL,
+        data_version TEXT NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_last_access ON cache_entries(last_access)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_namespace ON cache_entries(namespace)")
+
+
+def namespace_of(key):
+    """Namespace prefix of a cache key ('api_preview:<hash>:...' -> 'api_preview')"""
+    return key.split(':', 1)[0]
+
+
+class DiskCache:
+    """Version-tagged blob store with size-bounded LRU eviction"""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Open the cache database on first use; None if its directory is missing"""
+        if self._conn is None:
+            if not self.path.parent.exists():
+                return None
+            conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+            # The API and Streamlit processes share the file
+            conn.execute("PRAGMA journal_mode=WAL")
+            create_cache_table(conn.cursor())
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key, data_version):
+        """Stored blob for key at data_version, or None"""
+        if data_version is None:
+            return None
+        with self._lock:
+            try:
+                conn = self._connection()
+                if conn is None:
+                    return None
+                row = conn.execute("SELECT data_version, value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[0] != data_version:
+                    conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                return row[1]
+            except sqlite3.Error as e:
+                print(f"Disk cache read failed: {e}")
+                return None
+
+    def put(self, key, blob, data_version):
+        """Store a blob computed at data_version, evicting old entries if over budget"""
+        if data_version is None or len(blob) > self.max_entry_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                if conn is None:
+                    return
+                conn.execute("""
+                    INSERT OR REPLACE INTO cache_entries
+                    (key, namespace, data_version, value, size, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (key, namespace_of(key), data_version, sqlite3.Binary(blob), len(blob), now, now))
+                self._evict(conn)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Disk cache write failed: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            total -= size
+
+    def entries(self, namespace=None):
+        """[(key, data_version, size, created_at, last_access)] most recently used first"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return []
+            query = "SELECT key, data_version, size, created_at, last_access FROM cache_entries"
+            params = ()
+            if namespace:
+                query += " WHERE namespace = ?"
+                params = (namespace,)
+            return conn.execute(query + " ORDER BY last_access DESC", params).fetchall()
+
+    def stats(self):
+        """Entry count and bytes per namespace"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return {}
+            rows = conn.execute("""
+                SELECT namespace, COUNT(*), SUM(size) FROM cache_entries
+                GROUP BY namespace ORDER BY namespace
+            """)
+            return {namespace: {'entries': count, 'bytes': size} for namespace, count, size in rows}
+
+    def purge(self, namespace=None, keep_version=None):
+        """Delete entries (of one namespace, or not at keep_version); returns the count"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return 0
+            clauses, params = [], []
+            if namespace:
+                clauses.append("namespace = ?")
+                params.append(namespace)
+            if keep_version is not None:
+                clauses.append("data_version != ?")
+                params.append(keep_version)
+            where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+            deleted = conn.execute(f"DELETE FROM cache_entries{where}", params).rowcount
+            conn.commit()
+            conn.execute("VACUUM")
+            return deleted
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+if __name__ == "__main__":
+    from result_cache import DB_PATH, persistent_version
+
+    parser = argparse.ArgumentParser(description="Inspect and purge the persistent result cache")
+    parser.add_argument('command', choices=['stats', 'list', 'purge'])
+    parser.add_argument('--namespace', help="only entries of this namespace (e.g. api_preview)")
+    parser.add_argument('--stale', action='store_true', help="purge only entries from an older data version")
+    args = parser.parse_args()
+
+    cache = DiskCache()
+    if args.command == 'stats':
+        stats = cache.stats()
+        if not stats:
+            print(f"{cache.path} is empty")
+        for namespace, info in stats.items():
+            print(f"{namespace:<20} {info['entries']:>8,} entries {info['bytes']:>14,} bytes")
+    elif args.command == 'list':
+        for key, version, size, created_at, last_access in cache.entries(args.namespace):
+            print(f"{_format_time(last_access)}  {size:>10,}  {version:<40}  {key}")
+    else:
+        keep_version = None
+        if args.stale:
+            conn = sqlite3.connect(str(DB_PATH))
+            keep_version = persistent_version(conn)
+            conn.close()
+            if keep_version is None:
+                parser.error("the analytics database has no data version yet; purge without --stale")
+        print(f"Purged {cache.purge(args.namespace, keep_version):,} cache entries")
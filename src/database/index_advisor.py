@@ -0,0 +1,321 @@
+"""
+Index advisor driven by saved segments
+
+Compiles every saved segment in the segments table, captures its
+EXPLAIN QUERY PLAN, tallies full scans of hits by the columns of the
+container subqueries that scan, and proposes covering indexes on hits
+(leading filter columns followed by user_key/session_key, which is all a
+container subquery reads).
+With apply=True the indexes are created on every hits storage table and the
+plan and latency of each segment are measured again.
+
+Usage (from the project root):
+    python src/database/index_advisor.py            # report and propose
+    python src/database/index_advisor.py --apply    # also create the indexes
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import statistics
+import sys
+import time
+from pathlib import Path
+
+try:
+    from .partitions import hits_storage_tables
+except ImportError:
+    from partitions import hits_storage_tables
+
+EQUALITY_OPERATORS = {'equals'}
+# 'starts with' compiles to LIKE, which is case-insensitive by default and so
+# can't use a B-tree index on a BINARY column
+RANGE_OPERATORS = {
+    'is greater than', 'is less than', 'is greater than or equal to',
+    'is less than or equal to', 'is between'
+}
+
+# Appended to every proposal so container subqueries never touch the table
+COVERING_COLUMNS = ['user_key', 'session_key']
+
+# Leading filter columns per proposed index
+MAX_KEY_COLUMNS = 3
+
+_HITS_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+hits(?:_\w+)?\s+(?:AS\s+)?([A-Za-z_]\w*)", re.IGNORECASE)
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(.*)$")
+
+
+def load_saved_segments(conn, compile_segment):
+    """Return [{'name', 'definition', 'sql'}] for every saved segment
+
+    compile_segment turns a segment definition into SQL; when it fails the
+    stored sql_query (if the table has one) is used instead.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(segments)")]
+    if not columns:
+        return []
+    stored_sql = 'sql_query' if 'sql_query' in columns else 'NULL'
+
+    segments = []
+    for name, definition, sql in conn.execute(f"SELECT name, definition, {stored_sql} FROM segments ORDER BY name"):
+        try:
+            definition = json.loads(definition) if isinstance(definition, str) else definition
+            sql = compile_segment(definition) or sql
+        except Exception as e:
+            print(f"Could not compile segment '{name}': {e}")
+        if sql and not sql.lstrip().startswith('--'):
+            segments.append({'name': name, 'definition': definition, 'sql': sql})
+    return segments
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN detail lines for a query"""
+    return [detail for _, _, detail in explain_rows(conn, sql)]
+
+
+def explain_rows(conn, sql):
+    """EXPLAIN QUERY PLAN as (id, parent, detail) rows"""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def hits_scans(plan, sql, hits_tables):
+    """Plan lines that walk a whole hits table or one of its indexes"""
+    names = {name.lower() for name in hits_tables} | {'hits'}
+    names |= {alias.lower() for alias in _HITS_ALIAS.findall(sql)}
+    scans = []
+    for detail in plan:
+        match = _SCAN.match(detail)
+        if match and match.group(1).lower() in names:
+            scans.append(detail)
+    return scans
+
+
+def container_scans(rows, sql, hits_tables, container_count):
+    """Hits scans per container subquery, or None if the plan can't be matched up
+
+    Container subqueries are compiled into one compound SELECT (INTERSECT or
+    UNION), whose members appear in the plan in container order; a single
+    container is the only subquery of the plan.
+    """
+    children = {}
+    for row_id, parent, detail in rows:
+        children.setdefault(parent, []).append((row_id, detail))
+
+    def subtree(row_id):
+        details = []
+        for child_id, detail in children.get(row_id, []):
+            details.append(detail)
+            details.extend(subtree(child_id))
+        return details
+
+    compound = [row_id for row_id, _, detail in rows if detail == 'COMPOUND QUERY']
+    if compound:
+        members = [row_id for row_id, _ in children.get(compound[0], [])]
+    elif container_count == 1:
+        # Everything below the outer hit selection belongs to the one container
+        members = [row_id for row_id, _ in children.get(0, []) if children.get(row_id)]
+        return [hits_scans([d for member in members for d in subtree(member)], sql, hits_tables)]
+    else:
+        return None
+    if len(members) != container_count:
+        return None
+    return [hits_scans(subtree(member), sql, hits_tables) for member in members]
+
+
+def measure_latency(conn, sql, repeat=3):
+    """Median wall time in milliseconds to fully evaluate a query"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(f"SELECT COUNT(*) FROM ({sql}) AS advised").fetchone()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _container_predicates(container, hits_columns):
+    """Yield (equality columns, range columns) per container, children included"""
+    equality, ranges = [], []
+    for condition in container.get('conditions', []):
+        field = condition.get('field')
+        if field not in hits_columns:
+            continue
+        operator = condition.get('operator', 'equals')
+        if operator in EQUALITY_OPERATORS:
+            equality.append(field)
+        elif operator in RANGE_OPERATORS:
+            ranges.append(field)
+
+    logic = container.get('logic', 'and').lower()
+    if logic == 'or' or not container.get('include', True):
+        # OR-ed or negated conditions are only indexable one column at a time
+        for field in equality + ranges:
+            yield [field], []
+    elif equality or ranges:
+        yield sorted(set(equality)), sorted(set(ranges))
+
+    for child in container.get('children', []) or []:
+        yield from _container_predicates(child, hits_columns)
+
+
+def _existing_leading_columns(conn, table):
+    """Column lists of the indexes already defined on a table"""
+    existing = []
+    for _, index_name, *_ in conn.execute(f"PRAGMA index_list({table})"):
+        existing.append([row[2] for row in conn.execute(f"PRAGMA index_info({index_name})")])
+    return existing
+
+
+def compiled_containers(definition):
+    """Containers that compile to a subquery (the compiler skips empty ones)"""
+    return [container for container in definition.get('containers', []) if container.get('conditions')]
+
+
+def scanned_containers(report):
+    """Containers of a report whose own subquery scans hits
+
+    When the plan can't be matched up with the containers, every container of
+    a segment with a hits scan is counted.
+    """
+    containers = compiled_containers(report['definition'])
+    per_container = report.get('container_scans')
+    if per_container is None:
+        return containers if report['scans'] else []
+    return [container for container, scans in zip(containers, per_container) if scans]
+
+
+def propose_indexes(conn, reports):
+    """Turn the scan tally into covering index proposals on hits"""
+    template = hits_storage_tables(conn)[-1]
+    hits_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({template})")}
+    covering = [column for column in COVERING_COLUMNS if column in hits_columns]
+    existing = _existing_leading_columns(conn, template)
+
+    tally = {}
+    for report in reports:
+        for container in scanned_containers(report):
+            for equality, ranges in _container_predicates(container, hits_columns):
+                for column in equality + ranges:
+                    tally.setdefault(column, set()).add(report['name'])
+
+    proposals = {}
+    for report in reports:
+        for container in scanned_containers(report):
+            for equality, ranges in _container_predicates(container, hits_columns):
+                # Most frequently scanned equality columns first, one range column last
+                key = sorted(equality, key=lambda c: (-len(tally[c]), c))[:MAX_KEY_COLUMNS]
+                if ranges and len(key) < MAX_KEY_COLUMNS:
+                    key.append(max(ranges, key=lambda c: (len(tally[c]), c)))
+                if not key:
+                    continue
+                columns = key + [c for c in covering if c not in key]
+                if any(index[:len(columns)] == columns for index in existing):
+                    continue
+                proposal = proposals.setdefault(tuple(columns), {
+                    'name': 'idx_hits_' + '_'.join(key) + '_cover',
+                    'columns': columns,
+                    'segments': set()
+                })
+                proposal['segments'].add(report['name'])
+
+    ranked = sorted(proposals.values(), key=lambda p: (-len(p['segments']), p['name']))
+    for proposal in ranked:
+        proposal['segments'] = sorted(proposal['segments'])
+    return {column: len(names) for column, names in tally.items()}, ranked
+
+
+def create_indexes(conn, proposals):
+    """Create proposed indexes on every hits storage table"""
+    for table in hits_storage_tables(conn):
+        suffix = table[len('hits'):]
+        for proposal in proposals:
+            columns = ', '.join(proposal['columns'])
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {proposal['name']}{suffix} ON {table}({columns})")
+        # Without statistics the planner keeps preferring the user_key index for DISTINCT
+        conn.execute(f"ANALYZE {table}")
+    conn.commit()
+
+
+def advise_indexes(conn, segments, apply=False, repeat=3):
+    """Explain and time every segment, propose indexes and optionally apply them"""
+    hits_tables = hits_storage_tables(conn)
+    reports = []
+    for segment in segments:
+        rows = explain_rows(conn, segment['sql'])
+        plan = [detail for _, _, detail in rows]
+        definition = segment['definition'] or {}
+        reports.append({
+            'name': segment['name'],
+            'definition': definition,
+            'sql': segment['sql'],
+            'plan': plan,
+            'scans': hits_scans(plan, segment['sql'], hits_tables),
+            'container_scans': container_scans(
+                rows, segment['sql'], hits_tables, len(compiled_containers(definition))
+            ),
+            'latency_ms': measure_latency(conn, segment['sql'], repeat)
+        })
+
+    scan_counts, proposals = propose_indexes(conn, reports)
+
+    if apply and proposals:
+        create_indexes(conn, proposals)
+        for report in reports:
+            report['plan_after'] = explain(conn, report['sql'])
+            report['scans_after'] = hits_scans(report['plan_after'], report['sql'], hits_tables)
+            report['latency_after_ms'] = measure_latency(conn, report['sql'], repeat)
+
+    return {'segments': reports, 'scan_counts': scan_counts, 'proposals': proposals, 'applied': bool(apply and proposals)}
+
+
+def print_report(result):
+    """Print an advisor result to stdout"""
+    for report in result['segments']:
+        print(f"\n=== {report['name']} ===")
+        print(f"Plan ({report['latency_ms']:.1f} ms):")
+        for detail in report['plan']:
+            print(f"  {detail}")
+        if 'plan_after' in report:
+            print(f"Plan after ({report['latency_after_ms']:.1f} ms):")
+            for detail in report['plan_after']:
+                print(f"  {detail}")
+
+    print("\nFull scans of hits by filtered column:")
+    if not result['scan_counts']:
+        print("  none")
+    for column, count in sorted(result['scan_counts'].items(), key=lambda item: -item[1]):
+        print(f"  {column}: {count} segment(s)")
+
+    print("\nProposed indexes:")
+    if not result['proposals']:
+        print("  none")
+    for proposal in result['proposals']:
+        columns = ', '.join(proposal['columns'])
+        print(f"  CREATE INDEX {proposal['name']} ON hits({columns});  -- {len(proposal['segments'])} segment(s)")
+
+    if result['applied']:
+        print("\nLatency per segment (ms):")
+        for report in result['segments']:
+            before, after = report['latency_ms'], report['latency_after_ms']
+            speedup = before / after if after else float('inf')
+            print(f"  {report['name']}: {before:.1f} -> {after:.1f} ({speedup:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose hits indexes from saved segment query plans")
+    parser.add_argument('--apply', action='store_true', help="create the proposed indexes and re-measure")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per query (median is reported)")
+    args = parser.parse_args()
+
+    # Saved segments are compiled with the API's compiler, which lives at the project root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    from fastapi_backend import build_sql_from_segment
+
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    segments = load_saved_segments(conn, build_sql_from_segment)
+    if not segments:
+        print("No saved segments to analyze")
+    else:
+        print_report(advise_indexes(conn, segments, apply=args.apply, repeat=args.repeat))
+    conn.close()
@@ -0,0 +1,488 @@
+"""
+Bulk loading of hit logs into the hits table
+
+Hits are read from CSV, NDJSON (one JSON object per line) or Parquet files
+in batches and inserted with executemany, one transaction per file. During
+the load the database runs with synchronous=OFF and an in-memory journal,
+and the secondary indexes on hits are dropped and rebuilt once at the end.
+Surrogate keys are then assigned and the sessions and users the new hits
+belong to are rolled up. Hits arrive late and out of order, so a hit of
+a session that was already rolled up is counted as late, and only the
+affected sessions and users are recomputed from all their hits instead
+of rebuilding the rollup tables. The new hits are then merged into the
+sketches and value dictionary, so the cost follows the size of the load
+rather than of the hits table.
+
+Input columns are matched by name against the hits schema
+(init_db.create_tables); timestamp, user_id and session_id are required,
+unknown columns are ignored and rows without a valid timestamp are skipped.
+
+Re-running an ingest does not double-count hits:
+- Every loaded file is recorded in ingest_manifest by its SHA-256, in the
+  same transaction as its hits, so files that were already loaded are
+  skipped without looking at hits (--force loads them again).
+- With --dedup-key COLUMN the input column holding a natural event id is
+  stored in hits.event_id, which has a unique index on every hits storage
+  table, and batches are inserted with INSERT OR IGNORE, so events that
+  were already loaded (from another file or a forced reload) are dropped.
+  Rows without an event id are always inserted. On a partitioned database
+  the index is per partition, i.e. an event has to keep its timestamp.
+
+Usage (from the project root):
+    python src/database/ingest.py hits-2024-01.csv more/*.ndjson archive.parquet
+    python src/database/ingest.py --batch-rows 100000 logs/*.csv
+    python src/database/ingest.py --dedup-key event_id feed/*.ndjson
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    from .init_db import create_tables, drop_secondary_indexes, insert_frame, refresh_derived_tables, upgrade_schema
+    from .compact_schema import rebuild_compact_view
+    from .partitions import hits_storage_tables, is_compact, is_partitioned, rebuild_hits_view
+    from .result_cache import bump_ingest_watermark, create_meta_table
+    from .sampling import sample_bucket_for
+except ImportError:
+    from init_db import create_tables, drop_secondary_indexes, insert_frame, refresh_derived_tables, upgrade_schema
+    from compact_schema import rebuild_compact_view
+    from partitions import hits_storage_tables, is_compact, is_partitioned, rebuild_hits_view
+    from result_cache import bump_ingest_watermark, create_meta_table
+    from sampling import sample_bucket_for
+
+DB_PATH = Path("data/analytics.db")
+
+DEFAULT_BATCH_ROWS = 50000
+
+REQUIRED_COLUMNS = ('timestamp', 'user_id', 'session_id')
+# Assigned by the database or by upgrade_schema, never taken from input
+COMPUTED_COLUMNS = ('hit_id', 'user_key', 'session_key')
+# hits column holding the natural dedup key of an event
+DEDUP_COLUMN = 'event_id'
+# meta key: hit_id up to which sessions and users are rolled up
+ROLLUP_MARK_KEY = 'hits_rollup_mark'
+
+# End of a hit (timestamp + time_on_page), keeping the timestamp's fraction of a second
+HIT_END_SQL = "datetime(timestamp, '+' || COALESCE(time_on_page, 0) || ' seconds') || substr(timestamp, 20)"
+
+FORMATS = {
+    '.csv': 'csv',
+    '.json': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.ndjson': 'ndjson',
+    '.parquet': 'parquet',
+    '.pq': 'parquet'
+}
+
+
+def detect_format(path):
+    """'csv', 'ndjson' or 'parquet' from a file's extension"""
+    suffixes = [suffix.lower() for suffix in Path(path).suffixes]
+    if suffixes and suffixes[-1] in ('.gz', '.bz2', '.xz', '.zst') and len(suffixes) > 1:
+        suffixes.pop()
+    file_format = FORMATS.get(suffixes[-1] if suffixes else '')
+    if file_format is None:
+        raise ValueError(f"Cannot tell the format of {path}; expected one of {', '.join(sorted(FORMATS))}")
+    return file_format
+
+
+def hits_columns(conn):
+    """Columns of hits that input files may provide"""
+    return [row[1] for row in conn.execute("PRAGMA table_info(hits)") if row[1] not in COMPUTED_COLUMNS]
+
+
+def _read_frames(path, file_format, wanted, text_columns, batch_rows):
+    if file_format == 'csv':
+        yield from pd.read_csv(path, chunksize=batch_rows, usecols=lambda column: column in wanted,
+                               dtype={column: str for column in text_columns})
+    elif file_format == 'ndjson':
+        for batch in pd.read_json(path, lines=True, chunksize=batch_rows, dtype=False, convert_dates=False):
+            yield batch[[column for column in batch.columns if column in wanted]]
+    elif file_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading Parquet files requires pyarrow (pip install pyarrow)")
+        parquet_file = pq.ParquetFile(path)
+        present = [name for name in parquet_file.schema_arrow.names if name in wanted]
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=present):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported format: {file_format}")
+
+
+def read_batches(path, file_format, columns, batch_rows=DEFAULT_BATCH_ROWS, dedup_key=None):
+    """Yield DataFrames of at most batch_rows rows, restricted to columns
+
+    The input column dedup_key, if given, is returned as DEDUP_COLUMN.
+    """
+    wanted = set(columns)
+    text_columns = ['user_id', 'session_id', DEDUP_COLUMN]
+    if dedup_key:
+        wanted.add(dedup_key)
+        text_columns.append(dedup_key)
+    for batch in _read_frames(path, file_format, wanted, text_columns, batch_rows):
+        if dedup_key and dedup_key not in batch.columns:
+            raise ValueError(f"Input is missing the dedup key column: {dedup_key}")
+        if dedup_key and dedup_key != DEDUP_COLUMN:
+            batch = batch.drop(columns=[DEDUP_COLUMN], errors='ignore').rename(columns={dedup_key: DEDUP_COLUMN})
+        yield batch
+
+
+def _parse_timestamps(series):
+    """Naive datetimes from ISO strings or epoch seconds; NaT where unparseable"""
+    if pd.api.types.is_numeric_dtype(series):
+        parsed = pd.to_datetime(series, unit='s', errors='coerce', utc=True)
+    else:
+        parsed = pd.to_datetime(series, errors='coerce', utc=True, format='ISO8601')
+    # Stored like the generator writes them: UTC without an offset
+    return parsed.dt.tz_localize(None)
+
+
+def prepare_batch(batch, columns):
+    """Validate and normalize one batch; returns (rows to insert, skipped count)"""
+    missing = [column for column in REQUIRED_COLUMNS if column not in batch.columns]
+    if missing:
+        raise ValueError(f"Input is missing required column(s): {', '.join(missing)}")
+
+    batch = batch.copy()
+    batch['timestamp'] = _parse_timestamps(batch['timestamp'])
+    valid = batch['timestamp'].notna() & batch['user_id'].notna() & batch['session_id'].notna()
+    skipped = int((~valid).sum())
+    batch = batch[valid]
+
+    batch['user_id'] = batch['user_id'].astype(str)
+    batch['session_id'] = batch['session_id'].astype(str)
+    if DEDUP_COLUMN in batch.columns:
+        batch[DEDUP_COLUMN] = batch[DEDUP_COLUMN].map(lambda value: None if pd.isna(value) else str(value))
+    if 'sample_bucket' not in batch.columns or batch['sample_bucket'].isna().any():
+        buckets = {user_id: sample_bucket_for(user_id) for user_id in batch['user_id'].unique()}
+        batch['sample_bucket'] = batch['user_id'].map(buckets)
+    return batch[[column for column in columns if column in batch.columns]], skipped
+
+
+def collect_affected_keys(conn, first_hit_id):
+    """Fill temp.rollup_sessions/rollup_users with the keys of hits after first_hit_id
+
+    Returns the number of those hits that arrived late, i.e. belong to a
+    session that was already rolled up.
+    """
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_sessions (session_key INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_users (user_key INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.rollup_sessions")
+    cursor.execute("DELETE FROM temp.rollup_users")
+    cursor.execute(
+        "INSERT INTO temp.rollup_sessions SELECT DISTINCT session_key FROM hits WHERE hit_id > ?",
+        (first_hit_id,)
+    )
+    cursor.execute(
+        "INSERT INTO temp.rollup_users SELECT DISTINCT user_key FROM hits WHERE hit_id > ?",
+        (first_hit_id,)
+    )
+    return cursor.execute("""
+        SELECT COUNT(*) FROM hits
+        WHERE hit_id > ? AND session_key IN (SELECT session_key FROM sessions)
+    """, (first_hit_id,)).fetchone()[0]
+
+
+def duration_sql(end, start):
+    """Whole seconds from start to end, rounded down like the generator's durations"""
+    return f"CAST((julianday({end}) - julianday({start})) * 86400 + 0.0001 AS INTEGER)"
+
+
+def rollup_affected_sessions_and_users(conn):
+    """Recompute the sessions and users rows listed in temp.rollup_sessions/rollup_users
+
+    Only the affected rows are read and written: sessions are re-aggregated
+    from all their hits (including late ones) and users from their sessions.
+    A session lasts from its first hit to the end of the time on page of its
+    last one; the window of an existing session is only ever widened, since
+    generated sessions can start before their first recorded hit (and users
+    be first seen before their first session). Rows that do not exist yet
+    are inserted. Returns (sessions, users).
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO sessions
+            (session_id, user_id, session_key, user_key, start_time, end_time, total_hits, total_revenue,
+             session_duration, pages_viewed)
+        SELECT MIN(session_id), MIN(user_id), session_key, MIN(user_key), MIN(timestamp), MAX({HIT_END_SQL}),
+               COUNT(*), COALESCE(SUM(revenue), 0),
+               {duration_sql('MAX(' + HIT_END_SQL + ')', 'MIN(timestamp)')},
+               COUNT(DISTINCT page_url)
+        FROM hits
+        WHERE session_key IN (SELECT session_key FROM temp.rollup_sessions)
+        GROUP BY session_key
+        ON CONFLICT(session_key) DO UPDATE SET
+            start_time = MIN(start_time, excluded.start_time),
+            end_time = MAX(end_time, excluded.end_time),
+            total_hits = excluded.total_hits,
+            total_revenue = excluded.total_revenue,
+            session_duration = {duration_sql('MAX(end_time, excluded.end_time)',
+                                             'MIN(start_time, excluded.start_time)')},
+            pages_viewed = excluded.pages_viewed
+    """)
+    sessions = cursor.rowcount
+    # user_type is not derived from hits and is kept
+    cursor.execute("""
+        INSERT INTO users
+            (user_id, user_key, first_seen, last_seen, total_sessions, total_revenue, total_orders,
+             avg_session_duration)
+        SELECT MIN(s.user_id), s.user_key, MIN(s.start_time), MAX(s.end_time), COUNT(*), SUM(s.total_revenue),
+               (SELECT COALESCE(SUM(h.revenue > 0), 0) FROM hits h WHERE h.user_key = s.user_key),
+               SUM(s.session_duration) / COUNT(*)
+        FROM sessions s
+        WHERE s.user_key IN (SELECT user_key FROM temp.rollup_users)
+        GROUP BY s.user_key
+        ON CONFLICT(user_key) DO UPDATE SET
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen),
+            total_sessions = excluded.total_sessions,
+            total_revenue = excluded.total_revenue,
+            total_orders = excluded.total_orders,
+            avg_session_duration = excluded.avg_session_duration
+    """)
+    users = cursor.rowcount
+    return sessions, users
+
+
+def dedup_index_name(table):
+    """Unique index on DEDUP_COLUMN of a hits storage table (idx_hits_event_id, idx_hits_event_id_202401, ...)"""
+    return f"idx_hits_{DEDUP_COLUMN}{table[len('hits'):]}"
+
+
+def ensure_dedup_key(conn):
+    """Add DEDUP_COLUMN and its unique index to every hits storage table"""
+    cursor = conn.cursor()
+    added = False
+    for table in hits_storage_tables(conn):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if DEDUP_COLUMN not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {DEDUP_COLUMN} TEXT")
+            added = True
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {dedup_index_name(table)}
+            ON {table}({DEDUP_COLUMN}) WHERE {DEDUP_COLUMN} IS NOT NULL
+        """)
+
+    if added and is_partitioned(conn):
+        rebuild_hits_view(conn)
+    elif added and is_compact(conn):
+        rebuild_compact_view(conn)
+    conn.commit()
+    if added:
+        bump_ingest_watermark(conn)
+
+
+def create_manifest_table(cursor):
+    """Create the ingest_manifest table of loaded files"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+        file_hash TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        duplicates INTEGER NOT NULL,
+        skipped INTEGER NOT NULL,
+        loaded_at TEXT NOT NULL
+    )
+    """)
+
+
+def file_hash(path, chunk_bytes=1 << 20):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_file_loaded(conn, fingerprint):
+    return conn.execute("SELECT 1 FROM ingest_manifest WHERE file_hash = ?", (fingerprint,)).fetchone() is not None
+
+
+def _max_hit_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(hit_id), 0) FROM hits").fetchone()[0]
+
+
+def get_rollup_mark(conn):
+    """hit_id up to which sessions and users are rolled up
+
+    A database without a mark is taken as rolled up to its last hit.
+    """
+    create_meta_table(conn.cursor())
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (ROLLUP_MARK_KEY,)).fetchone()
+    if row is not None:
+        return int(row[0])
+    mark = _max_hit_id(conn)
+    conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (ROLLUP_MARK_KEY, mark))
+    conn.commit()
+    return mark
+
+
+def roll_up_new_hits(conn):
+    """Roll up the hits past the rollup mark and advance it in the same transaction
+
+    Also picks up hits committed by an earlier ingest that failed before its
+    rollup. Returns (late hits, sessions, users), or None if nothing was new.
+    """
+    mark = get_rollup_mark(conn)
+    last_hit_id = _max_hit_id(conn)
+    if last_hit_id <= mark:
+        return None
+    # Keys first: compact rollup tables are clustered on them
+    upgrade_schema(conn)
+    late = collect_affected_keys(conn, mark)
+    print(f"Rolling up affected sessions and users ({late:,} late hits)...")
+    sessions, users = rollup_affected_sessions_and_users(conn)
+    conn.execute("UPDATE meta SET value = ? WHERE key = ?", (last_hit_id, ROLLUP_MARK_KEY))
+    conn.commit()
+    return late, sessions, users
+
+
+def load_file(conn, path, columns, batch_rows=DEFAULT_BATCH_ROWS, dedup_key=None, fingerprint=None):
+    """Insert one file's hits in a single transaction; returns (loaded, skipped, duplicates)
+
+    When hits has DEDUP_COLUMN, rows whose event id is already stored are
+    dropped and counted as duplicates. With a fingerprint the file is
+    recorded in ingest_manifest in the same transaction.
+    """
+    file_format = detect_format(path)
+    conflict = 'IGNORE' if DEDUP_COLUMN in columns else None
+    cursor = conn.cursor()
+    loaded = skipped = duplicates = 0
+    started = time.perf_counter()
+    try:
+        for batch in read_batches(path, file_format, columns, batch_rows, dedup_key):
+            rows, rejected = prepare_batch(batch, columns)
+            # total_changes also counts rows written by the hits view triggers
+            before = conn.total_changes
+            insert_frame(cursor, 'hits', rows, conflict)
+            inserted = conn.total_changes - before
+            loaded += inserted
+            duplicates += len(rows) - inserted
+            skipped += rejected
+            elapsed = time.perf_counter() - started
+            print(f"  {path}: {loaded:,} rows ({loaded / max(elapsed, 1e-9):,.0f} rows/s)")
+        if fingerprint:
+            cursor.execute(
+                "INSERT OR REPLACE INTO ingest_manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, str(path), Path(path).stat().st_size, loaded, duplicates, skipped,
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return loaded, skipped, duplicates
+
+
+def ingest_files(conn, paths, batch_rows=DEFAULT_BATCH_ROWS, dedup_key=None, force=False):
+    """Load hit files and bring sessions, users and derived tables up to date
+
+    Files already in ingest_manifest are skipped unless force is set. With a
+    dedup_key, that input column is stored as DEDUP_COLUMN and rows with an
+    event id that is already loaded are dropped. Hits past the rollup mark
+    are rolled up even if no file is loaded, so re-running after a failure
+    completes the rollup of the files that were committed.
+
+    Returns {'files', 'already_loaded', 'rows', 'skipped', 'duplicates', 'late',
+    'sessions', 'users', 'seconds'} where sessions and users count the rollup
+    rows inserted or recomputed.
+    """
+    started = time.perf_counter()
+    create_tables(conn.cursor())
+    create_manifest_table(conn.cursor())
+    if dedup_key:
+        ensure_dedup_key(conn)
+    conn.commit()
+    columns = hits_columns(conn)
+    get_rollup_mark(conn)
+
+    summary = {'files': 0, 'already_loaded': 0, 'rows': 0, 'skipped': 0, 'duplicates': 0, 'late': 0,
+               'sessions': 0, 'users': 0}
+    pending = []
+    for path in paths:
+        fingerprint = file_hash(path)
+        if fingerprint in (queued for _, queued in pending) or (not force and is_file_loaded(conn, fingerprint)):
+            print(f"  {path}: already loaded, skipping")
+            summary['already_loaded'] += 1
+            continue
+        pending.append((path, fingerprint))
+    if pending:
+        synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA journal_mode = MEMORY")
+
+        # The dedup indexes have to be there while inserting
+        tables = hits_storage_tables(conn)
+        index_sql = drop_secondary_indexes(conn.cursor(), tables, keep=[dedup_index_name(table) for table in tables])
+        conn.commit()
+        try:
+            for path, fingerprint in pending:
+                loaded, skipped, duplicates = load_file(conn, path, columns, batch_rows, dedup_key, fingerprint)
+                summary['files'] += 1
+                summary['rows'] += loaded
+                summary['skipped'] += skipped
+                summary['duplicates'] += duplicates
+        except Exception:
+            # Files loaded before the failure are committed
+            if summary['rows']:
+                bump_ingest_watermark(conn)
+            raise
+        finally:
+            print("Building indexes...")
+            for sql in index_sql:
+                conn.execute(sql)
+            conn.commit()
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            conn.execute(f"PRAGMA synchronous = {synchronous}")
+
+        load_seconds = time.perf_counter() - started
+        print(f"Loaded {summary['rows']:,} hits in {load_seconds:.1f}s "
+              f"({summary['rows'] / max(load_seconds, 1e-9):,.0f} rows/s)")
+
+    rollup = roll_up_new_hits(conn)
+    if rollup:
+        summary['late'], summary['sessions'], summary['users'] = rollup
+        refresh_derived_tables(conn, incremental=True)
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load hits from CSV, NDJSON or Parquet files")
+    parser.add_argument('files', nargs='+', help="input files (.csv, .ndjson/.jsonl, .parquet)")
+    parser.add_argument('--db', default=str(DB_PATH), help="database to load into")
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help="rows per executemany batch")
+    parser.add_argument('--dedup-key', metavar='COLUMN',
+                        help=f"input column with a unique event id, stored as hits.{DEDUP_COLUMN} and deduplicated")
+    parser.add_argument('--force', action='store_true', help="load files again that are already in the manifest")
+    args = parser.parse_args()
+
+    for path in args.files:
+        if not Path(path).exists():
+            parser.error(f"{path} does not exist")
+        try:
+            detect_format(path)
+        except ValueError as e:
+            parser.error(str(e))
+
+    Path(args.db).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(args.db)
+    summary = ingest_files(conn, args.files, args.batch_rows, args.dedup_key, args.force)
+    conn.close()
+    print(f"Ingested {summary['rows']:,} hits from {summary['files']} file(s), "
+          f"{summary['already_loaded']} already loaded "
+          f"({summary['skipped']:,} rows skipped, {summary['duplicates']:,} duplicates, {summary['late']:,} late), "
+          f"rolled up {summary['sessions']:,} sessions and {summary['users']:,} users in {summary['seconds']}s")
@@ -1,20 +1,85 @@
+import argparse
 import sqlite3
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
-from datetime import datetime, timedelta
-import random
+from datetime import datetime
 import numpy as np
+import yaml
 
-def initialize_database():
-    """Initialize the SQLite database with tables and sample data"""
+try:
+    from .sketches import build_hll_sketches, merge_hll_sketches
+    from .sampling import ensure_sample_buckets, sample_bucket_for
+    from .partitions import hits_storage_tables, is_compact, is_partitioned
+    from .compact_schema import migrate_to_compact
+    from .surrogate_keys import encode_surrogate_keys, next_surrogate_keys, register_surrogate_keys
+    from .result_cache import bump_ingest_watermark, create_meta_table, ensure_database_id
+    from .stats_snapshot import refresh_stats_snapshot
+    from .value_dictionary import build_value_dictionary, merge_value_dictionary
+except ImportError:
+    from sketches import build_hll_sketches, merge_hll_sketches
+    from sampling import ensure_sample_buckets, sample_bucket_for
+    from partitions import hits_storage_tables, is_compact, is_partitioned
+    from compact_schema import migrate_to_compact
+    from surrogate_keys import encode_surrogate_keys, next_surrogate_keys, register_surrogate_keys
+    from result_cache import bump_ingest_watermark, create_meta_table, ensure_database_id
+    from stats_snapshot import refresh_stats_snapshot
+    from value_dictionary import build_value_dictionary, merge_value_dictionary
+
+CONFIG_PATH = Path(__file__).resolve().parents[2] / "config.yaml"
+BENCHMARK_DIR = Path("data/benchmarks")
+
+DEFAULT_DATABASE_SETTINGS = {'path': 'data/analytics.db', 'scale_factor': 1}
+
+# SF1; every scale factor keeps the per-user shape (sessions, hits, date span)
+USERS_PER_SCALE_FACTOR = 10000
+# Benchmark datasets are seeded and dated to a fixed "now", so rebuilding a
+# scale factor gives the same data
+BENCHMARK_SEED = 20240101
+BENCHMARK_NOW = datetime(2024, 1, 1)
+
+SCALE_FACTOR_KEY = 'sample_scale_factor'
+SEED_KEY = 'sample_seed'
+REFERENCE_TIME_KEY = 'sample_reference_time'
+
+def database_settings(config_path=CONFIG_PATH):
+    """database section of config.yaml merged over the defaults"""
+    try:
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f) or {}
+    except Exception:
+        config = {}
+    settings = dict(DEFAULT_DATABASE_SETTINGS)
+    settings.update(config.get('database') or {})
+    return settings
+
+def scale_factor_users(scale_factor):
+    """Number of users of a scale factor (SF1 = USERS_PER_SCALE_FACTOR)"""
+    num_users = int(round(float(scale_factor) * USERS_PER_SCALE_FACTOR))
+    if num_users < 1:
+        raise ValueError(f"Scale factor {scale_factor} yields no users")
+    return num_users
+
+def benchmark_db_path(scale_factor):
+    """Benchmark database of a scale factor, e.g. data/benchmarks/sf10.db"""
+    return BENCHMARK_DIR / f"sf{float(scale_factor):g}.db"
+
+def initialize_database(db_path=None, scale_factor=None, seed=None, workers=None, compact=False, now=None):
+    """Initialize the SQLite database with tables and sample data
+
+    db_path and scale_factor default to the database section of
+    config.yaml; sample data is only generated into an empty database,
+    dated back from now (default: the current time).
+    compact converts it to the compact layout (see compact_schema.py).
+    """
+    settings = database_settings()
+    db_path = Path(db_path or settings['path'])
+    scale_factor = scale_factor if scale_factor is not None else settings['scale_factor']
     
     # Create data directory
-    data_dir = Path("data")
-    data_dir.mkdir(exist_ok=True)
-    
-    # Database path
-    db_path = data_dir / "analytics.db"
+    db_path.parent.mkdir(parents=True, exist_ok=True)
     
     # Connect to database
     conn = sqlite3.connect(str(db_path))
@@ -27,14 +92,66 @@ def initialize_database():
     cursor.execute("SELECT COUNT(*) FROM hits")
     if cursor.fetchone()[0] == 0:
         # Generate sample data
-        print("Generating sample data...")
-        generate_sample_data(conn)
+        num_users = scale_factor_users(scale_factor)
+        print(f"Generating sample data (SF{float(scale_factor):g}, {num_users:,} users)...")
+        now = now or datetime.now()
+        generate_sample_data(conn, num_users, seed=seed, workers=workers or os.cpu_count() or 1, now=now)
+        record_scale_factor(conn, scale_factor, seed, now)
+        refresh_derived_tables(conn)
+    
+    # Backfill columns added after the database was first created
+    upgrade_schema(conn)
+    
+    if compact and migrate_to_compact(conn):
+        print("Converted to the compact layout")
     
     conn.commit()
     conn.close()
     
     print(f"Database initialized at: {db_path}")
 
+def record_scale_factor(conn, scale_factor, seed, now):
+    """Remember how the sample data was generated, for benchmark reports"""
+    cursor = conn.cursor()
+    create_meta_table(cursor)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [
+            (SCALE_FACTOR_KEY, f"{float(scale_factor):g}"),
+            (SEED_KEY, None if seed is None else str(seed)),
+            (REFERENCE_TIME_KEY, now.isoformat(sep=' '))
+        ]
+    )
+    conn.commit()
+
+def upgrade_schema(conn):
+    """Add and backfill columns introduced after a database was created"""
+    ensure_sample_buckets(conn)
+    encode_surrogate_keys(conn)
+    ensure_database_id(conn)
+
+def refresh_derived_tables(conn, incremental=False):
+    """Rebuild side tables derived from hits after a data load
+
+    incremental merges only the hits added since the last refresh into the
+    sketches and value dictionary, and leaves the statistics snapshot to be
+    refreshed in the background once it shows as stale.
+    """
+    if incremental:
+        print("Merging new hits into HyperLogLog sketches...")
+        merge_hll_sketches(conn)
+        print("Merging new hits into field value dictionary...")
+        merge_value_dictionary(conn)
+        bump_ingest_watermark(conn)
+        return
+    print("Building HyperLogLog sketches...")
+    build_hll_sketches(conn)
+    print("Building field value dictionary...")
+    build_value_dictionary(conn)
+    bump_ingest_watermark(conn)
+    print("Computing database statistics snapshot...")
+    refresh_stats_snapshot(conn)
+
 def create_tables(cursor):
     """Create the necessary tables"""
     
@@ -45,6 +162,8 @@ def create_tables(cursor):
         timestamp DATETIME NOT NULL,
         user_id TEXT NOT NULL,
         session_id TEXT NOT NULL,
+        user_key INTEGER,
+        session_key INTEGER,
         page_url TEXT,
         page_title TEXT,
         page_type TEXT,
@@ -60,20 +179,24 @@ def create_tables(cursor):
         products_viewed INTEGER DEFAULT 0,
         cart_additions INTEGER DEFAULT 0,
         time_on_page INTEGER DEFAULT 0,
-        bounce INTEGER DEFAULT 0
+        bounce INTEGER DEFAULT 0,
+        sample_bucket INTEGER
     )
     """)
     
-    # Create indexes for hits table
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hits_timestamp ON hits(timestamp)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hits_user_id ON hits(user_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hits_session_id ON hits(session_id)")
+    # Create indexes for hits table (partitions and the compact table carry
+    # their own, and the user_key/session_key indexes are created by
+    # encode_surrogate_keys)
+    if not is_partitioned(cursor.connection) and not is_compact(cursor.connection):
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_hits_timestamp ON hits(timestamp)")
     
     # Sessions table
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS sessions (
         session_id TEXT PRIMARY KEY,
         user_id TEXT NOT NULL,
+        session_key INTEGER,
+        user_key INTEGER,
         start_time DATETIME NOT NULL,
         end_time DATETIME NOT NULL,
         total_hits INTEGER DEFAULT 0,
@@ -91,6 +214,7 @@ def create_tables(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id TEXT PRIMARY KEY,
+        user_key INTEGER,
         first_seen DATETIME NOT NULL,
         last_seen DATETIME NOT NULL,
         user_type TEXT,
@@ -117,155 +241,358 @@ def create_tables(cursor):
     )
     """)
 
-def generate_sample_data(conn):
-    """Generate sample analytics data"""
-    
-    # Configuration
-    num_users = 10000
-    avg_sessions_per_user = 5
-    avg_hits_per_session = 10
-    days_back = 30
-    
-    # Reference data
-    browsers = ['Chrome', 'Firefox', 'Safari', 'Edge', 'Other']
-    browser_weights = [0.65, 0.15, 0.10, 0.08, 0.02]
-    
-    devices = ['Desktop', 'Mobile', 'Tablet']
-    device_weights = [0.50, 0.40, 0.10]
-    
-    countries = ['US', 'UK', 'CA', 'AU', 'DE', 'FR', 'JP', 'IN']
-    country_weights = [0.40, 0.15, 0.10, 0.08, 0.07, 0.07, 0.07, 0.06]
-    
-    traffic_sources = ['Direct', 'Organic', 'Paid', 'Social', 'Email', 'Referral']
-    source_weights = [0.25, 0.30, 0.20, 0.10, 0.10, 0.05]
-    
-    page_types = ['Home', 'Category', 'Product', 'Search', 'Checkout', 'Account']
-    page_weights = [0.20, 0.25, 0.30, 0.10, 0.05, 0.10]
-    
-    # Generate data
-    hits_data = []
-    sessions_data = []
-    users_data = []
-    
-    # Generate users
-    for i in range(num_users):
-        user_id = f"user_{i:06d}"
-        first_seen = datetime.now() - timedelta(days=random.randint(0, days_back * 2))
-        user_type = random.choice(['New', 'Returning', 'Registered'])
-        
-        user_sessions = []
-        user_revenue = 0
-        user_orders = 0
-        
-        # Generate sessions for user
-        num_sessions = max(1, int(np.random.poisson(avg_sessions_per_user)))
-        for j in range(num_sessions):
-            session_id = f"{user_id}_session_{j}"
-            session_start = first_seen + timedelta(
-                days=random.randint(0, days_back),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59)
+# Reference data: (values, weights); weights of None mean uniform
+BROWSERS = (['Chrome', 'Firefox', 'Safari', 'Edge', 'Other'], [0.65, 0.15, 0.10, 0.08, 0.02])
+DEVICES = (['Desktop', 'Mobile', 'Tablet'], [0.50, 0.40, 0.10])
+COUNTRIES = (['US', 'UK', 'CA', 'AU', 'DE', 'FR', 'JP', 'IN'], [0.40, 0.15, 0.10, 0.08, 0.07, 0.07, 0.07, 0.06])
+TRAFFIC_SOURCES = (['Direct', 'Organic', 'Paid', 'Social', 'Email', 'Referral'], [0.25, 0.30, 0.20, 0.10, 0.10, 0.05])
+PAGE_TYPES = (['Home', 'Category', 'Product', 'Search', 'Checkout', 'Account'], [0.20, 0.25, 0.30, 0.10, 0.05, 0.10])
+TRAFFIC_MEDIUMS = (['cpc', 'organic', 'email', 'social', 'none'], None)
+USER_TYPES = (['New', 'Returning', 'Registered'], None)
+
+AVG_SESSIONS_PER_USER = 5
+AVG_HITS_PER_SESSION = 10
+DAYS_BACK = 30
+
+# Users generated and inserted per shard (about 50 hits each)
+CHUNK_USERS = 5000
+
+_MINUTE = np.timedelta64(60, 's')
+_HOUR = np.timedelta64(3600, 's')
+_DAY = np.timedelta64(86400, 's')
+
+
+def _draw(rng, reference, size):
+    """Indexes into reference values drawn with its weights"""
+    values, weights = reference
+    return rng.choice(len(values), size=size, p=weights)
+
+
+def _group_max(values, starts):
+    """Maximum of each contiguous group beginning at starts"""
+    return np.maximum.reduceat(values, starts)
+
+
+def generate_sample_frames(num_users, first_user_key=1, first_session_key=1, rng=None, now=None, first_user=0):
+    """hits, sessions and users DataFrames of synthetic traffic, built column by column
+
+    Every column is drawn for all rows at once; sessions belong to users and
+    hits to sessions through repeat() of their Poisson counts, and session
+    and user rollups are group-bys over those contiguous runs. first_user
+    numbers the user ids when a dataset is generated in several chunks.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    now = np.datetime64(now or datetime.now(), 'us')
+
+    # Users
+    user_index = np.arange(num_users)
+    user_ids = np.array([f"user_{first_user + i:06d}" for i in user_index], dtype=object)
+    user_keys = first_user_key + user_index
+    sample_buckets = np.array([sample_bucket_for(user_id) for user_id in user_ids])
+    first_seen = now - rng.integers(0, DAYS_BACK * 2, num_users, endpoint=True) * _DAY
+    user_types = np.array(USER_TYPES[0], dtype=object)[_draw(rng, USER_TYPES, num_users)]
+
+    # Sessions: a contiguous run per user
+    sessions_per_user = np.maximum(1, rng.poisson(AVG_SESSIONS_PER_USER, num_users))
+    num_sessions = int(sessions_per_user.sum())
+    session_user = np.repeat(user_index, sessions_per_user)
+    user_session_starts = np.concatenate(([0], np.cumsum(sessions_per_user)[:-1]))
+    session_number = np.arange(num_sessions) - np.repeat(user_session_starts, sessions_per_user)
+    session_ids = pd.Series(user_ids[session_user]) + "_session_" + pd.Series(session_number).astype(str)
+    session_keys = first_session_key + np.arange(num_sessions)
+    session_start = (
+        first_seen[session_user]
+        + rng.integers(0, DAYS_BACK, num_sessions, endpoint=True) * _DAY
+        + rng.integers(0, 23, num_sessions, endpoint=True) * _HOUR
+        + rng.integers(0, 59, num_sessions, endpoint=True) * _MINUTE
+    )
+
+    # Hits: a contiguous run per session
+    hits_per_session = np.maximum(1, rng.poisson(AVG_HITS_PER_SESSION, num_sessions))
+    num_hits = int(hits_per_session.sum())
+    hit_session = np.repeat(np.arange(num_sessions), hits_per_session)
+    hit_user = session_user[hit_session]
+    hit_time = session_start[hit_session] + rng.integers(0, 30, num_hits, endpoint=True) * _MINUTE
+
+    # Formatted columns index into small tables of every possible string
+    page_type = _draw(rng, PAGE_TYPES, num_hits)
+    page_names = PAGE_TYPES[0]
+    page_number = rng.integers(1, 100, num_hits, endpoint=True)
+    page_url_code = page_type * 100 + page_number - 1
+    page_urls = np.array([f"/{name.lower()}/{n}" for name in page_names for n in range(1, 101)], dtype=object)
+    page_titles = np.array([f"{name} Page {n}" for name in page_names for n in range(1, 101)], dtype=object)
+    title_code = page_type * 100 + rng.integers(0, 100, num_hits)
+    browser_versions = np.array([f"{v}.0" for v in range(80, 121)], dtype=object)
+    cities = np.array([f"City_{n}" for n in range(1, 51)], dtype=object)
+    campaigns = np.array([f"campaign_{n}" for n in range(1, 21)], dtype=object)
+
+    is_checkout = page_type == page_names.index('Checkout')
+    is_product = page_type == page_names.index('Product')
+    has_campaign = rng.random(num_hits) > 0.7
+    campaign = np.where(has_campaign, campaigns[rng.integers(0, 20, num_hits)], None)
+    revenue = np.where(is_checkout & (rng.random(num_hits) > 0.3), rng.uniform(10, 500, num_hits), 0.0)
+    products_viewed = np.where(is_product, rng.integers(1, 5, num_hits, endpoint=True), 0)
+    cart_additions = np.where(is_product & (rng.random(num_hits) > 0.5), rng.integers(1, 3, num_hits, endpoint=True), 0)
+    time_on_page = rng.integers(10, 300, num_hits, endpoint=True)
+    bounce = (hits_per_session[hit_session] == 1).astype(int)
+
+    hits_df = pd.DataFrame({
+        'timestamp': hit_time,
+        'user_id': user_ids[hit_user],
+        'session_id': session_ids.to_numpy(dtype=object)[hit_session],
+        'user_key': user_keys[hit_user],
+        'session_key': session_keys[hit_session],
+        'page_url': page_urls[page_url_code],
+        'page_title': page_titles[title_code],
+        'page_type': np.array(page_names, dtype=object)[page_type],
+        'browser_name': np.array(BROWSERS[0], dtype=object)[_draw(rng, BROWSERS, num_hits)],
+        'browser_version': browser_versions[rng.integers(0, len(browser_versions), num_hits)],
+        'device_type': np.array(DEVICES[0], dtype=object)[_draw(rng, DEVICES, num_hits)],
+        'country': np.array(COUNTRIES[0], dtype=object)[_draw(rng, COUNTRIES, num_hits)],
+        'city': cities[rng.integers(0, len(cities), num_hits)],
+        'traffic_source': np.array(TRAFFIC_SOURCES[0], dtype=object)[_draw(rng, TRAFFIC_SOURCES, num_hits)],
+        'traffic_medium': np.array(TRAFFIC_MEDIUMS[0], dtype=object)[_draw(rng, TRAFFIC_MEDIUMS, num_hits)],
+        'campaign': campaign,
+        'revenue': revenue,
+        'products_viewed': products_viewed,
+        'cart_additions': cart_additions,
+        'time_on_page': time_on_page,
+        'bounce': bounce,
+        'sample_bucket': sample_buckets[hit_user]
+    })
+
+    # Session rollups; a session ends after the time on page of its last hit
+    session_hit_starts = np.concatenate(([0], np.cumsum(hits_per_session)[:-1]))
+    last_hit = session_hit_starts + hits_per_session - 1
+    session_end = hit_time[last_hit] + time_on_page[last_hit] * np.timedelta64(1, 's')
+    session_duration = (session_end - session_start) // np.timedelta64(1, 's')
+    session_revenue = np.bincount(hit_session, weights=revenue, minlength=num_sessions)
+    page_keys = np.sort(hit_session * len(page_urls) + page_url_code)
+    distinct_pages = page_keys[np.concatenate(([True], page_keys[1:] != page_keys[:-1]))]
+    pages_viewed = np.bincount(distinct_pages // len(page_urls), minlength=num_sessions)
+
+    sessions_df = pd.DataFrame({
+        'session_id': session_ids,
+        'user_id': user_ids[session_user],
+        'session_key': session_keys,
+        'user_key': user_keys[session_user],
+        'start_time': session_start,
+        'end_time': session_end,
+        'total_hits': hits_per_session,
+        'total_revenue': session_revenue,
+        'session_duration': session_duration,
+        'pages_viewed': pages_viewed
+    })
+
+    # User rollups
+    users_df = pd.DataFrame({
+        'user_id': user_ids,
+        'user_key': user_keys,
+        'first_seen': first_seen,
+        'last_seen': _group_max(session_end, user_session_starts),
+        'user_type': user_types,
+        'total_sessions': sessions_per_user,
+        'total_revenue': np.bincount(session_user, weights=session_revenue, minlength=num_users),
+        'total_orders': np.bincount(hit_user, weights=revenue > 0, minlength=num_users).astype(int),
+        'avg_session_duration': np.add.reduceat(session_duration, user_session_starts) // sessions_per_user
+    })
+
+    return hits_df, sessions_df, users_df
+
+
+def _column_values(series):
+    """Python values of a column as sqlite3 binds them (timestamps as text)"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return [str(value) for value in series.dt.to_pydatetime()]
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def insert_frame(cursor, table, df, conflict=None):
+    """Insert a DataFrame with a single executemany
+
+    conflict is an optional conflict resolution ('IGNORE', 'REPLACE', ...).
+    """
+    columns = list(df.columns)
+    placeholders = ', '.join('?' for _ in columns)
+    verb = f"INSERT OR {conflict}" if conflict else "INSERT"
+    cursor.executemany(
+        f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        zip(*(_column_values(df[column]) for column in columns))
+    )
+
+
+def drop_secondary_indexes(cursor, tables, keep=()):
+    """Drop the explicit indexes of tables except those named in keep; returns their CREATE statements"""
+    placeholders = ', '.join('?' for _ in tables)
+    indexes = cursor.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+    """, list(tables)).fetchall()
+    indexes = [(name, sql) for name, sql in indexes if name not in keep]
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
+
+
+def _insert_frames(conn, hits_df, sessions_df, users_df):
+    """Insert generated frames and record their surrogate keys"""
+    cursor = conn.cursor()
+    insert_frame(cursor, 'hits', hits_df)
+    insert_frame(cursor, 'sessions', sessions_df)
+    insert_frame(cursor, 'users', users_df)
+    register_surrogate_keys(
+        conn,
+        zip(_column_values(users_df['user_key']), _column_values(users_df['user_id'])),
+        zip(*(_column_values(sessions_df[c]) for c in ['session_key', 'session_id', 'user_key']))
+    )
+
+
+def shard_tasks(num_users, first_user_key, chunk_users, seed, now):
+    """(num_users, first_user, first_user_key, seed_sequence, now) for every shard
+
+    Each shard of chunk_users users draws from its own child of the seed, so
+    a seeded dataset is the same however many processes generate it.
+    """
+    first_users = range(0, num_users, chunk_users)
+    seeds = np.random.SeedSequence(seed).spawn(len(first_users))
+    return [
+        (min(chunk_users, num_users - first_user), first_user, first_user_key + first_user, shard_seed, now)
+        for first_user, shard_seed in zip(first_users, seeds)
+    ]
+
+
+def _generate_shard(task, first_session_key=1):
+    """Frames of one shard; session keys start at first_session_key"""
+    num_users, first_user, first_user_key, shard_seed, now = task
+    return generate_sample_frames(num_users, first_user_key, first_session_key,
+                                  np.random.default_rng(shard_seed), now, first_user)
+
+
+def _write_shard(args):
+    """Generate one shard into its own database file (runs in a worker process)"""
+    task, path = args
+    hits_df, sessions_df, users_df = _generate_shard(task)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    cursor = conn.cursor()
+    create_tables(cursor)
+    drop_secondary_indexes(cursor, ['hits', 'sessions', 'users'])
+    _insert_frames(conn, hits_df, sessions_df, users_df)
+    conn.commit()
+    conn.close()
+    return path, len(users_df), len(sessions_df), len(hits_df)
+
+
+def merge_shard(conn, path, session_key_offset):
+    """Copy a shard file into conn, shifting its session keys by session_key_offset
+
+    Must run outside a transaction (ATTACH cannot); commits the shard.
+    """
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        for table in ['hits', 'sessions', 'users']:
+            columns = [row[1] for row in conn.execute(f"PRAGMA shard.table_info({table})") if row[1] != 'hit_id']
+            select = ', '.join(
+                f"session_key + {session_key_offset}" if column == 'session_key' else column
+                for column in columns
             )
-            
-            session_hits = []
-            session_revenue = 0
-            
-            # Generate hits for session
-            num_hits = max(1, int(np.random.poisson(avg_hits_per_session)))
-            for k in range(num_hits):
-                hit_time = session_start + timedelta(minutes=random.randint(0, 30))
-                
-                page_type = np.random.choice(page_types, p=page_weights)
-                page_url = f"/{page_type.lower()}/{random.randint(1, 100)}"
-                page_title = f"{page_type} Page {random.randint(1, 100)}"
-                
-                # Generate hit data
-                hit = {
-                    'timestamp': hit_time,
-                    'user_id': user_id,
-                    'session_id': session_id,
-                    'page_url': page_url,
-                    'page_title': page_title,
-                    'page_type': page_type,
-                    'browser_name': np.random.choice(browsers, p=browser_weights),
-                    'browser_version': f"{random.randint(80, 120)}.0",
-                    'device_type': np.random.choice(devices, p=device_weights),
-                    'country': np.random.choice(countries, p=country_weights),
-                    'city': f"City_{random.randint(1, 50)}",
-                    'traffic_source': np.random.choice(traffic_sources, p=source_weights),
-                    'traffic_medium': random.choice(['cpc', 'organic', 'email', 'social', 'none']),
-                    'campaign': f"campaign_{random.randint(1, 20)}" if random.random() > 0.7 else None,
-                    'revenue': random.uniform(10, 500) if page_type == 'Checkout' and random.random() > 0.3 else 0,
-                    'products_viewed': random.randint(1, 5) if page_type == 'Product' else 0,
-                    'cart_additions': random.randint(1, 3) if page_type == 'Product' and random.random() > 0.5 else 0,
-                    'time_on_page': random.randint(10, 300),
-                    'bounce': 1 if k == 0 and num_hits == 1 else 0
-                }
-                
-                hits_data.append(hit)
-                session_hits.append(hit)
-                session_revenue += hit['revenue']
-                
-                if hit['revenue'] > 0:
-                    user_orders += 1
-            
-            # Create session record
-            session_end = session_hits[-1]['timestamp'] + timedelta(seconds=session_hits[-1]['time_on_page'])
-            session_duration = int((session_end - session_start).total_seconds())
-            
-            session = {
-                'session_id': session_id,
-                'user_id': user_id,
-                'start_time': session_start,
-                'end_time': session_end,
-                'total_hits': len(session_hits),
-                'total_revenue': session_revenue,
-                'session_duration': session_duration,
-                'pages_viewed': len(set(h['page_url'] for h in session_hits))
-            }
-            
-            sessions_data.append(session)
-            user_sessions.append(session)
-            user_revenue += session_revenue
-        
-        # Create user record
-        last_seen = max(s['end_time'] for s in user_sessions)
-        avg_duration = sum(s['session_duration'] for s in user_sessions) // len(user_sessions)
-        
-        user = {
-            'user_id': user_id,
-            'first_seen': first_seen,
-            'last_seen': last_seen,
-            'user_type': user_type,
-            'total_sessions': len(user_sessions),
-            'total_revenue': user_revenue,
-            'total_orders': user_orders,
-            'avg_session_duration': avg_duration
-        }
-        
-        users_data.append(user)
-        
-        # Progress indicator
-        if (i + 1) % 1000 == 0:
-            print(f"Generated data for {i + 1} users...")
-    
-    # Insert data into database
-    print("Inserting data into database...")
+            conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {select} FROM shard.{table}")
+        conn.execute("INSERT OR REPLACE INTO user_keys (user_key, user_id) SELECT user_key, user_id FROM shard.users")
+        conn.execute(f"""
+            INSERT OR REPLACE INTO session_keys (session_key, session_id, user_key)
+            SELECT session_key + {session_key_offset}, session_id, user_key FROM shard.sessions
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+
+def generate_sample_data(conn, num_users=10000, seed=None, chunk_users=CHUNK_USERS, workers=1, now=None):
+    """Generate sample analytics data
+
+    Users are generated in shards of chunk_users, so memory stays flat
+    however many users are requested, and the indexes on hits, sessions
+    and users are dropped first and rebuilt once at the end. Each shard has
+    its own seed derived from seed, so the same seed and now give the same
+    data for any number of workers.
+
+    With one worker the shards are inserted in a single transaction. With
+    more, a process pool writes each shard to a temporary database file next
+    to the target, and the files are merged in shard order as they finish,
+    one transaction per shard.
+    """
+    now = now or datetime.now()
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    cursor = conn.cursor()
     
-    # Convert to DataFrames
-    hits_df = pd.DataFrame(hits_data)
-    sessions_df = pd.DataFrame(sessions_data)
-    users_df = pd.DataFrame(users_data)
+    # Integer surrogate keys are assigned here rather than backfilled
+    first_user_key, next_session_key = next_surrogate_keys(conn)
+    conn.commit()
+    tasks = shard_tasks(num_users, first_user_key, chunk_users, seed, now)
     
-    # Insert into database
-    hits_df.to_sql('hits', conn, if_exists='append', index=False)
-    sessions_df.to_sql('sessions', conn, if_exists='append', index=False)
-    users_df.to_sql('users', conn, if_exists='append', index=False)
+    totals = {'users': 0, 'sessions': 0, 'hits': 0}
+    index_sql = drop_secondary_indexes(cursor, hits_storage_tables(conn) + ['sessions', 'users'])
+    try:
+        if workers <= 1 or len(tasks) == 1 or not db_path:
+            for task in tasks:
+                hits_df, sessions_df, users_df = _generate_shard(task, next_session_key)
+                _insert_frames(conn, hits_df, sessions_df, users_df)
+                next_session_key += len(sessions_df)
+                totals['users'] += len(users_df)
+                totals['sessions'] += len(sessions_df)
+                totals['hits'] += len(hits_df)
+                print(f"Inserted data for {totals['users']:,} of {num_users:,} users...")
+                del hits_df, sessions_df, users_df
+        else:
+            conn.commit()
+            shard_dir = tempfile.TemporaryDirectory(prefix='shards-', dir=Path(db_path).parent)
+            with shard_dir, ProcessPoolExecutor(max_workers=workers) as pool:
+                paths = [str(Path(shard_dir.name) / f"shard_{i:05d}.db") for i in range(len(tasks))]
+                for path, users, sessions, hits in pool.map(_write_shard, zip(tasks, paths)):
+                    merge_shard(conn, path, next_session_key - 1)
+                    os.remove(path)
+                    next_session_key += sessions
+                    totals['users'] += users
+                    totals['sessions'] += sessions
+                    totals['hits'] += hits
+                    print(f"Merged data for {totals['users']:,} of {num_users:,} users...")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        print("Building indexes...")
+        for sql in index_sql:
+            cursor.execute(sql)
+        conn.commit()
     
     print(f"Sample data generation complete!")
-    print(f"- Users: {len(users_data):,}")
-    print(f"- Sessions: {len(sessions_data):,}")
-    print(f"- Hits: {len(hits_data):,}")
+    print(f"- Users: {totals['users']:,}")
+    print(f"- Sessions: {totals['sessions']:,}")
+    print(f"- Hits: {totals['hits']:,}")
 
 if __name__ == "__main__":
-    initialize_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create the analytics database with sample data")
+    parser.add_argument('--scale-factor', type=float,
+                        help=f"generate a benchmark dataset of SF x {USERS_PER_SCALE_FACTOR:,} users "
+                             f"into {BENCHMARK_DIR}/sf<N>.db (default: database.scale_factor into database.path)")
+    parser.add_argument('--db', help="database file to create instead")
+    parser.add_argument('--seed', type=int, help="random seed (benchmark datasets default to a fixed one)")
+    parser.add_argument('--workers', type=int, help="generator processes (default: one per CPU)")
+    parser.add_argument('--compact', action='store_true',
+                        help="use the compact layout (epoch timestamps, WITHOUT ROWID rollups)")
+    args = parser.parse_args()
+
+    db_path = args.db
+    seed = args.seed
+    now = None
+    if args.scale_factor is not None and db_path is None:
+        db_path = benchmark_db_path(args.scale_factor)
+        seed = BENCHMARK_SEED if seed is None else seed
+        now = BENCHMARK_NOW
+    if db_path is not None and Path(db_path).exists():
+        parser.error(f"{db_path} already exists; remove it to regenerate")
+    initialize_database(db_path, args.scale_factor, seed, args.workers, args.compact, now)
\ No newline at end of file
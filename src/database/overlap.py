@@ -0,0 +1,81 @@
+"""
+Pairwise overlap of segments from compact membership sets
+
+Each segment is evaluated once into three bitmaps (Python ints) over
+user_key, session_key and hit_id. Shared visitors, sessions and hits of any
+pair are then popcounts of bitwise ANDs, so an N x N matrix costs N queries
+instead of N^2.
+"""
+
+# Comparing more segments than this in one request is almost certainly a mistake
+MAX_OVERLAP_SEGMENTS = 50
+
+OVERLAP_LEVELS = [('visitors', 'user_key'), ('sessions', 'session_key'), ('hits', 'hit_id')]
+
+
+def _popcount(bits):
+    """Number of set bits (int.bit_count needs Python 3.10)"""
+    try:
+        return bits.bit_count()
+    except AttributeError:
+        return bin(bits).count('1')
+
+
+def membership_sql(hits_sql):
+    """Wrap a hit-level segment query so it yields (user_key, session_key, hit_id)"""
+    return f"""
+    SELECT m.user_key, m.session_key, m.hit_id
+    FROM ({hits_sql}) AS segment_hits
+    JOIN hits m ON m.hit_id = segment_hits.hit_id
+    """
+
+
+def keys_to_bitmap(keys):
+    """Bitmap (int) with the bit of every non-negative integer key set"""
+    keys = [key for key in keys if key is not None]
+    # Setting bits in a bytearray is linear; OR-ing ints one bit at a time is not
+    buffer = bytearray(max(keys) // 8 + 1 if keys else 0)
+    for value in keys:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def bitmap_to_keys(bits):
+    """Ascending keys whose bit is set"""
+    keys = []
+    for index, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            keys.append(index * 8 + low.bit_length() - 1)
+            byte ^= low
+    return keys
+
+
+def evaluate_membership(conn, sql):
+    """Run a membership query once and return {level: bitmap}"""
+    rows = conn.execute(sql).fetchall()
+    return {
+        level: keys_to_bitmap(row[position] for row in rows)
+        for position, (level, _) in enumerate(OVERLAP_LEVELS)
+    }
+
+
+def overlap_matrix(conn, segments):
+    """Pairwise overlap of [(name, membership query)] segments
+
+    Returns {'segments': names, level: N x N counts} for visitors, sessions
+    and hits; the diagonal holds each segment's own size.
+    """
+    names = [name for name, _ in segments]
+    memberships = [evaluate_membership(conn, sql) for _, sql in segments]
+
+    result = {'segments': names}
+    for level, _ in OVERLAP_LEVELS:
+        bitmaps = [membership[level] for membership in memberships]
+        matrix = [[0] * len(bitmaps) for _ in bitmaps]
+        for i, left in enumerate(bitmaps):
+            matrix[i][i] = _popcount(left)
+            for j in range(i + 1, len(bitmaps)):
+                matrix[i][j] = matrix[j][i] = _popcount(left & bitmaps[j])
+        result[level] = matrix
+    return result
@@ -0,0 +1,184 @@
+"""
+Streaming Parquet export of tables and segment results
+
+Rows are fetched from a cursor batch_rows at a time and each batch is
+written as one Parquet row group, so memory use depends on the batch size
+and the projected columns, not on how many rows are exported. Column types
+come from the SQLite storage class of each column (INTEGER -> int64,
+REAL -> float64, TEXT -> string, BLOB -> binary). Requires pyarrow.
+
+Usage (from the project root):
+    python src/database/parquet_export.py table hits exports/hits.parquet --columns user_key,timestamp,revenue
+    python src/database/parquet_export.py segment "High Value Customers" exports/high_value.parquet
+    python src/database/parquet_export.py segment <segment_id> exports/high_value_hits.parquet --hits
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+DB_PATH = Path("data/analytics.db")
+
+DEFAULT_BATCH_ROWS = 100000
+
+# SQLite storage classes (typeof()) to Arrow type names
+_ARROW_TYPES = {
+    'integer': 'int64',
+    'real': 'float64',
+    'text': 'string',
+    'blob': 'binary'
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def column_types(conn, sql, columns, first_rows):
+    """Arrow type name of each result column
+
+    Taken from the first rows; columns that are NULL there are looked up with
+    one typeof() query each, and stay strings if they are NULL throughout.
+    A column holding both integers and reals is exported as float64.
+    """
+    types = {}
+    for index, column in enumerate(columns):
+        seen = {type(row[index]) for row in first_rows if row[index] is not None}
+        if not seen:
+            row = conn.execute(
+                f'SELECT typeof("{column}") FROM ({sql}) AS export_rows WHERE "{column}" IS NOT NULL LIMIT 1'
+            ).fetchone()
+            types[column] = _ARROW_TYPES.get(row[0] if row else 'text', 'string')
+        elif float in seen:
+            types[column] = 'float64'
+        elif seen == {int}:
+            types[column] = 'int64'
+        elif seen == {bytes}:
+            types[column] = 'binary'
+        else:
+            types[column] = 'string'
+    return types
+
+
+def _to_array(pa, values, arrow_type):
+    """Arrow array of values, coercing the odd value SQLite's loose typing lets through"""
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+        if pa.types.is_string(arrow_type):
+            values = [None if value is None else str(value) for value in values]
+        elif pa.types.is_floating(arrow_type):
+            values = [None if value is None else float(value) for value in values]
+        else:
+            raise ValueError(f"Cannot export values {values[:3]!r}... as {arrow_type}")
+        return pa.array(values, type=arrow_type)
+
+
+def export_query(conn, sql, destination, params=(), batch_rows=DEFAULT_BATCH_ROWS, compression='zstd'):
+    """Write the rows of a query to a Parquet file or writable binary file object
+
+    Returns the number of rows written.
+    """
+    pa, pq = _pyarrow()
+    cursor = conn.execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+    rows = cursor.fetchmany(batch_rows)
+    types = column_types(conn, sql, columns, rows)
+    schema = pa.schema([(column, getattr(pa, types[column])()) for column in columns])
+
+    written = 0
+    started = time.perf_counter()
+    with pq.ParquetWriter(destination, schema, compression=compression) as writer:
+        while rows:
+            arrays = [_to_array(pa, values, field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema), row_group_size=batch_rows)
+            written += len(rows)
+            if isinstance(destination, (str, Path)):
+                elapsed = time.perf_counter() - started
+                print(f"  {destination}: {written:,} rows ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+            rows = cursor.fetchmany(batch_rows)
+    return written
+
+
+def projection(columns):
+    """SELECT list for a column projection (None = every column)"""
+    if not columns:
+        return '*'
+    return ', '.join(f'"{column}"' for column in columns)
+
+
+def table_sql(table, columns=None):
+    """Query exporting a whole table in storage order"""
+    return f'SELECT {projection(columns)} FROM "{table}"'
+
+
+def segment_members_sql(segment_sql, columns=None):
+    """Query exporting a segment result query without a display LIMIT"""
+    return f"SELECT {projection(columns)} FROM ({segment_sql}) AS segment_rows"
+
+
+def segment_hits_sql(membership_sql, columns=None):
+    """Query exporting the hits of a segment from its membership query"""
+    select = ', '.join(f'h."{column}"' for column in columns) if columns else 'h.*'
+    return f"""
+        SELECT {select}
+        FROM hits h
+        WHERE h.hit_id IN (SELECT hit_id FROM ({membership_sql}) AS segment_members)
+    """
+
+
+def find_saved_segment(conn, name_or_id):
+    """Definition of a saved segment by id or name, or None"""
+    row = conn.execute(
+        "SELECT definition FROM segments WHERE CAST(segment_id AS TEXT) = ? OR name = ? ORDER BY segment_id LIMIT 1",
+        (str(name_or_id), str(name_or_id))
+    ).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]) if isinstance(row[0], str) else row[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export tables or segment results to Parquet")
+    parser.add_argument('kind', choices=['table', 'segment'])
+    parser.add_argument('source', help="table name, or saved segment id or name")
+    parser.add_argument('output', help="Parquet file to write")
+    parser.add_argument('--columns', help="comma-separated columns to export (default: all)")
+    parser.add_argument('--hits', action='store_true', help="export the segment's hits instead of its members")
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help="rows per row group")
+    args = parser.parse_args()
+
+    columns = [column.strip() for column in args.columns.split(',')] if args.columns else None
+    conn = sqlite3.connect(str(DB_PATH))
+
+    if args.kind == 'table':
+        sql = table_sql(args.source, columns)
+    else:
+        # Segments are compiled like the preview compiles them, from the project root
+        sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+        from src.utils.query_builder import build_membership_sql, build_sql_from_segment
+
+        definition = find_saved_segment(conn, args.source)
+        if definition is None:
+            parser.error(f"No saved segment with id or name '{args.source}'")
+        segment_sql = build_membership_sql(definition) if args.hits else build_sql_from_segment(definition)
+        if segment_sql.lstrip().startswith('--'):
+            parser.error(f"Segment '{args.source}' has no conditions")
+        if args.hits:
+            sql = segment_hits_sql(segment_sql, columns)
+        else:
+            sql = segment_members_sql(segment_sql, columns)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    rows = export_query(conn, sql, args.output, batch_rows=args.batch_rows)
+    conn.close()
+    print(f"Exported {rows:,} rows to {args.output} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,336 @@
+"""
+Monthly partitioning of the hits table
+
+Partitioned databases store hits in one table per month (hits_YYYYMM) plus a
+hits_default catch-all for rows outside every partition. A hits view unions
+the partitions so existing SQL keeps working, and INSTEAD OF triggers route
+INSERT/UPDATE/DELETE statements on the view to the partition tables.
+
+Queries with a date range are rewritten by apply_date_range() so every hits
+reference reads only the partitions overlapping the range.
+
+Compact databases (see compact_schema.py) store hits in the single table
+hits_data with integer epoch timestamps behind a hits view; they are listed
+as a one-table catalog and their date ranges compile to epoch predicates.
+"""
+
+import calendar
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+try:
+    from .result_cache import bump_ingest_watermark
+except ImportError:
+    from result_cache import bump_ingest_watermark
+
+DEFAULT_PARTITION = 'hits_default'
+COMPACT_TABLE = 'hits_data'
+
+# SQL keywords that can follow "FROM hits" and must not be taken as an alias
+_NOT_ALIASES = (
+    'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'ON',
+    'USING', 'GROUP', 'ORDER', 'LIMIT', 'UNION', 'INTERSECT', 'EXCEPT', 'HAVING', 'WINDOW'
+)
+_HITS_REFERENCE = re.compile(
+    r"\b(FROM|JOIN)\s+hits\b(?:\s+(?:AS\s+)?(?!(?:%s)\b)([A-Za-z_]\w*))?" % '|'.join(_NOT_ALIASES),
+    re.IGNORECASE
+)
+
+
+def create_partition_catalog(cursor):
+    """Create the hit_partitions catalog table"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS hit_partitions (
+        name TEXT PRIMARY KEY,
+        start_ts TEXT,
+        end_ts TEXT
+    )
+    """)
+
+
+def is_compact(conn):
+    """True when hits is the view over the compact hits_data table"""
+    return bool(conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (COMPACT_TABLE,)
+    ).fetchone())
+
+
+def is_partitioned(conn):
+    """True when hits is the partition view rather than a plain table"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'hits'").fetchone()
+    return bool(row) and row[0] == 'view' and not is_compact(conn)
+
+
+def load_partition_catalog(conn, skip_empty_default=False):
+    """Return [(name, start_ts, end_ts)] ordered by start, default partition last
+
+    skip_empty_default drops the catch-all partition when it holds no rows,
+    which is what query pruning wants. A compact database is the single
+    entry (COMPACT_TABLE, None, None).
+    """
+    if is_compact(conn):
+        return [(COMPACT_TABLE, None, None)]
+    if not is_partitioned(conn):
+        return None
+    catalog = conn.execute("""
+        SELECT name, start_ts, end_ts FROM hit_partitions
+        ORDER BY start_ts IS NULL, start_ts
+    """).fetchall()
+    if skip_empty_default and not conn.execute(f"SELECT 1 FROM {DEFAULT_PARTITION} LIMIT 1").fetchone():
+        catalog = [entry for entry in catalog if entry[0] != DEFAULT_PARTITION]
+    return catalog
+
+
+def hits_storage_tables(conn):
+    """Physical tables holding hit rows"""
+    catalog = load_partition_catalog(conn)
+    if catalog is None:
+        return ['hits']
+    return [name for name, _, _ in catalog]
+
+
+def _month_bounds(month):
+    """'YYYYMM' -> ('YYYY-MM-01', first day of the next month)"""
+    year, mon = int(month[:4]), int(month[4:])
+    start = date(year, mon, 1)
+    end = date(year + (mon == 12), mon % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def _partition_ddl(conn, name):
+    """CREATE TABLE statement for a partition, cloned from an existing hits table"""
+    template = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ('hits', ?) ORDER BY name = 'hits' DESC",
+        (DEFAULT_PARTITION,)
+    ).fetchone()
+    template_name, sql = template
+    sql = re.sub(r'^\s*CREATE TABLE\s+(IF NOT EXISTS\s+)?"?%s"?' % template_name,
+                 f'CREATE TABLE IF NOT EXISTS {name}', sql, count=1, flags=re.IGNORECASE)
+    # hit_id stays globally unique through the insert trigger, not per-partition sequences
+    return re.sub(r'\s+AUTOINCREMENT', '', sql, flags=re.IGNORECASE)
+
+
+def _create_partition(conn, name, index_sqls):
+    conn.execute(_partition_ddl(conn, name))
+    for index_name, sql in index_sqls:
+        suffix = name[len('hits'):]
+        partition_index = re.sub(r'\bhits\b', name, sql.replace(index_name, index_name + suffix, 1))
+        conn.execute(partition_index.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+
+
+def _template_indexes(conn):
+    """Index definitions of the unpartitioned table, written against 'hits'"""
+    template = 'hits' if not is_partitioned(conn) else DEFAULT_PARTITION
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (template,)
+    ).fetchall()
+    if template == 'hits':
+        return rows
+    # Strip the partition suffix back off
+    suffix = DEFAULT_PARTITION[len('hits'):]
+    return [
+        (name[:-len(suffix)], re.sub(r'\b%s\b' % DEFAULT_PARTITION, 'hits', sql.replace(name, name[:-len(suffix)], 1)))
+        for name, sql in rows
+    ]
+
+
+def rebuild_hits_view(conn):
+    """(Re)create the hits view and its routing triggers from the catalog"""
+    catalog = load_partition_catalog(conn) or conn.execute(
+        "SELECT name, start_ts, end_ts FROM hit_partitions ORDER BY start_ts IS NULL, start_ts"
+    ).fetchall()
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({DEFAULT_PARTITION})")]
+    column_list = ', '.join(columns)
+
+    conn.execute("DROP VIEW IF EXISTS hits")
+    union = '\nUNION ALL\n'.join(f"SELECT {column_list} FROM {name}" for name, _, _ in catalog)
+    conn.execute(f"CREATE VIEW hits AS\n{union}")
+
+    # Per-partition MAX lookups are O(1) on the rowid; MAX over the view is not
+    next_hit_id = "MAX(" + ", ".join(
+        f"COALESCE((SELECT MAX(hit_id) FROM {name}), 0)" for name, _, _ in catalog
+    ) + ", 0) + 1"
+
+    def new_values():
+        values = []
+        for column in columns:
+            if column == 'hit_id':
+                values.append(f"COALESCE(NEW.hit_id, {next_hit_id})")
+            else:
+                values.append(f"NEW.{column}")
+        return ', '.join(values)
+
+    routes = []
+    for name, start_ts, end_ts in catalog:
+        if start_ts is None:
+            condition = (
+                "NEW.timestamp IS NULL OR NOT EXISTS (SELECT 1 FROM hit_partitions "
+                "WHERE NEW.timestamp >= start_ts AND NEW.timestamp < end_ts)"
+            )
+        else:
+            condition = f"NEW.timestamp >= '{start_ts}' AND NEW.timestamp < '{end_ts}'"
+        routes.append(f"INSERT INTO {name} ({column_list}) SELECT {new_values()} WHERE {condition};")
+
+    assignments = ', '.join(f"{column} = NEW.{column}" for column in columns if column != 'hit_id')
+    updates = [f"UPDATE {name} SET {assignments} WHERE hit_id = OLD.hit_id;" for name, _, _ in catalog]
+    deletes = [f"DELETE FROM {name} WHERE hit_id = OLD.hit_id;" for name, _, _ in catalog]
+
+    for trigger, event, body in (
+        ('hits_insert', 'INSERT', routes),
+        ('hits_update', 'UPDATE', updates),
+        ('hits_delete', 'DELETE', deletes)
+    ):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute(
+            f"CREATE TRIGGER {trigger} INSTEAD OF {event} ON hits\nBEGIN\n    "
+            + '\n    '.join(body) + "\nEND"
+        )
+
+
+def partition_hits_by_month(conn):
+    """Convert a plain hits table into monthly partitions behind a view"""
+    if is_compact(conn):
+        raise ValueError("Compact databases cannot be partitioned")
+    if is_partitioned(conn):
+        return repartition_default(conn)
+
+    cursor = conn.cursor()
+    create_partition_catalog(cursor)
+    index_sqls = _template_indexes(conn)
+    months = [row[0] for row in cursor.execute(
+        "SELECT DISTINCT strftime('%Y%m', timestamp) FROM hits WHERE timestamp IS NOT NULL"
+    ) if row[0]]
+
+    conn.commit()
+    cursor.execute("BEGIN")
+    try:
+        # Default partition first: it is the template for all later partitions
+        _create_partition(conn, DEFAULT_PARTITION, index_sqls)
+        cursor.execute("INSERT OR REPLACE INTO hit_partitions VALUES (?, NULL, NULL)", (DEFAULT_PARTITION,))
+
+        for month in sorted(months):
+            name = f"hits_{month}"
+            start_ts, end_ts = _month_bounds(month)
+            _create_partition(conn, name, index_sqls)
+            cursor.execute(
+                f"INSERT INTO {name} SELECT * FROM hits WHERE timestamp >= ? AND timestamp < ?",
+                (start_ts, end_ts)
+            )
+            cursor.execute("INSERT OR REPLACE INTO hit_partitions VALUES (?, ?, ?)", (name, start_ts, end_ts))
+
+        cursor.execute(f"""
+            INSERT INTO {DEFAULT_PARTITION} SELECT * FROM hits
+            WHERE timestamp IS NULL OR strftime('%Y%m', timestamp) IS NULL
+        """)
+        cursor.execute("DROP TABLE hits")
+        rebuild_hits_view(conn)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    bump_ingest_watermark(conn)
+    return len(months)
+
+
+def repartition_default(conn):
+    """Move rows of the default partition into (new) monthly partitions"""
+    cursor = conn.cursor()
+    months = [row[0] for row in cursor.execute(
+        f"SELECT DISTINCT strftime('%Y%m', timestamp) FROM {DEFAULT_PARTITION} WHERE timestamp IS NOT NULL"
+    ) if row[0]]
+    if not months:
+        return 0
+
+    index_sqls = _template_indexes(conn)
+    conn.commit()
+    cursor.execute("BEGIN")
+    try:
+        for month in sorted(months):
+            name = f"hits_{month}"
+            start_ts, end_ts = _month_bounds(month)
+            _create_partition(conn, name, index_sqls)
+            cursor.execute("INSERT OR IGNORE INTO hit_partitions VALUES (?, ?, ?)", (name, start_ts, end_ts))
+            cursor.execute(
+                f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE timestamp >= ? AND timestamp < ?",
+                (start_ts, end_ts)
+            )
+            cursor.execute(
+                f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= ? AND timestamp < ?",
+                (start_ts, end_ts)
+            )
+        rebuild_hits_view(conn)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    bump_ingest_watermark(conn)
+    return len(months)
+
+
+def normalize_date_range(date_range):
+    """(start, end) dates, end inclusive -> ('YYYY-MM-DD', exclusive 'YYYY-MM-DD')"""
+    if not date_range or len(date_range) != 2:
+        return None
+
+    def as_date(value):
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.fromisoformat(str(value)[:10]).date()
+
+    start, end = as_date(date_range[0]), as_date(date_range[1])
+    return start.isoformat(), (end + timedelta(days=1)).isoformat()
+
+
+def epoch_seconds(day):
+    """'YYYY-MM-DD' -> Unix time of its midnight, matching strftime('%s', day)"""
+    return calendar.timegm(date.fromisoformat(day).timetuple())
+
+
+def hits_source_sql(start_ts, end_ts, catalog=None):
+    """Subquery over only the hits that can fall inside [start_ts, end_ts)"""
+    predicate = f"timestamp >= '{start_ts}' AND timestamp < '{end_ts}'"
+    if catalog is None:
+        return f"(SELECT * FROM hits WHERE {predicate})"
+    if catalog[0][0] == COMPACT_TABLE:
+        # Through the view, so hits keep their columns; ts is indexed
+        return f"(SELECT * FROM hits WHERE ts >= {epoch_seconds(start_ts)} AND ts < {epoch_seconds(end_ts)})"
+
+    tables = [
+        name for name, part_start, part_end in catalog
+        if part_start is None or (part_start < end_ts and part_end > start_ts)
+    ]
+    return "(" + " UNION ALL ".join(f"SELECT * FROM {name} WHERE {predicate}" for name in tables) + ")"
+
+
+def apply_date_range(sql, date_range, catalog=None):
+    """Restrict every hits reference in a query to a date range
+
+    date_range is an inclusive (start, end) pair of dates; catalog is the
+    result of load_partition_catalog() (None for an unpartitioned database).
+    """
+    bounds = normalize_date_range(date_range)
+    if not bounds:
+        return sql
+    source = hits_source_sql(*bounds, catalog=catalog)
+
+    def replace(match):
+        alias = match.group(2) or 'hits'
+        return f"{match.group(1)} {source} AS {alias}"
+
+    return _HITS_REFERENCE.sub(replace, sql)
+
+
+if __name__ == "__main__":
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    print("Partitioning hits by month...")
+    count = partition_hits_by_month(conn)
+    conn.close()
+    print(f"Created or filled {count} monthly partitions in {db_path}")
@@ -4,6 +4,11 @@ from pathlib import Path
 import json
 from datetime import datetime
 
+try:
+    from .value_dictionary import lookup_values
+except ImportError:
+    from value_dictionary import lookup_values
+
 def get_db_connection():
     """Get database connection"""
     db_path = Path("data/analytics.db")
@@ -146,8 +151,8 @@ def get_segment_statistics(segment_definition):
             conn = get_db_connection()
             # Get total counts
             total_hits = pd.read_sql_query("SELECT COUNT(*) as count FROM hits", conn).iloc[0]['count']
-            total_sessions = pd.read_sql_query("SELECT COUNT(DISTINCT session_id) as count FROM hits", conn).iloc[0]['count']
-            total_visitors = pd.read_sql_query("SELECT COUNT(DISTINCT user_id) as count FROM hits", conn).iloc[0]['count']
+            total_sessions = pd.read_sql_query("SELECT COUNT(DISTINCT session_key) as count FROM hits", conn).iloc[0]['count']
+            total_visitors = pd.read_sql_query("SELECT COUNT(DISTINCT user_key) as count FROM hits", conn).iloc[0]['count']
             conn.close()
             
             return {
@@ -169,8 +174,8 @@ def get_segment_statistics(segment_definition):
         
         # Get total counts first
         total_hits = pd.read_sql_query("SELECT COUNT(*) as count FROM hits", conn).iloc[0]['count']
-        total_sessions = pd.read_sql_query("SELECT COUNT(DISTINCT session_id) as count FROM hits", conn).iloc[0]['count']
-        total_visitors = pd.read_sql_query("SELECT COUNT(DISTINCT user_id) as count FROM hits", conn).iloc[0]['count']
+        total_sessions = pd.read_sql_query("SELECT COUNT(DISTINCT session_key) as count FROM hits", conn).iloc[0]['count']
+        total_visitors = pd.read_sql_query("SELECT COUNT(DISTINCT user_key) as count FROM hits", conn).iloc[0]['count']
         
         # Hit level count
         hit_query = f"""
@@ -213,10 +218,15 @@ def get_segment_statistics(segment_definition):
             'error': str(e)
         }
 
-def get_available_values(field_name, limit=100):
-    """Get available values for a given field"""
+def get_available_values(field_name, limit=100, prefix=None):
+    """Get available values for a given field, most frequent first"""
     conn = get_db_connection()
     try:
+        # Precomputed dictionary when available
+        rows = lookup_values(conn, field_name, prefix, limit)
+        if rows is not None:
+            return [row[0] for row in rows]
+        
         # Determine which table contains the field
         if field_name in ['user_id', 'user_type']:
             table = 'users'
@@ -229,12 +239,13 @@ def get_available_values(field_name, limit=100):
         SELECT DISTINCT {field_name} as value, COUNT(*) as count
         FROM {table}
         WHERE {field_name} IS NOT NULL
+          AND (? IS NULL OR {field_name} LIKE ? || '%')
         GROUP BY {field_name}
         ORDER BY count DESC
         LIMIT {limit}
         """
         
-        df = pd.read_sql_query(query, conn)
+        df = pd.read_sql_query(query, conn, params=(prefix, prefix))
         return df['value'].tolist()
     except Exception as e:
         return []
@@ -0,0 +1,252 @@
+"""
+Bounded, size-aware cache for segment preview results
+
+Entries are keyed by the canonical segment hash plus the parameters that
+shape the result (date range, sampling, limit) and stored pickled, so the
+byte budget is exact and callers can never mutate a cached value.
+
+The whole cache is dropped whenever the data may have changed: a dedicated
+long-lived connection polls SQLite's PRAGMA data_version (which moves on every
+commit made by any other connection or process) and the hits ingest watermark
+kept in the meta table (bumped by every data load).
+
+With a persistent store (disk_cache.DiskCache) entries are also written
+through to disk, tagged with the database id and ingest watermark, and
+memory misses are filled from it, so results survive process restarts.
+Every path that writes hits bumps the watermark, but a commit that does not
+(an external write, a load that failed halfway) would leave stale disk
+entries looking current: once data_version moves without the watermark,
+the disk store is bypassed until the watermark changes again.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from .canonical import segment_hash
+    from .disk_cache import DiskCache
+except ImportError:
+    from canonical import segment_hash
+    from disk_cache import DiskCache
+
+DB_PATH = Path("data/analytics.db")
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 256
+
+INGEST_WATERMARK_KEY = 'hits_ingest_watermark'
+DATABASE_ID_KEY = 'database_id'
+
+
+def create_meta_table(cursor):
+    """Create the meta key/value table"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+
+def get_meta_value(conn, key):
+    """Value stored under key in the meta table, or None"""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def set_meta_value(cursor, key, value):
+    """Store a meta value (committed by the caller)"""
+    create_meta_table(cursor)
+    cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def get_ingest_watermark(conn):
+    """Current hits ingest watermark (0 before the first recorded load)"""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (INGEST_WATERMARK_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0]) if row else 0
+
+
+def get_database_id(conn):
+    """Random id of this database, or None before ensure_database_id ran"""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (DATABASE_ID_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def ensure_database_id(conn):
+    """Give the database a random id, so a recreated file never matches old cache entries"""
+    cursor = conn.cursor()
+    create_meta_table(cursor)
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (DATABASE_ID_KEY, uuid.uuid4().hex))
+    conn.commit()
+    return get_database_id(conn)
+
+
+def persistent_version(conn):
+    """Data version that persisted cache entries are tagged with, or None if unknown"""
+    database_id = get_database_id(conn)
+    if database_id is None:
+        return None
+    return f"{database_id}:{get_ingest_watermark(conn)}"
+
+
+def bump_ingest_watermark(conn):
+    """Record that hits were loaded; invalidates every result cache"""
+    ensure_database_id(conn)
+    cursor = conn.cursor()
+    create_meta_table(cursor)
+    cursor.execute("""
+        INSERT INTO meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """, (INGEST_WATERMARK_KEY,))
+    conn.commit()
+    return get_ingest_watermark(conn)
+
+
+def cache_key(namespace, segment_definition, **params):
+    """Cache key for a segment result shaped by params (date range, limit, ...)"""
+    params = json.dumps(params, sort_keys=True, default=str)
+    return f"{namespace}:{segment_hash(segment_definition)}:{params}"
+
+
+class ResultCache:
+    """LRU cache bounded by entry count and pickled size"""
+
+    def __init__(self, db_path=DB_PATH, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 persistent=None):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_inode = None
+        self._token = None
+        self._disk_trusted = True
+
+    def _current_token(self):
+        """(inode, data_version, persistent version) of the database"""
+        try:
+            inode = os.stat(self.db_path).st_ino
+        except OSError:
+            return None
+
+        # A recreated database file needs a fresh watcher connection
+        if self._watcher is None or inode != self._watcher_inode:
+            if self._watcher is not None:
+                self._watcher.close()
+            self._watcher = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._watcher_inode = inode
+
+        data_version = self._watcher.execute("PRAGMA data_version").fetchone()[0]
+        return inode, data_version, persistent_version(self._watcher)
+
+    def _validate(self):
+        """Drop every entry if the database changed; return the current token"""
+        token = self._current_token()
+        if token != self._token:
+            # Disk entries are only tagged with the watermark, so they cannot
+            # tell a change that did not bump it
+            if self._token is not None and token is not None:
+                self._disk_trusted = token[2] != self._token[2]
+            self._entries.clear()
+            self._bytes = 0
+            self._token = token
+        return token
+
+    def token(self):
+        """Snapshot of the database state, to pass to put() after computing"""
+        with self._lock:
+            return self._validate()
+
+    def get(self, key, default=None):
+        with self._lock:
+            token = self._validate()
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+            elif self.persistent is not None and token is not None and self._disk_trusted:
+                blob = self.persistent.get(key, token[2])
+                if blob is not None:
+                    self._store(key, blob)
+            if blob is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return pickle.loads(blob)
+
+    def put(self, key, value, token=None):
+        """Store a value; skipped if the data changed since token was taken"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            current = self._validate()
+            if token is not None and token != current:
+                return
+            self._store(key, blob)
+            if self.persistent is not None and current is not None and self._disk_trusted:
+                self.persistent.put(key, blob, current[2])
+
+    def _store(self, key, blob):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        while self._entries and (
+            self._bytes + len(blob) > self.max_bytes or len(self._entries) >= self.max_entries
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+        self._entries[key] = blob
+        self._bytes += len(blob)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        token = self.token()
+        value = compute()
+        self.put(key, value, token)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Side database shared by every process using data/analytics.db
+disk_cache = DiskCache(DB_PATH.with_name("cache.db"))
+
+# Shared by every preview path in the process
+preview_cache = ResultCache(persistent=disk_cache)
@@ -0,0 +1,148 @@
+"""
+Deterministic hash-based user sampling for fast approximate previews
+
+Every hit carries a precomputed sample_bucket derived from a hash of its
+user_id, so a rate of 10% keeps exactly the users whose bucket is below
+10% of SAMPLE_BUCKETS. Because all hits of a user share a bucket, visit and
+visitor containers stay intact inside the sample. Totals are scaled back up
+with Horvitz-Thompson estimates and normal-approximation confidence intervals.
+"""
+
+import hashlib
+import math
+import sqlite3
+from pathlib import Path
+
+try:
+    from .partitions import hits_storage_tables, is_partitioned, rebuild_hits_view
+    from .result_cache import bump_ingest_watermark
+except ImportError:
+    from partitions import hits_storage_tables, is_partitioned, rebuild_hits_view
+    from result_cache import bump_ingest_watermark
+
+SAMPLE_BUCKETS = 1000
+
+# Offered in the preview UI, label -> fraction of users
+SAMPLE_RATES = {
+    'Exact': None,
+    '10% of users': 0.10,
+    '1% of users': 0.01
+}
+
+Z_95 = 1.96
+
+
+def sample_bucket_for(user_id):
+    """Stable bucket in [0, SAMPLE_BUCKETS) for a user id"""
+    digest = hashlib.md5(str(user_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % SAMPLE_BUCKETS
+
+
+def sample_threshold(rate):
+    """Number of buckets kept for a sampling rate"""
+    return min(SAMPLE_BUCKETS, max(1, int(round(rate * SAMPLE_BUCKETS))))
+
+
+def effective_rate(rate):
+    """Sampling rate actually applied after rounding to whole buckets"""
+    return sample_threshold(rate) / SAMPLE_BUCKETS
+
+
+def sample_filter_sql(rate, alias=None):
+    """SQL predicate restricting hits to the sampled users"""
+    column = f"{alias}.sample_bucket" if alias else "sample_bucket"
+    return f"{column} < {sample_threshold(rate)}"
+
+
+def ensure_sample_buckets(conn):
+    """Add and backfill the sample_bucket column on an existing hits table"""
+    cursor = conn.cursor()
+    added = backfilled = False
+    conn.create_function('sample_bucket_for', 1, sample_bucket_for, deterministic=True)
+
+    for table in hits_storage_tables(conn):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if 'sample_bucket' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN sample_bucket INTEGER")
+            added = True
+
+        if cursor.execute(f"SELECT 1 FROM {table} WHERE sample_bucket IS NULL LIMIT 1").fetchone():
+            cursor.execute(f"UPDATE {table} SET sample_bucket = sample_bucket_for(user_id) WHERE sample_bucket IS NULL")
+            backfilled = True
+
+        index_suffix = table[len('hits'):]
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_hits_sample_bucket{index_suffix} ON {table}(sample_bucket)")
+
+    if added and is_partitioned(conn):
+        rebuild_hits_view(conn)
+    conn.commit()
+    if added or backfilled:
+        bump_ingest_watermark(conn)
+
+
+def per_user_totals_sql(hits_sql, user_column='user_id', session_column='session_id'):
+    """Aggregate a hit-level query into the sums needed for scaled estimates"""
+    return f"""
+    SELECT COUNT(*), SUM(hits), SUM(hits * hits), SUM(sessions), SUM(sessions * sessions)
+    FROM (
+        SELECT {user_column}, COUNT(*) AS hits, COUNT(DISTINCT {session_column}) AS sessions
+        FROM ({hits_sql}) AS sampled_hits
+        GROUP BY {user_column}
+    ) AS sampled_users
+    """
+
+
+def grouped_totals_sql(per_user_sql, hits_column='hit_count', sessions_column='session_count'):
+    """Same sums as per_user_totals_sql for a query already grouped by user"""
+    return f"""
+    SELECT COUNT(*), SUM({hits_column}), SUM({hits_column} * {hits_column}),
+           SUM({sessions_column}), SUM({sessions_column} * {sessions_column})
+    FROM ({per_user_sql}) AS sampled_users
+    """
+
+
+def scale_total(total, sum_squares, rate):
+    """Scale a sampled total up with a 95% confidence interval
+
+    Users are sampled independently with probability rate, so the
+    Horvitz-Thompson estimate is total / rate with variance
+    (1 - rate) / rate^2 * sum of squared per-user values.
+    """
+    total = total or 0
+    sum_squares = sum_squares or 0
+    estimate = total / rate
+    margin = Z_95 * math.sqrt((1 - rate) * sum_squares) / rate
+    return {
+        'estimate': int(round(estimate)),
+        'lower': int(max(total, math.floor(estimate - margin))),
+        'upper': int(math.ceil(estimate + margin)),
+        'sampled': int(total)
+    }
+
+
+def summarize_sample(row, rate, max_users=None):
+    """Build scaled estimates from a per_user_totals_sql result row
+
+    max_users (the number of users) caps the user estimate and its interval.
+    """
+    rate = effective_rate(rate)
+    users, hits, hits_sq, sessions, sessions_sq = row
+    unique_users = scale_total(users, users, rate)
+    if max_users is not None:
+        unique_users = {key: min(value, max_users) for key, value in unique_users.items()}
+    return {
+        'rate': rate,
+        'confidence': 0.95,
+        'unique_users': unique_users,
+        'unique_sessions': scale_total(sessions, sessions_sq, rate),
+        'total_hits': scale_total(hits, hits_sq, rate)
+    }
+
+
+if __name__ == "__main__":
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    print("Backfilling sample buckets...")
+    ensure_sample_buckets(conn)
+    conn.close()
+    print(f"Sample buckets ready in {db_path}")
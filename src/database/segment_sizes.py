@@ -0,0 +1,142 @@
+"""
+Materialized visitor/session/hit counts of saved segments
+
+The segment library shows how big each saved segment is. Counting on page
+load would run one query per segment, so a batch job evaluates every
+segment once and stores its counts in segment_sizes, keyed by the canonical
+segment hash and tagged with the hits ingest watermark. The library then
+reads all sizes in a single query; rows from an older watermark are shown
+as stale until the next refresh.
+
+Usage (from the project root):
+    python src/database/segment_sizes.py            # compute missing/stale sizes
+    python src/database/segment_sizes.py --all      # recompute every size
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+try:
+    from .canonical import segment_hash
+    from .result_cache import get_ingest_watermark
+except ImportError:
+    from canonical import segment_hash
+    from result_cache import get_ingest_watermark
+
+
+def create_segment_sizes_table(cursor):
+    """Create the segment_sizes table"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS segment_sizes (
+        segment_hash TEXT PRIMARY KEY,
+        visitors INTEGER NOT NULL,
+        sessions INTEGER NOT NULL,
+        hits INTEGER NOT NULL,
+        ingest_watermark INTEGER NOT NULL,
+        computed_at TEXT NOT NULL
+    )
+    """)
+
+
+def count_segment(conn, membership_sql):
+    """(visitors, sessions, hits) of a query yielding (user_key, session_key, hit_id)"""
+    return conn.execute(f"""
+        SELECT COUNT(DISTINCT user_key), COUNT(DISTINCT session_key), COUNT(*)
+        FROM ({membership_sql}) AS segment_members
+    """).fetchone()
+
+
+def load_segment_sizes(conn):
+    """{segment_hash: {'visitors', 'sessions', 'hits', 'computed_at', 'stale'}} in one query"""
+    watermark = get_ingest_watermark(conn)
+    try:
+        rows = conn.execute(
+            "SELECT segment_hash, visitors, sessions, hits, ingest_watermark, computed_at FROM segment_sizes"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {
+        row[0]: {
+            'visitors': row[1],
+            'sessions': row[2],
+            'hits': row[3],
+            'computed_at': row[5],
+            'stale': row[4] != watermark
+        }
+        for row in rows
+    }
+
+
+def refresh_segment_sizes(conn, definitions, compile_membership, force=False):
+    """Compute and store sizes of segment definitions that are missing or stale
+
+    compile_membership(definition) returns a query yielding
+    (user_key, session_key, hit_id) of the segment's hits. Returns
+    {'computed', 'skipped', 'failed'} counts.
+    """
+    cursor = conn.cursor()
+    create_segment_sizes_table(cursor)
+    watermark = get_ingest_watermark(conn)
+    current = load_segment_sizes(conn)
+
+    summary = {'computed': 0, 'skipped': 0, 'failed': 0}
+    for definition in definitions:
+        key = segment_hash(definition)
+        if not force and key in current and not current[key]['stale']:
+            summary['skipped'] += 1
+            continue
+        try:
+            sql = compile_membership(definition)
+            if not sql or sql.lstrip().startswith('--'):
+                raise ValueError("segment has no conditions")
+            visitors, sessions, hits = count_segment(conn, sql)
+        except Exception as e:
+            print(f"Could not size segment '{definition.get('name', key[:12])}': {e}")
+            summary['failed'] += 1
+            continue
+        cursor.execute(
+            "INSERT OR REPLACE INTO segment_sizes VALUES (?, ?, ?, ?, ?, ?)",
+            (key, visitors, sessions, hits, watermark, datetime.now().isoformat(timespec='seconds'))
+        )
+        # Also seen by definitions that only differ in presentation
+        current[key] = {'stale': False}
+        summary['computed'] += 1
+
+    conn.commit()
+    return summary
+
+
+def saved_segment_definitions(conn):
+    """Definitions of every segment in the segments table"""
+    try:
+        rows = conn.execute("SELECT definition FROM segments").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    definitions = []
+    for (definition,) in rows:
+        try:
+            definitions.append(json.loads(definition) if isinstance(definition, str) else definition)
+        except (TypeError, ValueError):
+            continue
+    return definitions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize visitor/session/hit counts of saved segments")
+    parser.add_argument('--all', action='store_true', help="recompute sizes that are already up to date")
+    args = parser.parse_args()
+
+    # Segments are compiled like the library compiles them, from the project root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    from src.utils.query_builder import build_membership_sql
+
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    print("Computing saved segment sizes...")
+    summary = refresh_segment_sizes(conn, saved_segment_definitions(conn), build_membership_sql, force=args.all)
+    conn.close()
+    print(f"Computed {summary['computed']}, up to date {summary['skipped']}, failed {summary['failed']}")
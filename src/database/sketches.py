@@ -0,0 +1,386 @@
+"""
+HyperLogLog sketches for approximate unique visitor counts
+
+Sketches are precomputed per (field, value, day) for user_id and stored in
+the hll_sketches side table. The unique visitors of simple hit-level
+segments can then be estimated by merging (union) and inclusion-exclusion
+(intersection) of sketches instead of running COUNT(DISTINCT ...) over the
+matching hits.
+
+Sketches cover hits up to the hit_id recorded in meta; after a load only
+the newer hits are read and merged into the stored registers.
+"""
+
+import hashlib
+import math
+import sqlite3
+import zlib
+from itertools import combinations
+from pathlib import Path
+
+try:
+    from .result_cache import get_meta_value, set_meta_value
+except ImportError:
+    from result_cache import get_meta_value, set_meta_value
+
+# 2^12 registers -> ~1.6% standard error per sketch
+SKETCH_PRECISION = 12
+
+# Categorical hit fields worth sketching (bounded cardinality)
+SKETCH_FIELDS = [
+    'page_type', 'device_type', 'browser_name', 'country', 'city',
+    'traffic_source', 'traffic_medium', 'campaign'
+]
+
+# Inclusion-exclusion needs 2^k - 1 unions, keep k small
+MAX_INTERSECTED_CONTAINERS = 6
+
+# meta key: hit_id up to which hits are in the sketches
+SKETCHES_MARK_KEY = 'hll_sketches_mark'
+
+# Hashed users kept around while building; the cache is reset when full
+MAX_CACHED_HASHES = 1 << 20
+
+
+def _hash64(value):
+    """Stable 64-bit hash of a value"""
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _register_update(value, precision):
+    """Return (register index, rank) for a value"""
+    h = _hash64(value)
+    index = h >> (64 - precision)
+    remainder = h & ((1 << (64 - precision)) - 1)
+    rank = (64 - precision) - remainder.bit_length() + 1
+    return index, rank
+
+
+class HyperLogLog:
+    """Minimal HyperLogLog cardinality sketch"""
+
+    def __init__(self, precision=SKETCH_PRECISION, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        """Add a value to the sketch"""
+        index, rank = _register_update(value, self.precision)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Union another sketch into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def count(self):
+        """Estimate the number of distinct values added"""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # Small range correction (linear counting)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        """Standard error of the estimate relative to the true cardinality"""
+        return 1.04 / math.sqrt(self.m)
+
+    def to_blob(self):
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_blob(cls, blob, precision=SKETCH_PRECISION):
+        return cls(precision, zlib.decompress(blob))
+
+
+def create_sketch_table(cursor):
+    """Create the hll_sketches side table"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS hll_sketches (
+        field TEXT NOT NULL,
+        value TEXT NOT NULL,
+        day TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        precision INTEGER NOT NULL,
+        registers BLOB NOT NULL,
+        PRIMARY KEY (field, value, day, metric)
+    )
+    """)
+
+
+def _cached_updates(precision):
+    """_register_update with a bounded cache: each user is hashed once for every field"""
+    cache = {}
+
+    def cached_update(value):
+        update = cache.get(value)
+        if update is None:
+            if len(cache) >= MAX_CACHED_HASHES:
+                cache.clear()
+            update = cache[value] = _register_update(value, precision)
+        return update
+
+    return cached_update
+
+
+def _field_registers(conn, field, precision, cached_update, first_hit_id, last_hit_id):
+    """{(value, day): registers} of one field over hits first_hit_id < hit_id <= last_hit_id"""
+    m = 1 << precision
+    registers = {}
+    rows = conn.execute(f"""
+        SELECT date(timestamp), {field}, user_id
+        FROM hits
+        WHERE hit_id > ? AND hit_id <= ? AND {field} IS NOT NULL AND {field} != ''
+    """, (first_hit_id, last_hit_id))
+    for day, value, user_id in rows:
+        key = (str(value), day)
+        regs = registers.get(key)
+        if regs is None:
+            regs = registers[key] = bytearray(m)
+
+        index, rank = cached_update(user_id)
+        if rank > regs[index]:
+            regs[index] = rank
+    return registers
+
+
+def _max_hit_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(hit_id), 0) FROM hits").fetchone()[0]
+
+
+def build_hll_sketches(conn, fields=None, precision=SKETCH_PRECISION):
+    """Rebuild all sketches from the hits table"""
+    fields = fields or SKETCH_FIELDS
+    cursor = conn.cursor()
+    create_sketch_table(cursor)
+    cursor.execute("DELETE FROM hll_sketches")
+    last_hit_id = _max_hit_id(conn)
+    cached_update = _cached_updates(precision)
+
+    total = 0
+    for field in fields:
+        registers = _field_registers(conn, field, precision, cached_update, 0, last_hit_id)
+        cursor.executemany(
+            "INSERT INTO hll_sketches (field, value, day, metric, precision, registers) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (field, value, day, 'user_id', precision, zlib.compress(bytes(regs)))
+                for (value, day), regs in registers.items()
+            )
+        )
+        total += len(registers)
+
+    set_meta_value(cursor, SKETCHES_MARK_KEY, last_hit_id)
+    conn.commit()
+    return total
+
+
+def merge_hll_sketches(conn, precision=SKETCH_PRECISION):
+    """Merge hits added since the last build or merge into the stored sketches
+
+    HyperLogLog registers merge by maximum, so only the new hits are read.
+    Falls back to a full build without a recorded mark. Returns the number
+    of sketches written.
+    """
+    cursor = conn.cursor()
+    create_sketch_table(cursor)
+    mark = get_meta_value(conn, SKETCHES_MARK_KEY)
+    if mark is None or conn.execute(
+        "SELECT 1 FROM hll_sketches WHERE precision != ? LIMIT 1", (precision,)
+    ).fetchone():
+        return build_hll_sketches(conn, precision=precision)
+
+    first_hit_id = int(mark)
+    last_hit_id = _max_hit_id(conn)
+    cached_update = _cached_updates(precision)
+    total = 0
+    for field in SKETCH_FIELDS:
+        registers = _field_registers(conn, field, precision, cached_update, first_hit_id, last_hit_id)
+        for (value, day), regs in registers.items():
+            row = cursor.execute(
+                "SELECT registers FROM hll_sketches WHERE field = ? AND value = ? AND day = ? AND metric = 'user_id'",
+                (field, value, day)
+            ).fetchone()
+            if row is not None:
+                regs = bytearray(map(max, regs, zlib.decompress(row[0])))
+            cursor.execute(
+                "INSERT OR REPLACE INTO hll_sketches (field, value, day, metric, precision, registers) "
+                "VALUES (?, ?, ?, 'user_id', ?, ?)",
+                (field, value, day, precision, zlib.compress(bytes(regs)))
+            )
+        total += len(registers)
+
+    set_meta_value(cursor, SKETCHES_MARK_KEY, last_hit_id)
+    conn.commit()
+    return total
+
+
+def _load_sketch(conn, field, value, metric, start_day=None, end_day=None):
+    """Merge the daily sketches of one field value into a single sketch"""
+    query = """
+        SELECT precision, registers FROM hll_sketches
+        WHERE field = ? AND value = ? AND metric = ?
+    """
+    params = [field, str(value), metric]
+    if start_day:
+        query += " AND day >= ?"
+        params.append(str(start_day))
+    if end_day:
+        query += " AND day <= ?"
+        params.append(str(end_day))
+
+    sketch = None
+    for precision, blob in conn.execute(query, params):
+        day_sketch = HyperLogLog.from_blob(blob, precision)
+        sketch = day_sketch if sketch is None else sketch.merge(day_sketch)
+    return sketch or HyperLogLog()
+
+
+def is_sketchable_segment(segment_definition):
+    """Check whether a segment can be answered from sketches alone
+
+    Only top-level include hit containers of 'equals' conditions on sketched
+    fields qualify. Multiple conditions in one container must be OR-ed, since
+    an AND across fields would need both values on the same hit.
+    """
+    containers = segment_definition.get('containers', [])
+    if not containers or len(containers) > MAX_INTERSECTED_CONTAINERS:
+        return False
+
+    for container in containers:
+        if container.get('type', 'hit') != 'hit' or not container.get('include', True):
+            return False
+        if container.get('children'):
+            return False
+
+        conditions = container.get('conditions', [])
+        if not conditions:
+            return False
+        if len(conditions) > 1 and container.get('logic', 'and').lower() != 'or':
+            return False
+
+        for condition in conditions:
+            if condition.get('field') not in SKETCH_FIELDS:
+                return False
+            if condition.get('operator', 'equals') != 'equals' or condition.get('value') in (None, ''):
+                return False
+
+    return True
+
+
+def _container_sketch(conn, container, metric, start_day, end_day):
+    sketch = HyperLogLog()
+    for condition in container.get('conditions', []):
+        sketch.merge(_load_sketch(conn, condition['field'], condition['value'], metric, start_day, end_day))
+    return sketch
+
+
+def _estimate_combination(sketches, logic):
+    """Estimate |union| or |intersection| of sketches with a standard error"""
+    rel = sketches[0].relative_error
+
+    if logic == 'or' or len(sketches) == 1:
+        union = sketches[0].copy()
+        for sketch in sketches[1:]:
+            union.merge(sketch)
+        estimate = union.count()
+        return estimate, rel * estimate
+
+    # Inclusion-exclusion: |A n B n ...| = sum over subsets of (-1)^(k+1) |union of subset|
+    estimate = 0
+    variance = 0.0
+    for k in range(1, len(sketches) + 1):
+        for subset in combinations(sketches, k):
+            union = subset[0].copy()
+            for sketch in subset[1:]:
+                union.merge(sketch)
+            size = union.count()
+            estimate += size if k % 2 else -size
+            variance += (rel * size) ** 2
+
+    upper = min(s.count() for s in sketches)
+    estimate = max(0, min(estimate, upper))
+    return estimate, math.sqrt(variance)
+
+
+def segment_hit_filter(segment_definition):
+    """WHERE clause and parameters for the hits matching a sketchable segment's conditions
+
+    Every such hit belongs to the segment (its user matches the containers),
+    so the newest of them make cheap sample rows without evaluating the
+    segment. Under AND logic a hit must match every container itself.
+    """
+    container_clauses, params = [], []
+    for container in segment_definition.get('containers', []):
+        conditions = container.get('conditions', [])
+        container_clauses.append("(" + " OR ".join(f"{c['field']} = ?" for c in conditions) + ")")
+        params.extend(str(c['value']) for c in conditions)
+    joiner = " OR " if segment_definition.get('logic', 'and').lower() == 'or' else " AND "
+    return joiner.join(container_clauses), params
+
+
+def estimate_segment_uniques(conn, segment_definition, start_day=None, end_day=None, max_users=None):
+    """Estimate unique users of a simple hit-level segment
+
+    A segment selects every hit of the users that match its containers, so
+    its unique users are the users in the matching sketches. Its sessions
+    are all sessions of those users, not just the ones with a matching hit,
+    so they are not estimated.
+
+    Returns None when the segment is not sketchable or no sketches exist.
+    Error bounds are reported at ~95% confidence (two standard errors) and,
+    like the estimate, clamped to max_users (the number of users) if given.
+    """
+    if not is_sketchable_segment(segment_definition):
+        return None
+
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='hll_sketches'"
+    ).fetchone()
+    if not exists or not conn.execute("SELECT 1 FROM hll_sketches LIMIT 1").fetchone():
+        return None
+
+    logic = segment_definition.get('logic', 'and').lower()
+    containers = segment_definition.get('containers', [])
+
+    result = {
+        'estimate': True,
+        'method': 'hyperloglog',
+        'precision': SKETCH_PRECISION,
+        'relative_error': round(HyperLogLog().relative_error, 4),
+        'confidence': 0.95
+    }
+    sketches = [_container_sketch(conn, c, 'user_id', start_day, end_day) for c in containers]
+    estimate, std_error = _estimate_combination(sketches, logic)
+    error = int(math.ceil(2 * std_error))
+    lower, upper = max(0, estimate - error), estimate + error
+    if max_users is not None:
+        estimate, lower, upper = min(estimate, max_users), min(lower, max_users), min(upper, max_users)
+    result['unique_users'] = estimate
+    result['unique_users_error'] = error
+    result['unique_users_lower'] = lower
+    result['unique_users_upper'] = upper
+
+    return result
+
+
+if __name__ == "__main__":
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    print("Building HyperLogLog sketches...")
+    count = build_hll_sketches(conn)
+    conn.close()
+    print(f"Stored {count:,} sketches in {db_path}")
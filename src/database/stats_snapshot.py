@@ -0,0 +1,148 @@
+"""
+Precomputed database statistics snapshot
+
+The totals and breakdowns shown by /api/database/stats and the Streamlit
+home page need several full scans of hits. They are computed once per data
+load and stored as JSON in the single-row stats_snapshot table, tagged with
+the hits ingest watermark so readers can tell when a snapshot is stale and
+trigger a background refresh while still serving the previous numbers.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+try:
+    from .result_cache import get_ingest_watermark
+except ImportError:
+    from result_cache import get_ingest_watermark
+
+DB_PATH = Path("data/analytics.db")
+
+_refresh_lock = threading.Lock()
+
+
+def create_stats_snapshot_table(cursor):
+    """Create the single-row stats_snapshot table"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_snapshot (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        computed_at TEXT NOT NULL,
+        ingest_watermark INTEGER NOT NULL,
+        stats TEXT NOT NULL
+    )
+    """)
+
+
+def _breakdown(cursor, field, limit=None):
+    query = f"""
+        SELECT {field}, COUNT(*) as count
+        FROM hits
+        WHERE {field} IS NOT NULL AND {field} != ''
+        GROUP BY {field}
+        ORDER BY count DESC
+    """
+    if limit:
+        query += f" LIMIT {limit}"
+    return [{field: row[0], "count": row[1]} for row in cursor.execute(query)]
+
+
+def compute_database_stats(conn):
+    """Run the full-table aggregations behind the stats snapshot"""
+    cursor = conn.cursor()
+
+    # Totals and revenue share one scan
+    cursor.execute("""
+        SELECT COUNT(*),
+               COUNT(DISTINCT user_key),
+               COUNT(DISTINCT session_key),
+               SUM(revenue),
+               AVG(revenue),
+               COUNT(CASE WHEN revenue > 0 THEN 1 END)
+        FROM hits
+    """)
+    total_hits, total_users, total_sessions, total_revenue, avg_revenue, revenue_hits = cursor.fetchone()
+
+    return {
+        "total_hits": total_hits or 0,
+        "total_users": total_users or 0,
+        "total_sessions": total_sessions or 0,
+        "device_breakdown": _breakdown(cursor, "device_type"),
+        "browser_breakdown": _breakdown(cursor, "browser_name", 10),
+        "country_breakdown": _breakdown(cursor, "country", 10),
+        "revenue_stats": {
+            "total_revenue": float(total_revenue) if total_revenue else 0.0,
+            "avg_revenue": float(avg_revenue) if avg_revenue else 0.0,
+            "revenue_hits": revenue_hits or 0
+        }
+    }
+
+
+def refresh_stats_snapshot(conn):
+    """Recompute and store the snapshot; returns it as load_stats_snapshot would"""
+    watermark = get_ingest_watermark(conn)
+    stats = compute_database_stats(conn)
+    computed_at = datetime.now().isoformat(timespec='seconds')
+
+    cursor = conn.cursor()
+    create_stats_snapshot_table(cursor)
+    cursor.execute(
+        "INSERT OR REPLACE INTO stats_snapshot (id, computed_at, ingest_watermark, stats) VALUES (1, ?, ?, ?)",
+        (computed_at, watermark, json.dumps(stats))
+    )
+    conn.commit()
+    return dict(stats, computed_at=computed_at, stale=False)
+
+
+def load_stats_snapshot(conn):
+    """Stored snapshot with computed_at and a stale flag, or None if there is none"""
+    try:
+        row = conn.execute("SELECT computed_at, ingest_watermark, stats FROM stats_snapshot WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if not row:
+        return None
+    computed_at, watermark, stats = row
+    return dict(json.loads(stats), computed_at=computed_at, stale=watermark != get_ingest_watermark(conn))
+
+
+def _refresh_in_background(db_path):
+    try:
+        conn = sqlite3.connect(str(db_path))
+        try:
+            refresh_stats_snapshot(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Stats snapshot refresh failed: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def refresh_stats_snapshot_async(db_path=DB_PATH):
+    """Refresh the snapshot on a daemon thread; no-op if one is already running"""
+    if not _refresh_lock.acquire(blocking=False):
+        return None
+    thread = threading.Thread(target=_refresh_in_background, args=(db_path,), daemon=True)
+    thread.start()
+    return thread
+
+
+def get_stats_snapshot(conn, db_path=DB_PATH):
+    """Snapshot for display: computed inline only the first time, refreshed in the background when stale"""
+    snapshot = load_stats_snapshot(conn)
+    if snapshot is None:
+        return refresh_stats_snapshot(conn)
+    if snapshot["stale"]:
+        refresh_stats_snapshot_async(db_path)
+    return snapshot
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(str(DB_PATH))
+    print("Refreshing database statistics snapshot...")
+    snapshot = refresh_stats_snapshot(conn)
+    conn.close()
+    print(f"Snapshot of {snapshot['total_hits']:,} hits stored at {snapshot['computed_at']}")
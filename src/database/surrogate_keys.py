@@ -0,0 +1,162 @@
+"""
+Integer surrogate keys for users and sessions
+
+user_id and session_id are long TEXT values repeated on every hit. Each one
+is dictionary-encoded to a compact INTEGER (user_key / session_key) kept in
+the user_keys and session_keys mapping tables. Hits, sessions and users carry
+the integer keys, hits are indexed on them instead of the text ids, and the
+segment compilers join and filter on the integers. The text ids stay
+available through the mapping tables and the original columns for display.
+"""
+
+import sqlite3
+from pathlib import Path
+
+try:
+    from .partitions import hits_storage_tables, is_compact, is_partitioned, rebuild_hits_view
+    from .result_cache import bump_ingest_watermark
+except ImportError:
+    from partitions import hits_storage_tables, is_compact, is_partitioned, rebuild_hits_view
+    from result_cache import bump_ingest_watermark
+
+# (table, key column, text column) for every table carrying keys
+KEYED_TABLES = [
+    ('sessions', 'session_key', 'session_id'),
+    ('sessions', 'user_key', 'user_id'),
+    ('users', 'user_key', 'user_id')
+]
+
+
+def create_key_tables(cursor):
+    """Create the user_keys and session_keys mapping tables"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_keys (
+        user_key INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL UNIQUE
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS session_keys (
+        session_key INTEGER PRIMARY KEY,
+        session_id TEXT NOT NULL UNIQUE,
+        user_key INTEGER NOT NULL
+    )
+    """)
+
+
+def next_surrogate_keys(conn):
+    """First unused (user_key, session_key) for keys assigned at ingest"""
+    create_key_tables(conn.cursor())
+    user_key = conn.execute("SELECT COALESCE(MAX(user_key), 0) + 1 FROM user_keys").fetchone()[0]
+    session_key = conn.execute("SELECT COALESCE(MAX(session_key), 0) + 1 FROM session_keys").fetchone()[0]
+    return user_key, session_key
+
+
+def register_surrogate_keys(conn, user_rows, session_rows):
+    """Record keys assigned at ingest
+
+    user_rows are (user_key, user_id) and session_rows are
+    (session_key, session_id, user_key) tuples.
+    """
+    cursor = conn.cursor()
+    create_key_tables(cursor)
+    cursor.executemany("INSERT OR REPLACE INTO user_keys (user_key, user_id) VALUES (?, ?)", user_rows)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO session_keys (session_key, session_id, user_key) VALUES (?, ?, ?)",
+        session_rows
+    )
+
+
+def _columns(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+
+def _encode_hits_table(cursor, table):
+    """Assign keys to unmapped ids in one hits storage table and backfill them"""
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO user_keys (user_id)
+        SELECT DISTINCT user_id FROM {table} WHERE user_key IS NULL ORDER BY user_id
+    """)
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO session_keys (session_id, user_key)
+        SELECT t.session_id, k.user_key
+        FROM (SELECT session_id, MIN(user_id) AS user_id FROM {table}
+              WHERE session_key IS NULL GROUP BY session_id) AS t
+        JOIN user_keys k ON k.user_id = t.user_id
+        ORDER BY t.session_id
+    """)
+    cursor.execute(f"""
+        UPDATE {table} SET
+            user_key = (SELECT user_key FROM user_keys WHERE user_keys.user_id = {table}.user_id),
+            session_key = (SELECT session_key FROM session_keys WHERE session_keys.session_id = {table}.session_id)
+        WHERE user_key IS NULL OR session_key IS NULL
+    """)
+
+
+def encode_surrogate_keys(conn):
+    """Add, backfill and index the integer keys on an existing database
+
+    Safe to call repeatedly: only rows still missing keys are touched, so it
+    also picks up hits loaded by ingest paths that do not assign keys.
+    """
+    cursor = conn.cursor()
+    create_key_tables(cursor)
+    added = backfilled = False
+
+    for table in hits_storage_tables(conn):
+        columns = _columns(cursor, table)
+        for column in ('user_key', 'session_key'):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+                added = True
+
+        index_suffix = table[len('hits'):]
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_hits_user_key{index_suffix} ON {table}(user_key)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_hits_session_key{index_suffix} ON {table}(session_key)")
+
+        if cursor.execute(
+            f"SELECT 1 FROM {table} WHERE user_key IS NULL OR session_key IS NULL LIMIT 1"
+        ).fetchone():
+            _encode_hits_table(cursor, table)
+            backfilled = True
+
+        # The text indexes are superseded by the integer ones
+        cursor.execute(f"DROP INDEX IF EXISTS idx_hits_user_id{index_suffix}")
+        cursor.execute(f"DROP INDEX IF EXISTS idx_hits_session_id{index_suffix}")
+
+    for table, key_column, id_column in KEYED_TABLES:
+        if key_column not in _columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {key_column} INTEGER")
+        mapping = 'session_keys' if key_column == 'session_key' else 'user_keys'
+        if cursor.execute(f"SELECT 1 FROM {table} WHERE {key_column} IS NULL LIMIT 1").fetchone():
+            backfilled = True
+            cursor.execute(f"""
+                UPDATE {table} SET {key_column} = (
+                    SELECT {key_column} FROM {mapping} WHERE {mapping}.{id_column} = {table}.{id_column}
+                )
+                WHERE {key_column} IS NULL
+            """)
+
+    # Compact rollup tables are clustered on their key already
+    if not is_compact(conn):
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_session_key ON sessions(session_key)")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_key ON users(user_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_key ON sessions(user_key)")
+
+    if added and is_partitioned(conn):
+        rebuild_hits_view(conn)
+    conn.commit()
+    if added or backfilled:
+        bump_ingest_watermark(conn)
+
+
+if __name__ == "__main__":
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    print("Encoding user and session ids as integer keys...")
+    encode_surrogate_keys(conn)
+    users = conn.execute("SELECT COUNT(*) FROM user_keys").fetchone()[0]
+    sessions = conn.execute("SELECT COUNT(*) FROM session_keys").fetchone()[0]
+    conn.close()
+    print(f"Mapped {users:,} users and {sessions:,} sessions in {db_path}")
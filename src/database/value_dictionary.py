@@ -0,0 +1,254 @@
+"""
+Precomputed value dictionary for field value pickers
+
+field_values holds every distinct value of the categorical fields with its
+hit count, rebuilt after each data load. Top values of a field come straight
+off the (field, count) index and autocomplete prefixes are a range scan on a
+lowercased search key, instead of a GROUP BY over all hits per request. The
+same table answers "does this value occur at all?" for the empty-preview
+diagnostics, with close matches as suggestions.
+
+Hit counts cover hits up to the hit_id recorded in meta; after a load the
+counts of the newer hits are added on top (merge_value_dictionary).
+"""
+
+import difflib
+import sqlite3
+from pathlib import Path
+
+try:
+    from .result_cache import get_meta_value, set_meta_value
+except ImportError:
+    from result_cache import get_meta_value, set_meta_value
+
+# field -> table holding it
+VALUE_FIELDS = {
+    'page_type': 'hits',
+    'page_url': 'hits',
+    'page_title': 'hits',
+    'device_type': 'hits',
+    'browser_name': 'hits',
+    'browser_version': 'hits',
+    'country': 'hits',
+    'city': 'hits',
+    'traffic_source': 'hits',
+    'traffic_medium': 'hits',
+    'campaign': 'hits',
+    'user_type': 'users'
+}
+
+# meta key: hit_id up to which hits are counted in field_values
+VALUE_DICTIONARY_MARK_KEY = 'field_values_mark'
+
+
+def create_value_dictionary_table(cursor):
+    """Create the field_values table and its lookup indexes"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS field_values (
+        field TEXT NOT NULL,
+        value TEXT NOT NULL,
+        search_key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (field, value)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_values_count ON field_values(field, count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_values_search ON field_values(field, search_key)")
+
+
+def _rebuild_field(cursor, field):
+    table = VALUE_FIELDS[field]
+    cursor.execute("DELETE FROM field_values WHERE field = ?", (field,))
+    cursor.execute(f"""
+        INSERT INTO field_values (field, value, search_key, count)
+        SELECT ?, CAST({field} AS TEXT), lower(CAST({field} AS TEXT)), COUNT(*)
+        FROM {table}
+        WHERE {field} IS NOT NULL AND {field} != ''
+        GROUP BY {field}
+    """, (field,))
+    return cursor.rowcount
+
+
+def _max_hit_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(hit_id), 0) FROM hits").fetchone()[0]
+
+
+def build_value_dictionary(conn, fields=None):
+    """Rebuild the dictionary for the given fields (all by default)"""
+    cursor = conn.cursor()
+    create_value_dictionary_table(cursor)
+    last_hit_id = _max_hit_id(conn)
+
+    total = 0
+    for field in fields or VALUE_FIELDS:
+        total += _rebuild_field(cursor, field)
+
+    # Partial rebuilds leave the other fields' counts where they were
+    if not fields:
+        set_meta_value(cursor, VALUE_DICTIONARY_MARK_KEY, last_hit_id)
+    conn.commit()
+    return total
+
+
+def merge_value_dictionary(conn):
+    """Add the values of hits loaded since the last build or merge
+
+    Counts of hit fields are incremented from the new hits only, in the same
+    transaction that moves the mark, so a merge never counts a hit twice.
+    Fields of other tables are small and rebuilt. Falls back to a full build
+    without a recorded mark. Returns the number of values written.
+    """
+    mark = get_meta_value(conn, VALUE_DICTIONARY_MARK_KEY)
+    if mark is None:
+        return build_value_dictionary(conn)
+
+    cursor = conn.cursor()
+    create_value_dictionary_table(cursor)
+    first_hit_id = int(mark)
+    last_hit_id = _max_hit_id(conn)
+
+    total = 0
+    for field, table in VALUE_FIELDS.items():
+        if table != 'hits':
+            total += _rebuild_field(cursor, field)
+            continue
+        cursor.execute(f"""
+            INSERT INTO field_values (field, value, search_key, count)
+            SELECT ?, CAST({field} AS TEXT), lower(CAST({field} AS TEXT)), COUNT(*)
+            FROM hits
+            WHERE hit_id > ? AND hit_id <= ? AND {field} IS NOT NULL AND {field} != ''
+            GROUP BY {field}
+            ON CONFLICT(field, value) DO UPDATE SET count = count + excluded.count
+        """, (field, first_hit_id, last_hit_id))
+        total += cursor.rowcount
+
+    set_meta_value(cursor, VALUE_DICTIONARY_MARK_KEY, last_hit_id)
+    conn.commit()
+    return total
+
+
+def has_value_dictionary(conn, field):
+    """True when field is covered by a built dictionary"""
+    if field not in VALUE_FIELDS:
+        return False
+    try:
+        return conn.execute("SELECT 1 FROM field_values WHERE field = ? LIMIT 1", (field,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+def lookup_values(conn, field, prefix=None, limit=50):
+    """[(value, count)] most frequent first, optionally filtered by a case-insensitive prefix
+
+    Returns None when the field has no dictionary, so callers can fall back
+    to querying the source table.
+    """
+    if not has_value_dictionary(conn, field):
+        return None
+
+    if prefix:
+        low = prefix.lower()
+        rows = conn.execute("""
+            SELECT value, count FROM field_values
+            WHERE field = ? AND search_key >= ? AND search_key < ?
+            ORDER BY count DESC, value
+            LIMIT ?
+        """, (field, low, low + '\U0010ffff', limit))
+    else:
+        rows = conn.execute("""
+            SELECT value, count FROM field_values
+            WHERE field = ?
+            ORDER BY count DESC
+            LIMIT ?
+        """, (field, limit))
+    return rows.fetchall()
+
+
+# Operators whose matching values can be found in the dictionary, as a LIKE
+# pattern over the value (SQLite LIKE is case-insensitive, as in segment SQL)
+_LIKE_PATTERNS = {
+    'contains': '%{}%',
+    'starts with': '{}%',
+    'ends with': '%{}'
+}
+
+# Preview compiler spellings (query_builder.build_condition_sql) -> API spellings
+_OPERATOR_ALIASES = {
+    'not_equals': 'does not equal',
+    'not_contains': 'does not contain',
+    'starts_with': 'starts with',
+    'ends_with': 'ends with'
+}
+
+# Negated operator -> the operator whose matches it excludes
+_NEGATED_OPERATORS = {
+    'does not equal': 'equals',
+    'does not contain': 'contains'
+}
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# Close-match candidates per field, most frequent first
+MAX_SUGGESTION_CANDIDATES = 2000
+
+
+def matching_hits(conn, field, operator, value):
+    """Number of rows whose field matches operator/value, or None if the dictionary can't tell"""
+    if not has_value_dictionary(conn, field):
+        return None
+    value = str(value)
+    operator = _OPERATOR_ALIASES.get(operator, operator)
+    positive = _NEGATED_OPERATORS.get(operator, operator)
+    if positive == 'equals':
+        row = conn.execute("SELECT count FROM field_values WHERE field = ? AND value = ?", (field, value)).fetchone()
+        matched = row[0] if row else 0
+    elif positive in _LIKE_PATTERNS:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM field_values WHERE field = ? AND value LIKE ? ESCAPE '\\'",
+            (field, _LIKE_PATTERNS[positive].format(_escape_like(value)))
+        ).fetchone()
+        matched = row[0]
+    else:
+        return None
+
+    if operator in _NEGATED_OPERATORS:
+        total = conn.execute("SELECT SUM(count) FROM field_values WHERE field = ?", (field,)).fetchone()[0]
+        return (total or 0) - matched
+    return matched
+
+
+def suggest_values(conn, field, value, limit=3):
+    """Existing values of field that look like value: case-insensitive matches first, then close matches"""
+    if not has_value_dictionary(conn, field):
+        return []
+    value = str(value)
+    suggestions = [
+        row[0] for row in conn.execute(
+            "SELECT value FROM field_values WHERE field = ? AND search_key = ? ORDER BY count DESC",
+            (field, value.lower())
+        ) if row[0] != value
+    ]
+
+    candidates = [row[0] for row in conn.execute(
+        "SELECT value FROM field_values WHERE field = ? ORDER BY count DESC LIMIT ?",
+        (field, MAX_SUGGESTION_CANDIDATES)
+    )]
+    by_key = {}
+    for candidate in candidates:
+        by_key.setdefault(candidate.lower(), candidate)
+    for key in difflib.get_close_matches(value.lower(), list(by_key), n=limit, cutoff=0.6):
+        if by_key[key] != value and by_key[key] not in suggestions:
+            suggestions.append(by_key[key])
+    return suggestions[:limit]
+
+
+if __name__ == "__main__":
+    db_path = Path("data/analytics.db")
+    conn = sqlite3.connect(str(db_path))
+    print("Building field value dictionary...")
+    count = build_value_dictionary(conn)
+    conn.close()
+    print(f"Stored {count:,} field values in {db_path}")
@@ -0,0 +1,147 @@
+"""
+Background warm-up of saved segments after startup
+
+Right after a deploy every saved segment would otherwise be evaluated cold
+by the first user who opens it. warm_saved_segments() compiles each saved
+segment, reads the indexes its query plan uses so their pages are in the
+OS/SQLite cache, and lets the caller precompute the segment's result into
+its result cache. start_warmup() runs it on a daemon thread with at most
+max_workers segments in flight, so readiness is never delayed.
+
+Settings come from the warmup section of config.yaml:
+    warmup:
+      enabled: true
+      max_workers: 2
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+try:
+    from .index_advisor import explain, load_saved_segments
+except ImportError:
+    from index_advisor import explain, load_saved_segments
+
+DB_PATH = Path("data/analytics.db")
+CONFIG_PATH = Path(__file__).resolve().parents[2] / "config.yaml"
+
+DEFAULT_SETTINGS = {'enabled': True, 'max_workers': 2}
+
+_USING_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+_warmup_lock = threading.Lock()
+
+
+def warmup_settings(config_path=CONFIG_PATH):
+    """warmup section of config.yaml merged over the defaults"""
+    try:
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f) or {}
+    except Exception:
+        config = {}
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get('warmup') or {})
+    settings['max_workers'] = max(1, int(settings['max_workers']))
+    return settings
+
+
+def used_indexes(conn, sql):
+    """{index: table} for every index in a query's plan"""
+    names = set()
+    for detail in explain(conn, sql):
+        names.update(_USING_INDEX.findall(detail))
+    if not names:
+        return {}
+    placeholders = ', '.join('?' for _ in names)
+    rows = conn.execute(
+        f"SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name IN ({placeholders})",
+        sorted(names)
+    )
+    return dict(rows.fetchall())
+
+
+def warm_indexes(conn, indexes):
+    """Walk each index once so its pages are cached"""
+    for index, table in indexes.items():
+        try:
+            conn.execute(f"SELECT COUNT(*) FROM {table} INDEXED BY {index}").fetchone()
+        except sqlite3.Error as e:
+            # e.g. a partial index that cannot serve a plain count
+            print(f"Could not warm index {index}: {e}")
+
+
+def warm_saved_segments(compile_segment, warm_segment=None, db_path=DB_PATH, max_workers=2):
+    """Warm every saved segment, at most max_workers at a time
+
+    compile_segment(definition) returns the segment's SQL;
+    warm_segment(segment) (optional) precomputes its cached result, where
+    segment is {'name', 'definition', 'sql'}. Returns a summary dict.
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(str(db_path))
+    try:
+        segments = load_saved_segments(conn, compile_segment)
+
+        # Each index is read once even if many segments use it
+        indexes = {}
+        for segment in segments:
+            try:
+                indexes.update(used_indexes(conn, segment['sql']))
+            except sqlite3.Error as e:
+                print(f"Could not plan segment '{segment['name']}': {e}")
+        warm_indexes(conn, indexes)
+    finally:
+        conn.close()
+
+    failed = []
+
+    def warm(segment):
+        try:
+            warm_segment(segment)
+        except Exception as e:
+            failed.append(segment['name'])
+            print(f"Could not warm segment '{segment['name']}': {e}")
+
+    if warm_segment is not None:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(warm, segments))
+
+    return {
+        'segments': len(segments),
+        'indexes': sorted(indexes),
+        'failed': failed,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def _run_warmup(compile_segment, warm_segment, db_path, max_workers):
+    try:
+        summary = warm_saved_segments(compile_segment, warm_segment, db_path, max_workers)
+        print(f"Warmed {summary['segments']} saved segments and {len(summary['indexes'])} indexes "
+              f"in {summary['seconds']}s")
+    except Exception as e:
+        print(f"Segment warm-up failed: {e}")
+    finally:
+        _warmup_lock.release()
+
+
+def start_warmup(compile_segment, warm_segment=None, db_path=DB_PATH, settings=None):
+    """Run warm_saved_segments on a daemon thread; no-op if disabled or already running"""
+    settings = settings or warmup_settings()
+    if not settings['enabled'] or not Path(db_path).exists():
+        return None
+    if not _warmup_lock.acquire(blocking=False):
+        return None
+    thread = threading.Thread(
+        target=_run_warmup,
+        args=(compile_segment, warm_segment, db_path, settings['max_workers']),
+        daemon=True
+    )
+    thread.start()
+    return thread
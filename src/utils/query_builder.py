@@ -5,16 +5,14 @@ from typing import Dict, List, Any, Optional, Tuple
 import json
 import uuid
 from datetime import datetime
-import yaml
 from pathlib import Path
 
-# Load configuration for field mappings
-CONFIG_PATH = Path(__file__).resolve().parents[2] / "config.yaml"
-try:
-    with open(CONFIG_PATH, "r") as f:
-        _CONFIG = yaml.safe_load(f)
-except Exception:
-    _CONFIG = {}
+from src.database.sampling import sample_filter_sql
+from src.database.partitions import apply_date_range
+from src.utils.streamlit_cache import CONFIG_PATH, load_config
+
+# Load configuration for field mappings (parsed once per process)
+_CONFIG = load_config()
 
 
 def _build_field_table_map(cfg):
@@ -948,14 +946,45 @@ def get_max_nesting_depth(containers: List[Dict]) -> int:
     return max_depth
 
 
-def build_sql_query(segment_definition: Dict) -> str:
+def build_sql_query(segment_definition: Dict, sample_rate: Optional[float] = None,
+                    date_range: Optional[Tuple] = None, partition_catalog: Optional[List] = None) -> str:
     """
     Build SQL query from segment definition with nested container support
+
+    With sample_rate, only hits of the deterministic user sample are scanned.
+    With date_range (inclusive start/end dates), every hits reference is
+    restricted to the range and pruned to the overlapping monthly partitions
+    listed in partition_catalog (see src/database/partitions.py).
     """
     if not segment_definition or not segment_definition.get('containers'):
         return "-- No segment definition provided"
 
-    # Extract basic info
+    where_clause = build_where_clause(segment_definition, sample_rate)
+
+    # Build final query
+    query = f"""
+    SELECT 
+        user_id,
+        COUNT(*) as hit_count,
+        COUNT(DISTINCT session_key) as session_count,
+        MIN(timestamp) as first_hit,
+        MAX(timestamp) as last_hit
+    FROM hits 
+    WHERE {where_clause}
+    GROUP BY user_key
+    ORDER BY hit_count DESC
+    """
+
+    if date_range:
+        query = apply_date_range(query, date_range, partition_catalog)
+
+    return query.strip()
+
+
+def build_where_clause(segment_definition: Dict, sample_rate: Optional[float] = None) -> str:
+    """
+    Build the hit-level WHERE clause shared by the segment queries
+    """
     containers = segment_definition.get('containers', [])
     segment_logic = segment_definition.get('logic', 'and').upper()
 
@@ -973,20 +1002,32 @@ def build_sql_query(segment_definition: Dict) -> str:
     else:
         where_clause = "1=1"
 
-    # Build final query
+    if sample_rate:
+        where_clause = f"{sample_filter_sql(sample_rate)} AND ({where_clause})"
+
+    return where_clause
+
+
+def build_membership_sql(segment_definition: Dict, date_range: Optional[Tuple] = None,
+                         partition_catalog: Optional[List] = None) -> str:
+    """
+    Build SQL listing (user_key, session_key, hit_id) of every matching hit
+
+    Used to evaluate a segment once into membership sets for overlap
+    comparisons (see src/database/overlap.py).
+    """
+    if not segment_definition or not segment_definition.get('containers'):
+        return "-- No segment definition provided"
+
     query = f"""
-    SELECT 
-        user_id,
-        COUNT(*) as hit_count,
-        COUNT(DISTINCT session_id) as session_count,
-        MIN(timestamp) as first_hit,
-        MAX(timestamp) as last_hit
-    FROM hits 
-    WHERE {where_clause}
-    GROUP BY user_id
-    ORDER BY hit_count DESC
+    SELECT user_key, session_key, hit_id
+    FROM hits
+    WHERE {build_where_clause(segment_definition)}
     """
 
+    if date_range:
+        query = apply_date_range(query, date_range, partition_catalog)
+
     return query.strip()
 
 
@@ -1024,10 +1065,10 @@ def build_container_sql(container: Dict, level: int = 0) -> str:
     # Apply container-specific logic
     if container_type == 'visit':
         # Visit-level container: conditions must be met within the same session
-        combined_sql = f"session_id IN (SELECT session_id FROM hits WHERE {combined_sql})"
+        combined_sql = f"session_key IN (SELECT session_key FROM hits WHERE {combined_sql})"
     elif container_type == 'visitor':
         # Visitor-level container: conditions must be met by the same user
-        combined_sql = f"user_id IN (SELECT user_id FROM hits WHERE {combined_sql})"
+        combined_sql = f"user_key IN (SELECT user_key FROM hits WHERE {combined_sql})"
 
     # Handle include/exclude
     if not include:
@@ -1786,8 +1827,10 @@ def render_query_builder(segment_definition: Dict):
     render_query_preview(segment_definition)
 
 
-def build_sql_from_segment(segment_definition: Dict) -> str:
+def build_sql_from_segment(segment_definition: Dict, sample_rate: Optional[float] = None,
+                           date_range: Optional[Tuple] = None, partition_catalog: Optional[List] = None) -> str:
     """
     Build SQL from segment definition (alias for build_sql_query for backward compatibility)
     """
-    return build_sql_query(segment_definition)
\ No newline at end of file
+    return build_sql_query(segment_definition, sample_rate=sample_rate,
+                           date_range=date_range, partition_catalog=partition_catalog)
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Streamlit caching across reruns
+
+Every widget click reruns the whole script. Process-wide resources (the
+database connection and config.yaml) are created once with st.cache_resource,
+and data read from the database (stats, saved segments) is cached with
+st.cache_data keyed by the database version, so a rerun costs one cheap
+version check instead of reconnecting and rescanning. The TTL bounds how long
+an entry can outlive a change the version does not see.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+
+import streamlit as st
+import yaml
+
+from src.database.result_cache import preview_cache
+
+DB_PATH = Path("data/analytics.db")
+CONFIG_PATH = Path(__file__).resolve().parents[2] / "config.yaml"
+
+DATA_TTL_SECONDS = 300
+
+
+@st.cache_resource
+def load_config():
+    """Parsed config.yaml, read once per process"""
+    try:
+        with open(CONFIG_PATH, "r") as f:
+            return yaml.safe_load(f) or {}
+    except Exception:
+        return {}
+
+
+@st.cache_resource
+def get_connection(db_path=str(DB_PATH)):
+    """Shared read connection; use it under connection_lock()"""
+    return sqlite3.connect(db_path, check_same_thread=False)
+
+
+@st.cache_resource
+def connection_lock(db_path=str(DB_PATH)):
+    """Serializes use of the shared connection across sessions"""
+    return threading.Lock()
+
+
+def database_version():
+    """Changes whenever any connection commits or new hits are loaded"""
+    return preview_cache.token()
+
+
+@st.cache_data(ttl=DATA_TTL_SECONDS, max_entries=8, show_spinner=False)
+def cached_query(name, version, _compute):
+    """Result of _compute(conn) for this database version
+
+    name identifies the computation; _compute is not hashed, so it must be
+    the same function for a given name.
+    """
+    with connection_lock():
+        return _compute(get_connection())
+
+
+def clear_data_cache():
+    """Drop cached data, e.g. after this session wrote to the database"""
+    cached_query.clear()